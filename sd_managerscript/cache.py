@@ -0,0 +1,160 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from collections.abc import Hashable
+from typing import Any
+
+from graphql import DocumentNode
+from graphql import FieldNode
+from graphql import OperationDefinitionNode
+
+from .operations import lookup_operation
+from .operations import Operation
+
+
+def operation_name(document: Any) -> str:
+    """
+    Name of a GraphQL operation used to look up its cache TTL.
+
+    This is the registered name of the operation (see `operations.operation`),
+    e.g. "QUERY_ENGAGEMENTS". Unregistered documents are named by their operation
+    name if they have one, and otherwise by their first root field.
+    """
+    if not isinstance(document, Operation):
+        document = lookup_operation(document) or document
+    if isinstance(document, Operation):
+        return document.name
+    if not isinstance(document, DocumentNode):
+        return ""
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        if definition.name is not None:
+            return definition.name.value
+        for selection in definition.selection_set.selections:
+            if isinstance(selection, FieldNode):
+                return selection.name.value
+    return ""
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "tags")
+
+    def __init__(self, value: dict, expires: float, tags: set[str]) -> None:
+        self.value = value
+        self.expires = expires
+        self.tags = tags
+
+
+class ReadCache:
+    """
+    Cross-run cache of GraphQL query results with TTL and LRU eviction.
+
+    Results are cached per operation and variables (see `util.query_key`) for the
+    TTL of the operation, and the least recently used results are evicted when
+    the cache holds `maxsize` results. Each result is tagged with the UUIDs found
+    in its variables and data, and `invalidate` forgets the results tagged with
+    any of the given UUIDs. A TTL of 0 disables caching of an operation.
+
+    The cache is plugged into the query layer through `util.query_scope`.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        ttls: dict[str, float] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            maxsize: Maximum number of cached results. 0 disables the cache.
+            ttl: Default TTL in seconds
+            ttls: TTL in seconds by registered operation name (see `operation_name`)
+            clock: Monotonic clock
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.clock = clock
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._tagged: dict[str, set[Hashable]] = {}
+        # Incremented on invalidation, so results fetched while a mutation was
+        # executed are not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_of(self, operation: str) -> float:
+        return self.ttls.get(operation, self.ttl)
+
+    def get(self, key: Hashable) -> dict | None:
+        """Get a cached result, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires <= self.clock():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(
+        self,
+        key: Hashable,
+        operation: str,
+        value: dict,
+        tags: set[str],
+        generation: int | None = None,
+    ) -> None:
+        """
+        Cache a result.
+
+        Args:
+            key: Query key of the result
+            operation: Operation name of the query
+            value: Result of the query
+            tags: UUIDs of the result
+            generation: `generation` of the cache when the query was sent. The
+                        result is not cached if the cache has been invalidated
+                        since.
+        """
+        ttl = self.ttl_of(operation)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, self.clock() + ttl, tags)
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        for tag in entry.tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def invalidate(self, tags: set[str]) -> None:
+        """Forget the results tagged with any of the given UUIDs."""
+        self.generation += 1
+        for tag in tags:
+            for key in list(self._tagged.get(tag, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+        self._tagged.clear()
@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from enum import IntFlag
+from uuid import UUID
+
+from .interning import UUIDTable
+
+
+class OrgUnitFlag(IntFlag):
+    """
+    Classification of an org-unit based on its name.
+
+    All the naming rules of the integration are defined in `classify`.
+    """
+
+    NONE = 0
+    LEDER = 1  # Name ends with "_leder"
+    EXCLUDED = 2  # Name is prefixed with "Ø_"
+    LED_ADM = 4  # Name ends with "led-adm"
+
+
+def classify(name: str) -> OrgUnitFlag:
+    """
+    Compute the classification flags of an org-unit from its name.
+
+    Args:
+        name: Name of the org-unit
+    Returns:
+        OrgUnitFlag bitfield
+    """
+    stripped = name.strip()
+    lowered = stripped.lower()
+
+    flags = OrgUnitFlag.NONE
+    if lowered.endswith("_leder"):
+        flags |= OrgUnitFlag.LEDER
+    if stripped.startswith("Ø_"):
+        flags |= OrgUnitFlag.EXCLUDED
+    if lowered.endswith("led-adm"):
+        flags |= OrgUnitFlag.LED_ADM
+    return flags
+
+
+def is_manager_unit(flags: OrgUnitFlag) -> bool:
+    """Return True for "_leder" units which are not excluded with the "Ø_" prefix."""
+    return flags & (OrgUnitFlag.LEDER | OrgUnitFlag.EXCLUDED) == OrgUnitFlag.LEDER
+
+
+class OrgUnitFlags:
+    """
+    Classification flags of the org-units loaded in a run, keyed by interned id.
+    """
+
+    def __init__(self, uuids: UUIDTable) -> None:
+        self.uuids = uuids
+        self._flags: dict[int, OrgUnitFlag] = {}
+
+    def __contains__(self, uuid: UUID | str) -> bool:
+        return uuid in self.uuids and self.uuids.intern(uuid) in self._flags
+
+    def __getitem__(self, uuid: UUID | str) -> OrgUnitFlag:
+        return self._flags[self.uuids.intern(uuid)]
+
+    def by_id(self, id_: int) -> OrgUnitFlag:
+        """Flags of an org-unit by its interned id."""
+        return self._flags[id_]
+
+    def add(self, uuid: UUID | str, name: str) -> OrgUnitFlag:
+        """Classify an org-unit and store the flags. Returns the flags."""
+        flags = self._flags[self.uuids.intern(uuid)] = classify(name)
+        return flags
@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
 from functools import cache
+from importlib.util import find_spec
 from typing import Any
 from uuid import UUID
 
@@ -9,12 +10,114 @@ from pydantic import BaseSettings
 from pydantic import Field
 from pydantic import parse_obj_as
 from pydantic import SecretStr
+from pydantic import validator
 
 from .init import ManagerLevel
 
 
 class Settings(BaseSettings):
     graphql_timeout: int = 120
+    graphql_page_size: int = Field(
+        500, description="Page size used for paginated GraphQL queries"
+    )
+    graphql_batch_size: int = Field(
+        100, description="Maximum number of UUIDs in the filter of a batched query"
+    )
+    unit_concurrency: int = Field(
+        1, description="Maximum number of _leder units processed concurrently"
+    )
+    graphql_connect_timeout: float | None = Field(
+        None, description="Timeout for connecting to MO. Defaults to GRAPHQL_TIMEOUT"
+    )
+    graphql_pool_timeout: float | None = Field(
+        None,
+        description="Timeout for getting a connection from the pool. "
+        "Defaults to GRAPHQL_TIMEOUT",
+    )
+    http_max_connections: int = Field(
+        100, description="Maximum number of concurrent connections to MO"
+    )
+    http_max_keepalive_connections: int = Field(
+        20, description="Maximum number of idle connections kept alive"
+    )
+    http_keepalive_expiry: float = Field(
+        5.0, description="Time in seconds idle connections are kept alive"
+    )
+    http2: bool = Field(False, description="Use HTTP/2 for the connections to MO")
+    graphql_persisted_queries: bool = Field(
+        False,
+        description="Send only the hash of known operations (automatic persisted "
+        "queries). Requires support in MO",
+    )
+    adaptive_concurrency: bool = Field(
+        False,
+        description="Adapt the number of concurrent requests to MO to its latency "
+        "and errors",
+    )
+    concurrency_initial: int = Field(
+        10, description="Initial number of concurrent requests to MO"
+    )
+    concurrency_max: int = Field(
+        100, description="Maximum number of concurrent requests to MO"
+    )
+    concurrency_latency_target: float = Field(
+        2.0,
+        description="The concurrency is only raised while the p95 latency of MO "
+        "is below this (in seconds)",
+    )
+    mutation_log_path: str | None = Field(
+        None,
+        description="Path of a local SQLite write-ahead log of the mutations sent to "
+        "MO. Disabled if not set.",
+    )
+    checkpoint_window: float = Field(
+        6 * 60 * 60,
+        description="A full run started within this many seconds of the last "
+        "progress of an interrupted full run resumes it. 0 disables checkpoints.",
+    )
+    retry_attempts: int = Field(
+        1,
+        description="Maximum number of attempts of a query failing with a transient "
+        "error or a 5xx response. 1 disables retries.",
+    )
+    retry_backoff: float = Field(
+        0.5,
+        description="Delay before the first retry of a query (in seconds), doubled "
+        "for each retry and jittered",
+    )
+    retry_backoff_max: float = Field(
+        10.0, description="Maximum delay between retries of a query (in seconds)"
+    )
+    hedged_reads: bool = Field(
+        False, description="Send a duplicate of slow queries and use the first response"
+    )
+    hedge_percentile: float = Field(
+        0.95,
+        description="Percentile of the latency of recent queries after which a query "
+        "is hedged",
+    )
+    hedge_max_ratio: float = Field(
+        0.05, description="Maximum fraction of the queries which are hedged"
+    )
+    write_rate: float = Field(
+        0.0,
+        description="Maximum number of mutations per second sent to MO. "
+        "0 disables the limiter.",
+    )
+    write_burst: int = Field(
+        10, description="Number of mutations which may be sent in a burst"
+    )
+    write_concurrency: int = Field(
+        4, description="Maximum number of concurrent mutations sent to MO"
+    )
+    http_compression: bool = Field(
+        True, description="Request compressed (gzip or Brotli) responses from MO"
+    )
+    http_pool_wait_warning: float = Field(
+        1.0,
+        description="Log a warning for requests waiting longer than this "
+        "(in seconds) for a connection",
+    )
     client_id: str = Field("SD-Managerscript", description="Client ID for OIDC client.")
     client_secret: SecretStr = Field(..., description="Client Secret for OIDC client.")
     mo_url: AnyHttpUrl = Field(
@@ -37,9 +140,60 @@ class Settings(BaseSettings):
         description="Mapping dict from org-unit level to manager level"
     )
     manager_level_create: list[ManagerLevel]
+    columnar_engagement_check: bool = Field(
+        False,
+        description="Evaluate manager engagements with NumPy vector operations",
+    )
+    engagement_history: bool = Field(
+        False,
+        description="Select the manager of a _leder unit by all (also past and "
+        "future) engagement validities of the employees, not only the current ones",
+    )
+
+    read_cache_maxsize: int = Field(
+        10000, description="Maximum number of query results in the read cache"
+    )
+    read_cache_ttl: float = Field(
+        0, description="Default TTL in seconds of the read cache. 0 disables it."
+    )
+    read_cache_ttls: dict[str, float] = Field(
+        {}, description="TTL in seconds of the read cache by GraphQL operation name"
+    )
+
+    state_store_path: str | None = Field(
+        None, description="Path of the SQLite state store. Disabled if not set."
+    )
+    state_store_max_age: float = Field(
+        86400,
+        description="Seconds after which unchanged _leder units are re-evaluated",
+    )
+    delta_sync: bool = Field(
+        False,
+        description="Only process changes since the last run in full runs",
+    )
+    full_sync_interval: float = Field(
+        604800, description="Seconds between full runs when delta sync is enabled"
+    )
+    check_manager_roles: bool = Field(
+        False,
+        description="Check manager engagements by paging through all manager roles "
+        "instead of traversing the org-unit tree",
+    )
+    event_consumer: bool = Field(
+        False, description="Process _leder units on association and org-unit events"
+    )
+    event_debounce: float = Field(
+        5, description="Seconds to wait for more events for a _leder unit"
+    )
 
     log_level: str = "INFO"
 
+    @validator("http2")
+    def h2_installed(cls, value: bool) -> bool:
+        if value and find_spec("h2") is None:
+            raise ValueError("HTTP/2 requires the h2 package (httpx[http2])")
+        return value
+
 
 @cache
 def get_settings(*args: Any, **kwargs: Any) -> Settings:
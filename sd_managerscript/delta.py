@@ -0,0 +1,220 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from datetime import datetime
+from uuid import UUID
+
+import structlog
+from more_itertools import chunked
+from raclients.graph.client import PersistentGraphQLClient  # type: ignore
+
+from .config import get_settings
+from .models import Changes
+from .org_graph import OrgGraph
+from .queries import QUERY_CHANGED_OBJECTS
+from .queries import QUERY_EMPLOYEE_ROLES
+from .queries import QUERY_ENGAGEMENT_VALIDITIES
+from .queries import QUERY_MANAGER_VALIDITIES
+from .queries import QUERY_REGISTRATIONS
+from .state import StateStore
+from .util import query_graphql
+from .util import query_paginated
+
+logger = structlog.get_logger()
+
+# Models of the registrations that can affect the managers
+REGISTRATION_MODELS = ["org_unit", "association", "engagement", "manager"]
+
+
+def delta_start(state_store: StateStore, now: datetime) -> datetime | None:
+    """
+    Start of the delta of a run, i.e. the start time of the last successful run.
+
+    Args:
+        state_store: State store of the previous runs
+        now: Start time of this run
+    Returns:
+        Start of the delta, or None if a full run is needed because delta runs are
+        disabled, no full run has completed yet, or the last full run is older
+        than the full sync interval.
+    """
+    settings = get_settings()
+    last_run = state_store.last_run()
+    last_full_run = state_store.last_run(full=True)
+    if not settings.delta_sync or last_run is None or last_full_run is None:
+        return None
+    if (now - last_full_run).total_seconds() >= settings.full_sync_interval:
+        logger.info("Full reconciliation due", last_full_run=last_full_run)
+        return None
+    return last_run
+
+
+async def get_run_changes(
+    gql_client: PersistentGraphQLClient, state_store: StateStore, now: datetime
+) -> Changes | None:
+    """
+    Get the changes to process in a delta run (see `get_changes`), including the
+    "_leder" units failing in the last run.
+
+    Args:
+        gql_client: GraphQL client
+        state_store: State store of the previous runs
+        now: Timezone aware start time of this run
+    Returns:
+        Changes, or None if a full run is needed (see `delta_start`)
+    """
+    since = delta_start(state_store, now)
+    if since is None:
+        return None
+    logger.info("Getting changes since last run...", since=since)
+    changes = await get_changes(gql_client, since, now)
+    # The units failing in the last run are processed again
+    changes.org_units |= state_store.failed_units()
+    return changes
+
+
+def in_window(date: str | None, since: datetime, now: datetime) -> bool:
+    """Check if an ISO date (e.g. of a validity) is in the interval (since, now]."""
+    return date is not None and since < datetime.fromisoformat(date) <= now
+
+
+async def get_validity_boundaries(
+    gql_client: PersistentGraphQLClient, since: datetime, now: datetime
+) -> set[str]:
+    """
+    Get the engagements and managers whose validity starts or ends in the
+    interval (since, now].
+
+    An engagement or manager role starting or ending by its validity creates no
+    registration, so these are not found among the registrations since the last
+    run.
+
+    Args:
+        gql_client: GraphQL client
+        since: Timezone aware time of the last run
+        now: Timezone aware start time of this run
+    Returns:
+        UUIDs of the engagements and managers
+    """
+    variables = {"from_date": since.isoformat(), "to_date": now.isoformat()}
+    uuids: set[str] = set()
+    for query in (QUERY_ENGAGEMENT_VALIDITIES, QUERY_MANAGER_VALIDITIES):
+        objects = await query_paginated(
+            gql_client, query, variables, get_settings().graphql_page_size
+        )
+        uuids.update(
+            obj["uuid"]
+            for obj in objects
+            if any(
+                in_window(validity["validity"]["from"], since, now)
+                or in_window(validity["validity"]["to"], since, now)
+                for validity in obj["validities"]
+            )
+        )
+    return uuids
+
+
+async def get_changes(
+    gql_client: PersistentGraphQLClient, since: datetime, now: datetime
+) -> Changes:
+    """
+    Get the org-units and employees changed in MO since the given time.
+
+    The registrations since then, and the engagements and managers whose validity
+    starts or ends since then, are resolved to the org-units and employees of the
+    changed org-units, associations, engagements and managers. The org-units in
+    which a changed employee has an association or a manager role are changed as
+    well.
+
+    Args:
+        gql_client: GraphQL client
+        since: Timezone aware time of the last run
+        now: Timezone aware start time of this run
+    Returns:
+        Changes
+    """
+    page_size = get_settings().graphql_page_size
+    registrations = await query_paginated(
+        gql_client,
+        QUERY_REGISTRATIONS,
+        {"start": since.isoformat(), "models": REGISTRATION_MODELS},
+        page_size,
+    )
+    boundaries = await get_validity_boundaries(gql_client, since, now)
+    changes = await resolve_changes(
+        gql_client, {r["uuid"] for r in registrations} | boundaries
+    )
+
+    for chunk in chunked(sorted(map(str, changes.employees)), page_size):
+        data = await query_graphql(gql_client, QUERY_EMPLOYEE_ROLES, {"uuids": chunk})
+        for collection in ("associations", "managers"):
+            for obj in data[collection]["objects"]:
+                for validity in obj["validities"]:
+                    changes.org_units.add(UUID(validity["org_unit_uuid"]))
+
+    logger.info(
+        "Changes since last run",
+        since=since,
+        registrations=len(registrations),
+        validity_boundaries=len(boundaries),
+        org_units=len(changes.org_units),
+        employees=len(changes.employees),
+    )
+    return changes
+
+
+async def resolve_changes(
+    gql_client: PersistentGraphQLClient, uuids: set[str]
+) -> Changes:
+    """
+    Resolve the UUIDs of changed objects to the org-units and employees they
+    belong to.
+
+    Args:
+        gql_client: GraphQL client
+        uuids: UUIDs of changed org-units, associations, engagements or managers
+    Returns:
+        Changes
+    """
+    changes = Changes()
+    for chunk in chunked(sorted(uuids), get_settings().graphql_page_size):
+        data = await query_graphql(gql_client, QUERY_CHANGED_OBJECTS, {"uuids": chunk})
+        changes.org_units.update(
+            UUID(obj["uuid"]) for obj in data["org_units"]["objects"]
+        )
+        for collection in ("associations", "engagements", "managers"):
+            for obj in data[collection]["objects"]:
+                for validity in obj["validities"]:
+                    changes.org_units.add(UUID(validity["org_unit_uuid"]))
+                    changes.employees.add(UUID(validity["employee_uuid"]))
+    return changes
+
+
+def changed_managed_units(graph: OrgGraph, changes: Changes) -> list[UUID]:
+    """
+    The org-units whose manager must be checked for an active engagement.
+
+    These are the changed org-units and their parents, as the manager of an
+    org-unit may be engaged in a "led-adm" child org-unit.
+    """
+    ids: set[int] = set()
+    for uuid in changes.org_units:
+        id_ = graph.id(uuid)
+        if id_ in graph:
+            ids.add(id_)
+            if graph.parent[id_] != -1:
+                ids.add(graph.parent[id_])
+    return [graph.uuids.uuid(id_) for id_ in sorted(ids)]
+
+
+def affected_leder_units(graph: OrgGraph, changes: Changes) -> list[int]:
+    """
+    The "_leder" units that are changed themselves or whose target org-units
+    are changed.
+    """
+    changed = {graph.id(uuid) for uuid in changes.org_units}
+    targeting = set(graph.leder_units_targeting(changed))
+    return [
+        leder_unit
+        for leder_unit in graph.leder_units()
+        if leder_unit in changed or leder_unit in targeting
+    ]
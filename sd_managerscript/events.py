@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+from collections.abc import Awaitable
+from collections.abc import Callable
+from uuid import UUID
+
+import structlog
+from raclients.graph.client import PersistentGraphQLClient  # type: ignore
+
+from .cache import ReadCache
+from .delta import resolve_changes
+from .interning import UUIDTable
+from .manager_index import ManagerIndex
+from .models import Changes
+from .models import Event
+from .org_graph import load_org_graph
+from .org_graph import OrgGraph
+from .util import uuid_tags
+
+logger = structlog.get_logger()
+
+
+class Broker:
+    """
+    In-process stand-in for the AMQP broker, i.e. a queue of events.
+    """
+
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue[Event] = asyncio.Queue()
+
+    def __len__(self) -> int:
+        """Number of published events not yet consumed."""
+        return self._queue.qsize()
+
+    async def publish(self, event: Event) -> None:
+        await self._queue.put(event)
+
+    async def get(self) -> Event:
+        return await self._queue.get()
+
+    def task_done(self) -> None:
+        self._queue.task_done()
+
+    async def join(self) -> None:
+        """Wait until all published events have been consumed."""
+        await self._queue.join()
+
+
+class Debouncer:
+    """
+    Debouncing of the processing of org-units (or employees), keyed by UUID.
+
+    An org-unit is processed once no new event for it has been submitted for
+    `delay` seconds, so a burst of events collapses into one evaluation. Events
+    submitted while the org-unit is processed cause it to be processed again.
+    An org-unit is never processed concurrently with itself.
+    """
+
+    def __init__(
+        self, delay: float, process: Callable[[UUID], Awaitable[None]]
+    ) -> None:
+        """
+        Args:
+            delay: Debounce delay in seconds
+            process: Coroutine function processing an org-unit (or employee)
+        """
+        self.delay = delay
+        self.process = process
+        self._deadlines: dict[UUID, float] = {}
+        self._tasks: dict[UUID, asyncio.Task] = {}
+
+    def submit(self, uuid: UUID) -> None:
+        """Schedule the processing of an org-unit (or employee)."""
+        loop = asyncio.get_running_loop()
+        self._deadlines[uuid] = loop.time() + self.delay
+        if uuid not in self._tasks:
+            self._tasks[uuid] = asyncio.create_task(self._run(uuid))
+
+    async def _run(self, uuid: UUID) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                while (remaining := self._deadlines[uuid] - loop.time()) > 0:
+                    await asyncio.sleep(remaining)
+                deadline = self._deadlines[uuid]
+                try:
+                    await self.process(uuid)
+                except Exception:
+                    logger.exception("Processing failed", uuid=str(uuid))
+                if self._deadlines[uuid] == deadline:
+                    return
+        finally:
+            del self._tasks[uuid]
+            del self._deadlines[uuid]
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def drain(self) -> None:
+        """Wait until everything scheduled has been processed."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values())
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+
+
+async def handle_event(
+    gql_client: PersistentGraphQLClient,
+    event: Event,
+    leder_units: Debouncer,
+    employees: Debouncer | None = None,
+    manager_index: ManagerIndex | None = None,
+    read_cache: ReadCache | None = None,
+    graph: OrgGraph | None = None,
+) -> None:
+    """
+    Handle a change event.
+
+    Org-unit and association events schedule the changed org-units for processing
+    as "_leder" units, engagement events schedule the changed employees for a
+    check of their manager roles, and manager events refresh the manager index.
+    The read cache is invalidated for the changed objects. If an org graph is
+    given, org-units known from it not to be "_leder" units are not scheduled on
+    association events, and org-unit events mark the org-unit as changed in it.
+
+    Args:
+        gql_client: GraphQL client
+        event: Event
+        leder_units: Debouncer processing "_leder" units
+        employees: Debouncer checking the manager roles of employees
+        manager_index: Reverse index from employee to manager roles
+        read_cache: Cross-run read cache
+        graph: Org graph loaded when the consumer was started
+    """
+    if event.routing_key == "org_unit":
+        changes = Changes(org_units={event.uuid})
+    elif event.routing_key in {"association", "engagement", "manager"}:
+        changes = await resolve_changes(gql_client, {str(event.uuid)})
+    else:
+        return
+
+    if read_cache is not None:
+        read_cache.invalidate(
+            uuid_tags(event.uuid, *changes.org_units, *changes.employees)
+        )
+
+    if event.routing_key == "org_unit" and graph is not None:
+        graph.mark_changed(event.uuid)
+
+    if event.routing_key in {"org_unit", "association"}:
+        for org_unit_uuid in changes.org_units:
+            if graph is None or graph.may_be_leder_unit(org_unit_uuid):
+                leder_units.submit(org_unit_uuid)
+    elif event.routing_key == "engagement" and employees is not None:
+        for employee_uuid in changes.employees:
+            employees.submit(employee_uuid)
+    elif event.routing_key == "manager" and manager_index is not None:
+        await manager_index.refresh(gql_client, [event.uuid])
+
+
+async def consume_events(
+    gql_client: PersistentGraphQLClient,
+    broker: Broker,
+    leder_units: Debouncer,
+    employees: Debouncer | None = None,
+    manager_index: ManagerIndex | None = None,
+    read_cache: ReadCache | None = None,
+    graph: OrgGraph | None = None,
+) -> None:
+    """
+    Consume events from the broker forever (see `handle_event`).
+
+    Args:
+        gql_client: GraphQL client
+        broker: Event broker
+        leder_units: Debouncer processing "_leder" units
+        employees: Debouncer checking the manager roles of employees
+        manager_index: Reverse index from employee to manager roles
+        read_cache: Cross-run read cache
+        graph: Org graph of the org-units
+    """
+    while True:
+        event = await broker.get()
+        try:
+            logger.debug(
+                "Event received", routing_key=event.routing_key, uuid=event.uuid
+            )
+            await handle_event(
+                gql_client,
+                event,
+                leder_units,
+                employees,
+                manager_index,
+                read_cache,
+                graph,
+            )
+        except Exception:
+            logger.exception(
+                "Event failed", routing_key=event.routing_key, uuid=event.uuid
+            )
+        finally:
+            broker.task_done()
+
+
+async def start_consumer(
+    gql_client: PersistentGraphQLClient,
+    broker: Broker,
+    leder_units: Debouncer,
+    employees: Debouncer,
+    manager_index: ManagerIndex,
+    read_cache: ReadCache | None = None,
+) -> None:
+    """
+    Load the manager index and the org graph, then consume events forever (see
+    `consume_events`).
+
+    The events published while loading are kept by the broker, so e.g. an
+    engagement event is not checked against a partially loaded manager index.
+
+    Args:
+        gql_client: GraphQL client
+        broker: Event broker
+        leder_units: Debouncer processing "_leder" units
+        employees: Debouncer checking the manager roles of employees
+        manager_index: Reverse index from employee to manager roles
+        read_cache: Cross-run read cache
+    """
+    _, graph = await asyncio.gather(
+        manager_index.refresh(gql_client), load_org_graph(gql_client, UUIDTable())
+    )
+    logger.info(
+        "Event consumer started",
+        managers=len(manager_index),
+        org_units=len(graph),
+        buffered_events=len(broker),
+    )
+    await consume_events(
+        gql_client, broker, leder_units, employees, manager_index, read_cache, graph
+    )
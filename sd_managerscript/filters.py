@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
 from asyncio import gather
+from asyncio import Semaphore
 from datetime import datetime
 from uuid import UUID
 
@@ -9,6 +10,7 @@ from fastapi.encoders import jsonable_encoder
 from more_itertools import one
 from raclients.graph.client import PersistentGraphQLClient  # type: ignore
 
+from .config import get_settings
 from .exceptions import ConflictingManagers
 from .mo import get_active_engagements
 from .models import OrgUnitManagers
@@ -121,11 +123,42 @@ async def filter_managers(
 
 
 async def filter_manager_org_units(
-    gql_client: PersistentGraphQLClient, manager_org_units: list[OrgUnitManagers]
+    gql_client: PersistentGraphQLClient,
+    manager_org_units: list[OrgUnitManagers],
+    failures: dict[UUID, str] | None = None,
 ) -> list[OrgUnitManagers]:
-    manager_org_units = [
-        await filter_managers(gql_client, org_unit) for org_unit in manager_org_units
-    ]
+    """
+    Select the manager of each "_leder" unit (see `filter_managers`).
+
+    Up to UNIT_CONCURRENCY units are processed concurrently, so the engagements of
+    their candidates are fetched in shared batches.
+
+    Args:
+        gql_client: GraphQL client
+        manager_org_units: "_leder" OrgUnitManagers objects
+        failures: If given, units failing the selection are recorded here (with
+                  the error) and skipped, instead of failing all units.
+    Returns:
+        "_leder" OrgUnitManagers objects with the association of the selected
+        manager
+    """
+    semaphore = Semaphore(get_settings().unit_concurrency)
+
+    async def select(org_unit: OrgUnitManagers) -> OrgUnitManagers | None:
+        async with semaphore:
+            try:
+                return await filter_managers(gql_client, org_unit)
+            except Exception as error:
+                if failures is None:
+                    raise
+                logger.exception(
+                    "Manager selection failed", org_unit=str(org_unit.uuid)
+                )
+                failures[org_unit.uuid] = repr(error)
+                return None
+
+    filtered = await gather(*map(select, manager_org_units))
+    manager_org_units = [org_unit for org_unit in filtered if org_unit is not None]
     # Remove the _leder units without associations to the parent "main" unit
     manager_org_units = remove_org_units_without_associations(manager_org_units)
 
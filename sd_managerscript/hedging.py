@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable
+from collections.abc import Callable
+from typing import TypeVar
+
+import structlog
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+
+class Hedger:
+    """
+    Hedged requests: if a request has not completed after the `percentile`
+    latency of the recent requests, a duplicate is sent and the first response is
+    used, cancelling the other request.
+
+    Only idempotent requests may be hedged. At most `max_ratio` of the requests
+    are hedged, so a slow MO is not flooded with duplicates.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        max_ratio: float = 0.05,
+        window: int = 100,
+        min_samples: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            percentile: Percentile of the latency after which a request is hedged
+            max_ratio: Maximum fraction of the requests which are hedged
+            window: Number of recent latencies the delay is based on
+            min_samples: Number of latencies needed before requests are hedged
+            clock: Monotonic clock
+        """
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.clock = clock
+        self._latencies: deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self) -> float | None:
+        """Delay before a request is hedged, or None if it is not yet known."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(self.percentile * len(latencies)))]
+
+    def _may_hedge(self) -> bool:
+        return self.hedges + 1 <= self.max_ratio * self.requests
+
+    async def run(self, request: Callable[[], Awaitable[T]]) -> T:
+        """
+        Await `request`, hedging it with a second call if it is slow.
+
+        Args:
+            request: Function sending the request
+        Returns:
+            The first response
+        """
+        self.requests += 1
+        started = self.clock()
+        primary = asyncio.ensure_future(request())
+        tasks = {primary}
+        try:
+            delay = self.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._may_hedge():
+                    self.hedges += 1
+                    logger.debug("Hedging slow request", delay=round(delay, 3))
+                    tasks.add(asyncio.ensure_future(request()))
+
+            # Use the first successful response, or the last failure
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                task = done.pop()
+                tasks.discard(task)
+                if task.exception() is None or not tasks:
+                    break
+            if task is not primary:
+                self.hedge_wins += 1
+            result = task.result()
+            self._latencies.append(self.clock() - started)
+            return result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def summary(self) -> dict[str, float | None]:
+        delay = self.delay()
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "delay": None if delay is None else round(delay, 3),
+        }
@@ -2,34 +2,69 @@
 # SPDX-License-Identifier: MPL-2.0
 import asyncio
 from datetime import datetime
+from datetime import timezone
+from functools import partial
 from typing import Any
-from typing import cast
+from typing import Callable
 from uuid import UUID
 
+import numpy as np
 import structlog
 from fastapi.encoders import jsonable_encoder
+from gql.transport.exceptions import TransportQueryError  # type: ignore
+from more_itertools import chunked
 from more_itertools import one
 from raclients.graph.client import PersistentGraphQLClient  # type: ignore
 from ramodels.mo._shared import Validity  # type: ignore
 
+from .cache import ReadCache
+from .classification import classify
+from .classification import is_manager_unit
+from .classification import OrgUnitFlag
+from .classification import OrgUnitFlags
 from .config import get_settings
+from .delta import affected_leder_units
+from .delta import changed_managed_units
+from .delta import get_run_changes
 from .filters import filter_manager_org_units
+from .interning import UUIDTable
+from .limiter import WriteLimiter
+from .manager_index import ManagerIndex
+from .mo import get_active_engagements
+from .models import Changes
+from .models import EngagementFrom
 from .models import Manager
 from .models import ManagerLevel
+from .models import ManagerTarget
 from .models import ManagerType
 from .models import OrgUnitManager
 from .models import OrgUnitManagers
+from .mutation_log import MutationLog
+from .operations import REGISTRY
+from .org_graph import load_org_graph
+from .org_graph import load_org_subgraph
+from .org_graph import OrgGraph
+from .queries import ASSOCIATION_TERMINATE
 from .queries import CREATE_MANAGER
 from .queries import CURRENT_MANAGER
-from .queries import QUERY_LEDER_ORG_UNITS
+from .queries import MANAGER_TERMINATE
+from .queries import QUERY_LEDER_ORG_UNITS_BY_UUIDS
 from .queries import QUERY_MANAGER_ENGAGEMENTS
-from .queries import QUERY_ORG_UNIT_LEVEL
+from .queries import QUERY_MANAGER_ROLE_ENGAGEMENTS
 from .queries import QUERY_ROOT_MANAGER_ENGAGEMENTS
 from .queries import UPDATE_MANAGER
+from .state import assigned_manager_role
+from .state import leder_unit_fingerprint
+from .state import RunProgress
+from .state import StateStore
 from .terminate import terminate_manager
+from .util import DataLoader
 from .util import execute_mutator
+from .util import get_loader
 from .util import query_graphql
 from .util import query_org_unit
+from .util import query_paginated
+from .util import query_scope
 
 try:
     import zoneinfo
@@ -50,17 +85,24 @@ def is_engagement_active(engagement: dict[str, Any]) -> bool:
     return datetime.fromisoformat(to_date) > datetime.now(tz=DEFAULT_TZ)
 
 
-def is_led_adm_unit(org_unit: dict) -> bool:
+def is_led_adm_unit(org_unit: dict, flags: OrgUnitFlags | None = None) -> bool:
     """
     Returns True if the org unit's name ends with 'led-adm'
+
+    The precomputed classification flags are used if the org-unit is in `flags`.
     """
-    name = cast(str, org_unit.get("name", "")).lower().strip()
-    return name.endswith("led-adm")
+    uuid = org_unit.get("uuid")
+    if flags is not None and uuid is not None and uuid in flags:
+        return OrgUnitFlag.LED_ADM in flags[uuid]
+    return OrgUnitFlag.LED_ADM in classify(org_unit.get("name", ""))
 
 
-async def get_unengaged_managers(query_dict: dict[str, Any]) -> list[OrgUnitManager]:
+async def get_unengaged_managers(
+    query_dict: dict[str, Any], flags: OrgUnitFlags | None = None
+) -> list[OrgUnitManager]:
     """
     Return OrgUnitManager if the manager has no active engagements in the given org-unit or led-adm child.
+    The org-units of the engagements are classified with `flags` if given.
 
     Example of query_dict:
     {
@@ -134,7 +176,7 @@ async def get_unengaged_managers(query_dict: dict[str, Any]) -> list[OrgUnitMana
         # Check for active engagement in a `led-adm` unit that's a child of this org_unit
         has_active_led_adm_engagement = any(
             is_engagement_active(e)
-            and is_led_adm_unit(one(e["org_unit"]))
+            and is_led_adm_unit(one(e["org_unit"]), flags)
             and one(e["org_unit"]).get("parent", {}).get("uuid") == org_unit_uuid
             for e in engagements
         )
@@ -151,11 +193,138 @@ async def get_unengaged_managers(query_dict: dict[str, Any]) -> list[OrgUnitMana
     return unengaged_managers
 
 
+def _to_datetime64(date: datetime | None) -> Any:
+    """Convert a timezone aware datetime to a UTC numpy datetime64 (NaT if None)."""
+    if date is None:
+        return np.datetime64("NaT", "us")
+    return np.datetime64(date.astimezone(timezone.utc).replace(tzinfo=None), "us")
+
+
+def get_unengaged_managers_columnar(
+    query_dicts: list[dict[str, Any]], flags: OrgUnitFlags | None = None
+) -> list[OrgUnitManager]:
+    """
+    Columnar version of `get_unengaged_managers` for a whole batch of org-units.
+
+    The engagement rows of all managers in the batch are collected into NumPy
+    arrays (to-dates as datetime64 and UUIDs interned as integers) and the active,
+    same-unit and led-adm child checks are evaluated as vector operations.
+    The result is identical to calling `get_unengaged_managers` on each element
+    of `query_dicts` and concatenating the results.
+
+    Args:
+        query_dicts: list of org-unit objects as returned by the
+                     QUERY_MANAGER_ENGAGEMENTS query.
+        flags: Classification flags of the org graph, if loaded
+    Returns:
+        list of OrgUnitManager for managers without an active engagement
+    """
+    uuids = UUIDTable()
+    led_adm_units: dict[int, bool] = {}
+    manager_units: list[int] = []
+    manager_ids: list[int] = []
+    engagement_manager: list[int] = []
+    engagement_unit: list[int] = []
+    engagement_parent: list[int] = []
+    engagement_led_adm: list[bool] = []
+    engagement_to: list[Any] = []
+
+    for query_dict in query_dicts:
+        try:
+            org_unit = one(query_dict["validities"])
+        except Exception as e:
+            logger.error(
+                f"Invalid query_dict: {query_dict}. Exception: {e}", exc_info=True
+            )
+            continue
+
+        org_unit_uuid = org_unit.get("uuid")
+        for manager in org_unit.get("managers", []):
+            try:
+                manager_uuid = manager["uuid"]
+                employee = one(manager.get("employee", []))
+                engagements = employee.get("engagements", [])
+            except Exception as e:
+                logger.warning(
+                    f"Skipping manager: {query_dict}. Exception: {e}", exc_info=True
+                )
+                continue
+
+            row = len(manager_ids)
+            manager_ids.append(uuids.intern(manager_uuid))
+            manager_units.append(uuids.intern(org_unit_uuid))
+            for engagement in engagements:
+                engagement_org_unit = one(engagement["org_unit"])
+                parent_uuid = (engagement_org_unit.get("parent") or {}).get("uuid")
+                unit_id = uuids.intern(engagement_org_unit["uuid"])
+                if unit_id not in led_adm_units:
+                    led_adm_units[unit_id] = is_led_adm_unit(engagement_org_unit, flags)
+                engagement_manager.append(row)
+                engagement_unit.append(unit_id)
+                engagement_parent.append(
+                    -1 if parent_uuid is None else uuids.intern(parent_uuid)
+                )
+                engagement_led_adm.append(led_adm_units[unit_id])
+                to_date = engagement["validity"]["to"]
+                engagement_to.append(
+                    _to_datetime64(to_date and datetime.fromisoformat(to_date))
+                )
+
+    if not manager_ids:
+        return []
+
+    now = _to_datetime64(datetime.now(tz=DEFAULT_TZ))
+    to_dates = np.array(engagement_to, dtype="datetime64[us]")
+    rows = np.array(engagement_manager, dtype=np.intp)
+    owner_units = np.array(manager_units, dtype=np.int64)[rows]
+
+    active = np.isnat(to_dates) | (to_dates > now)
+    same_unit = np.array(engagement_unit, dtype=np.int64) == owner_units
+    led_adm_child = np.array(engagement_led_adm, dtype=bool) & (
+        np.array(engagement_parent, dtype=np.int64) == owner_units
+    )
+
+    engaged = np.zeros(len(manager_ids), dtype=bool)
+    engaged[rows[active & (same_unit | led_adm_child)]] = True
+
+    return [
+        OrgUnitManager(
+            org_unit_uuid=uuids.uuid(manager_units[row]),
+            manager_uuid=uuids.uuid(manager_ids[row]),
+        )
+        for row in np.flatnonzero(~engaged)
+    ]
+
+
+async def find_unengaged_managers(
+    query_dicts: list[dict[str, Any]], flags: OrgUnitFlags | None = None
+) -> list[OrgUnitManager]:
+    """
+    Find the managers without an active engagement in a batch of org-units, using
+    the columnar evaluation if enabled in the settings.
+
+    Args:
+        query_dicts: list of org-unit objects as returned by the
+                     QUERY_MANAGER_ENGAGEMENTS query.
+        flags: Classification flags of the org graph, if loaded
+    Returns:
+        list of OrgUnitManager for managers without an active engagement
+    """
+    if get_settings().columnar_engagement_check:
+        return get_unengaged_managers_columnar(query_dicts, flags)
+
+    results = await asyncio.gather(
+        *(get_unengaged_managers(query_dict, flags) for query_dict in query_dicts)
+    )
+    return [org_unit_manager for res in results for org_unit_manager in res]
+
+
 async def check_manager_engagement(
     gql_client: PersistentGraphQLClient,
     org_unit_uuid: UUID,
     root_uuid: UUID,
     recursive: bool = True,
+    flags: OrgUnitFlags | None = None,
 ) -> list[OrgUnitManager]:
     """
     Recursive function, traverse through all org_units and checks if manager has engagement
@@ -168,6 +337,7 @@ async def check_manager_engagement(
         root_uuid: root_uuid of the Organisation tree.
                    (root_uuid is fetched from enviromental variable)
         recursive: If true, check manager engagement recursively
+        flags: Classification flags of the org graph, if loaded
     Returns:
         list of manager UUID's
 
@@ -201,14 +371,9 @@ async def check_manager_engagement(
             gql_client, QUERY_ROOT_MANAGER_ENGAGEMENTS, variables
         )
         # Check if manager of root org-unit has active engagement
-        root_tasks = [
-            get_unengaged_managers(org_unit)
-            for org_unit in data["org_units"]["objects"]
-        ]
-        root_results = await asyncio.gather(*root_tasks)
-        root_results = [res for res in root_results if res is not None]
-        for res in root_results:
-            managers_to_terminate.extend(res)
+        managers_to_terminate.extend(
+            await find_unengaged_managers(data["org_units"]["objects"], flags)
+        )
 
         if not recursive:
             return managers_to_terminate
@@ -220,13 +385,9 @@ async def check_manager_engagement(
     # or else return managers uuid to terminate
     logger.debug("Org-units returned from query", response=data)
     # Concurrently check managers for engagement
-    check_tasks = [
-        get_unengaged_managers(org_unit) for org_unit in data["org_units"]["objects"]
-    ]
-    check_results = await asyncio.gather(*check_tasks)
-    check_results = [res for res in check_results if res is not None]
-    for res in check_results:
-        managers_to_terminate.extend(res)
+    managers_to_terminate.extend(
+        await find_unengaged_managers(data["org_units"]["objects"], flags)
+    )
 
     # Recursively check child org-units with children
     child_org_units = [
@@ -240,6 +401,7 @@ async def check_manager_engagement(
             gql_client,
             one(org_unit["validities"])["uuid"],
             root_uuid,
+            flags=flags,
         )
         for org_unit in child_org_units
     ]
@@ -251,46 +413,210 @@ async def check_manager_engagement(
     return managers_to_terminate
 
 
+async def check_manager_engagement_by_level(
+    gql_client: PersistentGraphQLClient,
+    org_unit_uuid: UUID,
+    root_uuid: UUID,
+    flags: OrgUnitFlags | None = None,
+) -> list[OrgUnitManager]:
+    """
+    Breadth-first alternative to the recursive `check_manager_engagement`.
+
+    The org-unit tree is traversed one level at a time, querying the children of
+    all org-units of a level with one QUERY_MANAGER_ENGAGEMENTS query (chunked to
+    at most `graphql_batch_size` parents per query). The number of requests is
+    the depth of the tree rather than the number of org-units with children.
+
+    Args:
+        gql_client: GraphQL client
+        org_unit_uuid: UUID of the org-unit to check the descendants of
+        root_uuid: UUID of the root org-unit. The manager of the root org-unit
+                   itself is checked too.
+        flags: Classification flags of the org graph, if loaded
+    Returns:
+        list of OrgUnitManager for managers without an active engagement
+    """
+    batch_size = get_settings().graphql_batch_size
+    managers_to_terminate = []
+
+    if org_unit_uuid == root_uuid:
+        data = await query_graphql(
+            gql_client, QUERY_ROOT_MANAGER_ENGAGEMENTS, {"uuid": str(org_unit_uuid)}
+        )
+        managers_to_terminate.extend(
+            await find_unengaged_managers(data["org_units"]["objects"], flags)
+        )
+
+    level = [str(org_unit_uuid)]
+    depth = 0
+    while level:
+        results = await asyncio.gather(
+            *(
+                query_graphql(gql_client, QUERY_MANAGER_ENGAGEMENTS, {"uuid": chunk})
+                for chunk in chunked(level, batch_size)
+            )
+        )
+        org_units = [
+            org_unit for data in results for org_unit in data["org_units"]["objects"]
+        ]
+        managers_to_terminate.extend(await find_unengaged_managers(org_units, flags))
+        level = [
+            validity["uuid"]
+            for validity in (one(org_unit["validities"]) for org_unit in org_units)
+            if validity["has_children"]
+        ]
+        depth += 1
+    logger.debug("Org-unit tree traversed", depth=depth)
+
+    return managers_to_terminate
+
+
+def group_manager_roles(manager_roles: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Group manager roles by org-unit into org-unit objects of the same shape as
+    returned by the QUERY_MANAGER_ENGAGEMENTS query.
+
+    Args:
+        manager_roles: manager objects as returned by the
+                       QUERY_MANAGER_ROLE_ENGAGEMENTS query
+    Returns:
+        list of org-unit objects
+    """
+    org_units: dict[str, list[dict[str, Any]]] = {}
+    for manager_role in manager_roles:
+        validity = one(manager_role["validities"])
+        org_units.setdefault(validity["org_unit_uuid"], []).append(
+            # Vacant manager roles have no employee
+            {"uuid": validity["uuid"], "employee": validity["employee"] or []}
+        )
+    return [
+        {"validities": [{"uuid": org_unit_uuid, "managers": managers}]}
+        for org_unit_uuid, managers in org_units.items()
+    ]
+
+
+async def check_manager_roles(
+    gql_client: PersistentGraphQLClient,
+    org_unit_uuids: set[UUID] | None = None,
+    flags: OrgUnitFlags | None = None,
+) -> list[OrgUnitManager]:
+    """
+    Alternative to `check_manager_engagement` paging through all current manager
+    roles directly instead of traversing the org-unit tree.
+
+    The same rules apply: a manager must have an active engagement in the
+    org-unit of the manager role or in a "led-adm" child of it.
+
+    Args:
+        gql_client: GraphQL client
+        org_unit_uuids: If given, only check manager roles in these org-units
+        flags: Classification flags of the org graph, if loaded
+    Returns:
+        list of OrgUnitManager for managers without an active engagement
+    """
+    manager_roles = await query_paginated(
+        gql_client,
+        QUERY_MANAGER_ROLE_ENGAGEMENTS,
+        {},
+        get_settings().graphql_page_size,
+    )
+    org_units = group_manager_roles(manager_roles)
+    if org_unit_uuids is not None:
+        org_units = [
+            org_unit
+            for org_unit in org_units
+            if UUID(one(org_unit["validities"])["uuid"]) in org_unit_uuids
+        ]
+    logger.debug(
+        "Manager roles fetched", managers=len(manager_roles), org_units=len(org_units)
+    )
+    return await find_unengaged_managers(org_units, flags)
+
+
 async def get_manager_org_units(
     gql_client: PersistentGraphQLClient,
+    flags: OrgUnitFlags | None,
+    org_unit_uuids: list[UUID],
 ) -> list[OrgUnitManagers]:
     """
-    Function for getting all org_units that ends with `_leder`
+    Get the org-units among the given ones that end with `_leder`, with their
+    associations
 
     Args:
         Graphql client
+        flags: Classification flags of the run. The flags of the loaded
+               org-units and their parents are added to it.
+        org_unit_uuids: UUIDs of the org-units, e.g. the "_leder" units of the
+                        org graph (see `OrgGraph.leder_units`)
     Returns:
         managers: list of '_leder' OrgUnitManagers
 
     """
-    data = await query_org_unit(gql_client, QUERY_LEDER_ORG_UNITS, {})
+    if flags is None:
+        flags = OrgUnitFlags(UUIDTable())
+    data = []
+    for chunk in chunked(org_unit_uuids, get_settings().graphql_page_size):
+        data.extend(
+            await query_org_unit(
+                gql_client,
+                QUERY_LEDER_ORG_UNITS_BY_UUIDS,
+                {"uuids": [str(uuid) for uuid in chunk]},
+            )
+        )
+
+    for ou in data:
+        flags.add(ou.uuid, ou.name)
+        flags.add(ou.parent.uuid, ou.parent.name)
 
     # Select _leder units that are not prefixed with 'Ø_'
-    leder_units = [
-        ou
-        for ou in data
-        if ou.name.lower().strip().endswith("_leder")
-        and not ou.name.strip().startswith("Ø_")
-    ]
+    leder_units = [ou for ou in data if is_manager_unit(flags[ou.uuid])]
 
     return leder_units
 
 
+async def load_current_managers(
+    gql_client: PersistentGraphQLClient, org_unit_uuids: list[UUID]
+) -> dict[UUID, list[dict]]:
+    """
+    Batch load the current managers of org-units (see `DataLoader`).
+
+    Args:
+        gql_client: GraphQL client
+        org_unit_uuids: UUIDs of the org-units
+    Returns:
+        Manager objects by org-unit UUID
+    """
+    variables = {"uuid": [str(uuid) for uuid in org_unit_uuids]}
+    data = await query_graphql(gql_client, CURRENT_MANAGER, variables)
+    return {
+        UUID(obj["uuid"]): one(obj["validities"])["managers"]
+        for obj in data["org_units"]["objects"]
+    }
+
+
 async def get_current_manager(
     gql_client: PersistentGraphQLClient, org_unit_uuid: UUID
 ) -> Manager | None:
     """
     Get the current manager or None, if the manager does not exist
 
+    The managers of concurrently looked up org-units are fetched in one query.
+
     Args:
         gql_client: GraphQL client
         org_unit_uuid: UUID of the org-unit we want to fetch the manager from.
     Returns:
         The manager or None, if the manager does not exist
     """
-    variables = {"uuid": str(org_unit_uuid)}
-    ou_manager = await query_graphql(gql_client, CURRENT_MANAGER, variables)
-    managers = one(one(ou_manager["org_units"]["objects"])["validities"])["managers"]
+    loader = get_loader(
+        "current_managers",
+        lambda: DataLoader(
+            partial(load_current_managers, gql_client),
+            get_settings().graphql_batch_size,
+            default=[],
+        ),
+    )
+    managers = await loader.load(org_unit_uuid)
     if managers:
         logger.debug("Manager found", manager=managers, org_unit=str(org_unit_uuid))
         manager = one(managers)
@@ -364,8 +690,10 @@ def is_manager_correct(
 
 
 async def update_manager(
-    gql_client: PersistentGraphQLClient, org_unit_uuid: UUID, manager_obj: Manager
-) -> None:
+    gql_client: PersistentGraphQLClient,
+    org_unit_uuid: UUID,
+    manager_obj: Manager,
+) -> Manager:
     """
     Checks if there exists a manager posistion at parent org-unit.
     If so. Update the manager position with employee
@@ -376,8 +704,9 @@ async def update_manager(
     Args:
         gql_client: GraphQL client
         org_unit_uuid: uuid of the org-unit we want to assign the manager to
+        manager_obj: the manager to assign
     Returns:
-        Nothing
+        The manager role assigned in the org-unit
     """
     manager_dict = jsonable_encoder(manager_obj)
     manager_dict["manager_type"] = manager_dict["manager_type"]["uuid"]
@@ -389,9 +718,14 @@ async def update_manager(
 
     if current_manager is None:
         variables = {"input": manager_dict}
-        await execute_mutator(gql_client, CREATE_MANAGER, variables)
+        result = await execute_mutator(gql_client, CREATE_MANAGER, variables)
         logger.info(f"Manager created: {manager_dict}")
-        return
+        return manager_obj.copy(
+            update={
+                "uuid": UUID(result["manager_create"]["uuid"]),
+                "org_unit": org_unit_uuid,
+            }
+        )
 
     manager_correct = is_manager_correct(current_manager, manager_obj, org_unit_uuid)
     logger.debug("Check if manager correct", correct=manager_correct)
@@ -401,108 +735,657 @@ async def update_manager(
         variables = {"input": manager_dict}
         await execute_mutator(gql_client, UPDATE_MANAGER, variables)
         logger.info(f"Manager updated: {manager_dict}")
+        return manager_obj.copy(
+            update={"uuid": current_manager.uuid, "org_unit": org_unit_uuid}
+        )
+    return current_manager
 
 
-async def get_manager_level(
-    gql_client: PersistentGraphQLClient, org_unit: OrgUnitManagers
-) -> ManagerLevel:
+async def create_update_manager(
+    gql_client: PersistentGraphQLClient,
+    org_unit: OrgUnitManagers,
+    target: ManagerTarget,
+    dry_run: bool = False,
+) -> list[Manager]:
     """
-    Checks if parent org-unit is "led-adm" org-unit and returns
-    manager level based on org-unit level.
+    Create manager payload and send request to update manager in relevant org-units
 
     Args:
         gql_client: GraphQL client
         org_unit: OrgUnitManagers object
-    Returns
-        manager_level_uuid: UUID of manager level
+        target: Target org-units and manager level of the "_leder" unit
+                (see `OrgGraph.manager_targets`)
+        dry_run: If true, do not actually perform write operations to MO
+    Returns:
+        The manager roles assigned in the target org-units (none if dry run)
     """
 
-    # Assign manager level based on "NYx" org_unit_level_uuid
-    manager_level_dict = get_settings().manager_level_mapping
-    org_unit_level_uuid = org_unit.parent.org_unit_level_uuid
-
-    # If parent org-unit name is ending with "led-adm"
-    # we fetch org_unit_level_uuid from org-unit two levels up
-    if org_unit.parent.name.strip().endswith("led-adm"):
-        variables = {"uuids": str(org_unit.parent.parent_uuid)}
-        data = await gql_client.execute(QUERY_ORG_UNIT_LEVEL, variable_values=variables)
+    # TODO: unit test for dry run
 
-        org_unit_level_uuid = one(one(data["org_units"]["objects"])["validities"])[
-            "org_unit_level_uuid"
-        ]
+    logger.debug("Creating manager object.", org_unit=org_unit)
 
-    return ManagerLevel(uuid=UUID(manager_level_dict[str(org_unit_level_uuid)]))
+    manager: Manager = await create_manager_object(
+        org_unit,
+        target.manager_level,
+    )
+    logger.debug("Update manager role.", manager=manager)
+    if dry_run:
+        return []
+    return list(
+        await asyncio.gather(
+            *(
+                update_manager(gql_client, org_unit_uuid, manager)
+                for org_unit_uuid in target.org_units
+            )
+        )
+    )
 
 
-async def create_update_manager(
+async def create_update_managers(
     gql_client: PersistentGraphQLClient,
-    org_unit: OrgUnitManagers,
+    units: list[tuple[OrgUnitManagers, ManagerTarget]],
+    failures: dict[UUID, str],
     dry_run: bool = False,
+    on_updated: Callable[[OrgUnitManagers, ManagerTarget, list[Manager]], None]
+    | None = None,
 ) -> None:
     """
-    Create manager payload and send request to update manager in relevant org-units
+    Update the managers of "_leder" units (see `create_update_manager`).
+
+    Up to UNIT_CONCURRENCY units are updated concurrently, so the current managers
+    of their target org-units are fetched in shared batches. A unit sharing a
+    target org-unit with an earlier unit waits for it, so the last unit wins as
+    when updating one unit at a time.
 
     Args:
         gql_client: GraphQL client
-        org_unit: OrgUnitManagers object
+        units: "_leder" OrgUnitManagers objects with their targets
+        failures: Units failing the update are recorded here (with the error)
         dry_run: If true, do not actually perform write operations to MO
+        on_updated: Called with each unit updated successfully, its target and
+                    the manager roles assigned
+    """
+    semaphore = asyncio.Semaphore(get_settings().unit_concurrency)
+    previous: dict[UUID, asyncio.Task] = {}
+
+    async def update(
+        org_unit: OrgUnitManagers, target: ManagerTarget, after: set[asyncio.Task]
+    ) -> None:
+        # Wait before taking a slot, as the earlier units may be waiting for one
+        await asyncio.gather(*after, return_exceptions=True)
+        async with semaphore:
+            try:
+                managers = await create_update_manager(
+                    gql_client, org_unit, target, dry_run=dry_run
+                )
+            except Exception as error:
+                logger.exception("Manager update failed", org_unit=str(org_unit.uuid))
+                failures[org_unit.uuid] = repr(error)
+                return
+        if on_updated is not None:
+            on_updated(org_unit, target, managers)
+
+    tasks = []
+    for org_unit, target in units:
+        after = {previous[uuid] for uuid in target.org_units if uuid in previous}
+        task = asyncio.create_task(update(org_unit, target, after))
+        previous.update(dict.fromkeys(target.org_units, task))
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+
+
+async def get_engagement_froms(
+    gql_client: PersistentGraphQLClient, manager_org_units: list[OrgUnitManagers]
+) -> dict[UUID, datetime | None]:
+    """
+    Latest engagement from-date of each employee associated with the "_leder"
+    units (see `get_active_engagements`).
+
+    Employees whose engagements cannot be fetched are left out.
+    """
+    employees = {
+        association.employee_uuid
+        for org_unit in manager_org_units
+        for association in org_unit.associations
+    }
+    results = await asyncio.gather(
+        *(get_active_engagements(gql_client, uuid) for uuid in employees),
+        return_exceptions=True,
+    )
+    return {
+        result.employee_uuid: result.engagement_from
+        for result in results
+        if isinstance(result, EngagementFrom)
+    }
+
+
+async def is_manager_unchanged(
+    gql_client: PersistentGraphQLClient, assigned: dict[str, str]
+) -> bool:
+    """
+    Check that a manager role recorded in the state store (see
+    `StateStore.assigned_managers`) is still the current manager in MO.
+    """
+    current = await get_current_manager(gql_client, UUID(assigned["org_unit"]))
+    return current is not None and assigned_manager_role(current) == assigned
+
+
+async def skip_unchanged_org_units(
+    gql_client: PersistentGraphQLClient,
+    manager_org_units: list[OrgUnitManagers],
+    manager_targets: dict[int, ManagerTarget],
+    uuids: UUIDTable,
+    state_store: StateStore,
+    changed_org_units: set[UUID],
+    engagement_from: dict[UUID, datetime | None],
+) -> list[OrgUnitManagers]:
+    """
+    Remove the "_leder" units whose input is unchanged since they were last
+    processed, according to the state store, and whose assigned manager roles
+    are unchanged in MO.
+
+    Args:
+        gql_client: GraphQL client
+        manager_org_units: list of '_leder' OrgUnitManagers
+        manager_targets: Precomputed targets of the "_leder" units
+        uuids: UUID interning table of the run
+        state_store: State store of the previous runs
+        changed_org_units: UUIDs of org-units whose manager was changed in this
+                           run (e.g. terminated). "_leder" units targeting any of
+                           these are always processed.
+        engagement_from: Latest engagement from-date of the associated employees
+                         (see `get_engagement_froms`)
     Returns:
-        Nothing
+        list of the '_leder' OrgUnitManagers to process
     """
+    max_age = get_settings().state_store_max_age
+
+    async def is_unchanged(org_unit: OrgUnitManagers) -> bool:
+        target = manager_targets[uuids.intern(org_unit.uuid)]
+        if changed_org_units.intersection(target.org_units):
+            return False
+        fingerprint = leder_unit_fingerprint(org_unit, target, engagement_from)
+        if not state_store.is_unchanged(org_unit.uuid, fingerprint, max_age):
+            return False
+        # The manager roles may have been changed in MO since, e.g. manually
+        assigned = state_store.assigned_managers(org_unit.uuid)
+        if {UUID(manager["org_unit"]) for manager in assigned} != set(target.org_units):
+            return False
+        return all(
+            await asyncio.gather(
+                *(is_manager_unchanged(gql_client, manager) for manager in assigned)
+            )
+        )
 
-    # TODO: unit test for dry run
+    unchanged = await asyncio.gather(*map(is_unchanged, manager_org_units))
+    to_process = [
+        org_unit for org_unit, skip in zip(manager_org_units, unchanged) if not skip
+    ]
+    logger.info(
+        "Skipping unchanged manager org units",
+        skipped=len(manager_org_units) - len(to_process),
+    )
+    return to_process
 
-    logger.debug("Creating manager object.", org_unit=org_unit)
-    manager_level = await get_manager_level(gql_client, org_unit)
 
-    manager: Manager = await create_manager_object(
-        org_unit,
-        manager_level,
+async def update_leder_unit(
+    gql_client: PersistentGraphQLClient,
+    org_unit_uuid: UUID,
+    dry_run: bool = False,
+    read_cache: ReadCache | None = None,
+    write_limiter: WriteLimiter | None = None,
+    mutation_log: MutationLog | None = None,
+) -> None:
+    """
+    Select and update the manager of a single "_leder" unit, e.g. on an event.
+
+    Org-units which are not "_leder" units, or are excluded with the "Ø_" prefix,
+    are ignored. The target org-units and manager level are computed from the
+    org-units around the "_leder" unit (see `load_org_subgraph`) with the same
+    rules as in full runs.
+
+    Args:
+        gql_client: GraphQL client
+        org_unit_uuid: UUID of the "_leder" unit
+        dry_run: If true, do not actually perform write operations to MO
+        read_cache: Cross-run read cache
+        write_limiter: Rate limiter of the mutations
+        mutation_log: Write-ahead log of the mutations
+    """
+    async with query_scope(read_cache, write_limiter, mutation_log):
+        manager_org_units = await get_manager_org_units(
+            gql_client, None, [org_unit_uuid]
+        )
+        if not manager_org_units:
+            logger.debug("Not a manager org unit", org_unit=str(org_unit_uuid))
+            return
+
+        graph = await load_org_subgraph(gql_client, UUIDTable(), org_unit_uuid)
+        target = graph.manager_targets([graph.id(org_unit_uuid)]).get(
+            graph.id(org_unit_uuid)
+        )
+        if target is None:
+            logger.warning("No manager target", org_unit=str(org_unit_uuid))
+            return
+
+        manager_org_units = await filter_manager_org_units(
+            gql_client, manager_org_units
+        )
+        for org_unit in manager_org_units:
+            await create_update_manager(gql_client, org_unit, target, dry_run=dry_run)
+    logger.info("Manager org unit updated", org_unit=str(org_unit_uuid))
+
+
+async def check_employee_managers(
+    gql_client: PersistentGraphQLClient,
+    employee_uuid: UUID,
+    root_uuid: UUID,
+    manager_index: ManagerIndex,
+    dry_run: bool = False,
+    write_limiter: WriteLimiter | None = None,
+    mutation_log: MutationLog | None = None,
+) -> None:
+    """
+    Check the manager roles of a single employee for an active engagement, e.g.
+    when an engagement of the employee has changed, and terminate the unengaged
+    managers.
+
+    Only the org-units in which the employee holds a manager role according to
+    the manager index are checked.
+
+    Args:
+        gql_client: GraphQL client
+        employee_uuid: UUID of the employee
+        root_uuid: UUID of the root org-unit
+        manager_index: Reverse index from employee to manager roles
+        dry_run: If true, do not actually perform write operations to MO
+        write_limiter: Rate limiter of the mutations
+        mutation_log: Write-ahead log of the mutations
+    """
+    org_unit_uuids = manager_index.org_units(employee_uuid)
+    if not org_unit_uuids:
+        return
+
+    async with query_scope(write_limiter=write_limiter, mutation_log=mutation_log):
+        results = await asyncio.gather(
+            *(
+                check_manager_engagement(gql_client, uuid, root_uuid, recursive=False)
+                for uuid in org_unit_uuids
+            )
+        )
+        for org_unit_manager in (manager for result in results for manager in result):
+            await terminate_manager(
+                gql_client, org_unit_manager.manager_uuid, dry_run=dry_run
+            )
+            if not dry_run:
+                manager_index.remove(org_unit_manager.manager_uuid)
+    logger.info(
+        "Manager roles of employee checked",
+        employee=str(employee_uuid),
+        org_units=len(org_unit_uuids),
     )
-    logger.debug("Update manager role.", manager=manager)
-    if not dry_run:
-        await update_manager(gql_client, org_unit.parent.uuid, manager)
 
-    # If parent org-unit has "led-adm" in name,
-    # it's parent org-unit will also have the manager assigned
-    if org_unit.parent.name.strip()[-7:] == "led-adm":
-        logger.debug("Parent unit is 'led-adm' - manager will also be assigned here")
-        if not dry_run:
-            await update_manager(gql_client, org_unit.parent.parent_uuid, manager)
+
+def superseded_update(
+    current_manager: Manager | None, manager_input: dict
+) -> str | None:
+    """
+    Check if a logged manager update is applied or superseded in MO.
+
+    Args:
+        current_manager: The current manager of the org-unit of the update
+        manager_input: Input of the UPDATE_MANAGER mutation
+    Returns:
+        Why the update is not to be applied again, or None
+    """
+    if current_manager is None:
+        return "Manager terminated"
+    if str(current_manager.uuid) != manager_input["uuid"]:
+        return "Manager replaced"
+    logged_from = datetime.fromisoformat(manager_input["validity"]["from"])
+    if current_manager.validity.from_date.date() > logged_from.date():
+        return "Manager changed after the update"
+    if (
+        str(current_manager.employee) == manager_input["person"]
+        and str(current_manager.manager_level.uuid) == manager_input["manager_level"]
+        and str(current_manager.manager_type.uuid) == manager_input["manager_type"]
+    ):
+        return "Manager already updated"
+    return None
+
+
+def replayed_manager_input(manager_input: dict) -> dict:
+    """
+    Input of a logged manager mutation to apply again, valid from today if it was
+    logged on an earlier day, so the history of the manager role since then is
+    kept.
+    """
+    logged_from = datetime.fromisoformat(manager_input["validity"]["from"]).date()
+    from_date = max(logged_from, datetime.today().date())
+    return {
+        **manager_input,
+        "validity": {**manager_input["validity"], "from": from_date.isoformat()},
+    }
+
+
+async def reconcile_mutation(
+    gql_client: PersistentGraphQLClient,
+    mutation_log: MutationLog,
+    entry_id: int,
+    name: str,
+    variables: dict[str, Any],
+) -> None:
+    """
+    Reconcile a mutation left in the mutation log against MO.
+
+    Terminations are idempotent and applied again. A manager is only created if
+    the org-unit still has no manager, and a manager is only updated if the
+    update is neither applied nor superseded (see `superseded_update`), as MO
+    holds newer changes otherwise. Managers are created and updated from today
+    (see `replayed_manager_input`). The entry is kept if MO cannot be reached.
+
+    Args:
+        gql_client: GraphQL client
+        mutation_log: Write-ahead log of the mutations
+        entry_id: Id of the entry
+        name: Name of the registered operation of the mutation
+        variables: Variables of the mutation
+    """
+    operation = REGISTRY.get(name)
+    if operation is None:
+        logger.warning("Unknown mutation in mutation log", operation=name)
+        mutation_log.done(entry_id)
+        return
+
+    try:
+        if operation in (CREATE_MANAGER, UPDATE_MANAGER):
+            manager_input = variables["input"]
+            org_unit_uuid = UUID(manager_input["org_unit"])
+            current_manager = await get_current_manager(gql_client, org_unit_uuid)
+            if operation is CREATE_MANAGER and current_manager is not None:
+                reason: str | None = "Manager already created"
+            elif operation is UPDATE_MANAGER:
+                reason = superseded_update(current_manager, manager_input)
+            else:
+                reason = None
+            if reason is not None:
+                logger.info(reason, operation=name, org_unit=str(org_unit_uuid))
+                mutation_log.done(entry_id)
+                return
+            variables = {**variables, "input": replayed_manager_input(manager_input)}
+        await execute_mutator(gql_client, operation, variables)
+    except TransportQueryError:
+        logger.exception("Logged mutation rejected by MO", operation=name)
+    except Exception:
+        logger.exception("Logged mutation failed", operation=name)
+        return
+    mutation_log.done(entry_id)
 
 
-# This function only delegates to other tested functions — no internal logic.
-async def update_mo_managers(  # pragma: no cover
+async def reconcile_mutations(
+    gql_client: PersistentGraphQLClient,
+    mutation_log: MutationLog,
+    write_limiter: WriteLimiter | None = None,
+) -> None:
+    """
+    Reconcile the mutations left in the mutation log, e.g. by a crash, against MO
+    (see `reconcile_mutation`).
+
+    The terminations are applied concurrently first, and then the manager
+    updates and creations, as these may replace a terminated manager. An entry
+    failing to be reconciled is kept, without failing the other entries.
+
+    Args:
+        gql_client: GraphQL client
+        mutation_log: Write-ahead log of the mutations
+        write_limiter: Rate limiter of the mutations
+    """
+    entries = mutation_log.pending()
+    if not entries:
+        return
+    logger.info("Reconciling logged mutations", mutations=len(entries))
+
+    terminations = {MANAGER_TERMINATE.name, ASSOCIATION_TERMINATE.name}
+    async with query_scope(write_limiter=write_limiter):
+        for batch in (
+            [entry for entry in entries if entry[1] in terminations],
+            [entry for entry in entries if entry[1] not in terminations],
+        ):
+            await asyncio.gather(
+                *(
+                    reconcile_mutation(gql_client, mutation_log, *entry)
+                    for entry in batch
+                )
+            )
+    logger.info("Logged mutations reconciled", pending=len(mutation_log))
+
+
+async def update_mo_managers(
     gql_client: PersistentGraphQLClient,
     org_unit_uuid: UUID,
     root_uuid: UUID,
     recursive: bool = True,
     dry_run: bool = False,
-) -> None:
-    """Main function for selecting and updating managers"""
+    read_cache: ReadCache | None = None,
+    state_store: StateStore | None = None,
+    write_limiter: WriteLimiter | None = None,
+    mutation_log: MutationLog | None = None,
+) -> dict[UUID, str]:
+    """
+    Main function for selecting and updating managers
 
-    logger.info("Check for unengaged managers...")
-    managers_to_terminate = await check_manager_engagement(
-        gql_client, org_unit_uuid, root_uuid, recursive=recursive
+    A "_leder" unit failing the selection or update of its manager does not stop
+    the run, but is skipped and returned with the error.
+    """
+
+    failures: dict[UUID, str] = {}
+    async with query_scope(read_cache, write_limiter, mutation_log) as scope:
+        await _update_mo_managers(
+            gql_client,
+            org_unit_uuid,
+            root_uuid,
+            recursive=recursive,
+            dry_run=dry_run,
+            state_store=state_store,
+            failures=failures,
+        )
+    logger.info(
+        "Run summary",
+        org_unit=str(org_unit_uuid),
+        writes=scope.writes,
+        write_wait=round(scope.write_wait, 3),
+        failed_units=sorted(map(str, failures)),
     )
-    logger.debug("Managers to terminate", managers_to_terminate=managers_to_terminate)
+    return failures
+
+
+async def find_managers_to_terminate(
+    gql_client: PersistentGraphQLClient,
+    graph: OrgGraph,
+    org_unit_uuid: UUID,
+    root_uuid: UUID,
+    recursive: bool,
+    changes: Changes | None,
+) -> list[OrgUnitManager]:
+    """
+    Find the managers without an active engagement in the org-units of a run.
 
+    Args:
+        gql_client: GraphQL client
+        graph: Org graph of the run
+        org_unit_uuid: UUID of the org-unit of the run
+        root_uuid: UUID of the root org-unit
+        recursive: If true, the descendants of the org-unit are checked as well
+        changes: Changes of a delta run, or None. Only the managers of the changed
+                 org-units (see `changed_managed_units`) are checked in delta runs.
+    Returns:
+        list of OrgUnitManager objects
+    """
+    if changes is not None:
+        results = await asyncio.gather(
+            *(
+                check_manager_engagement(
+                    gql_client, uuid, root_uuid, recursive=False, flags=graph.flags
+                )
+                for uuid in changed_managed_units(graph, changes)
+            )
+        )
+        return [manager for result in results for manager in result]
+    if recursive and get_settings().check_manager_roles:
+        # Like the tree traversals, only the descendants of the org-unit, and the
+        # org-unit itself only if it is the root
+        subtree = graph.subtree(graph.id(org_unit_uuid))
+        if org_unit_uuid != root_uuid:
+            subtree = subtree[1:]
+        return await check_manager_roles(
+            gql_client, {graph.uuids.uuid(id_) for id_ in subtree}, graph.flags
+        )
+    if recursive:
+        return await check_manager_engagement_by_level(
+            gql_client, org_unit_uuid, root_uuid, graph.flags
+        )
+    return await check_manager_engagement(
+        gql_client, org_unit_uuid, root_uuid, recursive=False, flags=graph.flags
+    )
+
+
+async def find_manager_org_units(
+    gql_client: PersistentGraphQLClient,
+    graph: OrgGraph,
+    org_unit_uuid: UUID,
+    recursive: bool,
+    full_run: bool,
+    changes: Changes | None,
+) -> list[OrgUnitManagers]:
+    """
+    Find the "_leder" units of a run.
+
+    Args:
+        gql_client: GraphQL client
+        graph: Org graph of the run
+        org_unit_uuid: UUID of the org-unit of the run
+        recursive: If true, the "_leder" units assigning managers to the
+                   descendants of the org-unit are found as well
+        full_run: True for runs of the whole organisation
+        changes: Changes of a delta run, or None. Only the "_leder" units affected
+                 by the changes (see `affected_leder_units`) are found in delta runs.
+    Returns:
+        list of '_leder' OrgUnitManagers
+    """
+    if changes is not None:
+        ids = affected_leder_units(graph, changes)
+    elif full_run:
+        # The "_leder" units are found by name in the lightweight listing of the
+        # org graph, so only these are fetched with their associations
+        ids = graph.leder_units()
+    else:
+        # Only the "_leder" units assigning managers to the requested org-unit
+        # (or its descendants, if recursive)
+        node = graph.id(org_unit_uuid)
+        scope = set(graph.subtree(node)) if recursive else {node}
+        ids = graph.leder_units_targeting(scope)
+    return await get_manager_org_units(
+        gql_client, graph.flags, [graph.uuids.uuid(id_) for id_ in ids]
+    )
+
+
+# Only sequences the phases of a run. The logic of each phase is in the
+# functions above, e.g. the bookkeeping of the run in `RunProgress`.
+async def _update_mo_managers(  # pragma: no cover
+    gql_client: PersistentGraphQLClient,
+    org_unit_uuid: UUID,
+    root_uuid: UUID,
+    recursive: bool,
+    dry_run: bool,
+    state_store: StateStore | None,
+    failures: dict[UUID, str],
+) -> None:
+    uuids = UUIDTable()
+    started_at = datetime.now(timezone.utc)
+    full_run = recursive and org_unit_uuid == root_uuid
+
+    logger.info("Loading org graph...")
+    if recursive:
+        graph = await load_org_graph(gql_client, uuids)
+    else:
+        graph = await load_org_subgraph(gql_client, uuids, org_unit_uuid)
+
+    # Delta runs only process the changes since the last run
+    changes = None
+    if full_run and state_store is not None:
+        changes = await get_run_changes(gql_client, state_store, started_at)
+    progress = RunProgress(
+        state_store,
+        started_at,
+        full_run=full_run,
+        delta=changes is not None,
+        dry_run=dry_run,
+        checkpoint_window=get_settings().checkpoint_window,
+    )
+
+    logger.info("Check for unengaged managers...")
+    managers_to_terminate = []
+    if progress.terminations_completed:
+        logger.info("Unengaged managers already terminated before the restart")
+    else:
+        managers_to_terminate = await find_managers_to_terminate(
+            gql_client, graph, org_unit_uuid, root_uuid, recursive, changes
+        )
     logger.info("Terminate unengaged managers", manager=managers_to_terminate)
-    for org_unit_manager in managers_to_terminate:
+    for org_unit_manager in progress.pending_terminations(managers_to_terminate):
         await terminate_manager(
             gql_client, org_unit_manager.manager_uuid, dry_run=dry_run
         )
+        progress.terminated(org_unit_manager)
+    progress.complete_terminations()
 
     logger.info("Getting manager org units (units ending in _leder)...")
-    manager_org_units = await get_manager_org_units(gql_client)
+    manager_org_units = await find_manager_org_units(
+        gql_client, graph, org_unit_uuid, recursive, full_run, changes
+    )
     logger.debug("Manager org units", manager_org_units=manager_org_units)
+    manager_targets = graph.manager_targets(
+        uuids.intern(org_unit.uuid) for org_unit in manager_org_units
+    )
+    # The units without a manager level are logged by `manager_targets`
+    manager_org_units = [
+        org_unit
+        for org_unit in manager_org_units
+        if uuids.intern(org_unit.uuid) in manager_targets
+    ]
+    engagement_from: dict[UUID, datetime | None] = {}
+    if state_store is not None:
+        # Also fetched in the same scope when selecting the managers
+        engagement_from = await get_engagement_froms(gql_client, manager_org_units)
+        manager_org_units = await skip_unchanged_org_units(
+            gql_client,
+            manager_org_units,
+            manager_targets,
+            uuids,
+            state_store,
+            progress.changed_org_units,
+            engagement_from,
+        )
+    manager_org_units = progress.unprocessed(manager_org_units)
 
     logger.info("Filter managers org units")
-    manager_org_units = await filter_manager_org_units(gql_client, manager_org_units)
+    manager_org_units = await filter_manager_org_units(
+        gql_client, manager_org_units, failures
+    )
 
     logger.info("Updating Managers")
-    for org_unit in manager_org_units:
-        await create_update_manager(gql_client, org_unit, dry_run=dry_run)
+    await create_update_managers(
+        gql_client,
+        [
+            (org_unit, manager_targets[uuids.intern(org_unit.uuid)])
+            for org_unit in manager_org_units
+        ],
+        failures,
+        dry_run=dry_run,
+        on_updated=lambda org_unit, target, managers: progress.processed(
+            org_unit, target, engagement_from, managers
+        ),
+    )
 
-    logger.debug("hurra")
+    progress.complete(failures)
     logger.info("Updating managers complete!")
@@ -3,15 +3,16 @@
 from uuid import UUID
 
 import structlog
-from gql import gql  # type: ignore
 from more_itertools import one
 from pydantic import BaseModel
 from raclients.graph.client import PersistentGraphQLClient  # type: ignore
 from ramodels.mo import Validity  # type: ignore
 
+from .operations import operation
 from .queries import QUERY_ORG
 
-QUERY_MANAGER_CLASSES = gql(
+QUERY_MANAGER_CLASSES = operation(
+    "QUERY_MANAGER_CLASSES",
     """
     query Facet {
         facets(filter: { user_keys: "manager_level" }) {
@@ -25,17 +26,18 @@ QUERY_MANAGER_CLASSES = gql(
             }
         }
     }
-    """
+    """,
 )
 
-MANAGER_LEVEL_CREATE = gql(
+MANAGER_LEVEL_CREATE = operation(
+    "MANAGER_LEVEL_CREATE",
     """
         mutation ($input: ClassCreateInput!){
             class_create (input: $input){
                 uuid
             }
         }
-    """
+    """,
 )
 
 logger = structlog.get_logger()
@@ -61,7 +63,7 @@ async def get_organisation(gql_client: PersistentGraphQLClient) -> UUID:
          UUID of the MO organisation
     """
 
-    r = await gql_client.execute(QUERY_ORG)
+    r = await gql_client.execute(QUERY_ORG.document)
     uuid = UUID(r["org"]["uuid"])
     logger.info("Got org UUID", uuid=uuid)
     return uuid
@@ -81,7 +83,7 @@ async def get_manager_level_facet_and_classes(
         manager level classes in MO.
     """
 
-    r = await gql_client.execute(QUERY_MANAGER_CLASSES)
+    r = await gql_client.execute(QUERY_MANAGER_CLASSES.document)
     facets = r.get("facets", {})
     facet = one(one(facets["objects"])["validities"])
     classes = facet.get("classes", [])
@@ -127,7 +129,7 @@ async def create_manager_level(
         gql_input["uuid"] = str(uuid)
 
     r = await gql_client.execute(
-        MANAGER_LEVEL_CREATE, variable_values={"input": gql_input}
+        MANAGER_LEVEL_CREATE.document, variable_values={"input": gql_input}
     )
     uuid = UUID(r["class_create"]["uuid"])
     logger.info("Create manager level", name=name, user_key=user_key, uuid=uuid)
@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from uuid import UUID
+
+
+class UUIDTable:
+    """
+    Per-run interning table mapping UUIDs to small integer ids.
+
+    Every distinct UUID is parsed once and given the next free id. The in-memory
+    indexes of a run are keyed by these ids, and the parsed UUID (or its string
+    form) can be looked up again from the id when building models or payloads.
+    """
+
+    def __init__(self) -> None:
+        self._ids: dict[str, int] = {}
+        self._uuids: list[UUID] = []
+        self._strs: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self._uuids)
+
+    def __contains__(self, value: object) -> bool:
+        return str(value) in self._ids
+
+    def intern(self, value: str | UUID) -> int:
+        """
+        Get the id of a UUID, assigning a new id if it has not been seen before.
+
+        Args:
+            value: UUID or UUID string
+        Returns:
+            integer id of the UUID
+        """
+        key = str(value)
+        try:
+            return self._ids[key]
+        except KeyError:
+            pass
+
+        uuid = value if isinstance(value, UUID) else UUID(key)
+        canonical = str(uuid)
+        id_ = self._ids.get(canonical)
+        if id_ is None:
+            id_ = len(self._uuids)
+            self._uuids.append(uuid)
+            self._strs.append(canonical)
+            self._ids[canonical] = id_
+        # Also remember non-canonical spellings (e.g. upper case) of the UUID
+        self._ids[key] = id_
+        return id_
+
+    def intern_mapping(self, mapping: dict[str, str]) -> dict[int, int]:
+        """Intern both keys and values of a UUID to UUID mapping."""
+        return {self.intern(key): self.intern(value) for key, value in mapping.items()}
+
+    def uuid(self, id_: int) -> UUID:
+        """Reverse lookup of the UUID with the given id."""
+        return self._uuids[id_]
+
+    def as_str(self, id_: int) -> str:
+        """Reverse lookup of the canonical string form of the UUID with the given id."""
+        return self._strs[id_]
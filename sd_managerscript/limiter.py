@@ -0,0 +1,218 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+import time
+from collections import deque
+from collections.abc import Callable
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class AdaptiveLimiter:
+    """
+    Adaptive limit on the number of concurrent requests to MO (AIMD).
+
+    The limit is raised by one after each window of requests with a p95 latency
+    within the target and an error rate within the threshold, and halved when a
+    request times out or fails with a 5xx response. The limit is halved at most
+    once per cooldown, so a burst of failures of requests sent at the same limit
+    only counts once.
+    """
+
+    def __init__(
+        self,
+        initial: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 100,
+        latency_target: float = 2.0,
+        error_threshold: float = 0.05,
+        window: int = 20,
+        cooldown: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            initial: Initial limit
+            min_limit: Minimum limit
+            max_limit: Maximum limit
+            latency_target: Maximum healthy p95 latency in seconds
+            error_threshold: Maximum healthy fraction of overloaded requests
+            window: Number of requests between increases of the limit
+            cooldown: Minimum seconds between decreases of the limit
+            clock: Monotonic clock
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.error_threshold = error_threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.clock = clock
+        self.in_flight = 0
+        self.requests = 0
+        self.overloads = 0
+        self._samples: deque[tuple[float, bool]] = deque(maxlen=window)
+        self._since_adjust = 0
+        self._last_decrease = -cooldown
+        self._waiters: list[asyncio.Future] = []
+
+    def p95(self) -> float:
+        """p95 latency of the last window of requests."""
+        if not self._samples:
+            return 0.0
+        latencies = sorted(latency for latency, _ in self._samples)
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+    def error_rate(self) -> float:
+        """Fraction of overloaded requests in the last window."""
+        if not self._samples:
+            return 0.0
+        return sum(overloaded for _, overloaded in self._samples) / len(self._samples)
+
+    async def acquire(self) -> None:
+        """Wait until a request may be sent."""
+        while self.in_flight >= int(self.limit):
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            finally:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+        self.in_flight += 1
+
+    def release(self, latency: float, overloaded: bool, record: bool = True) -> None:
+        """
+        Record a completed request and adjust the limit.
+
+        Args:
+            latency: Seconds the request took
+            overloaded: True if the request timed out, failed with a network error or
+                        failed with a 5xx response
+            record: If false, only release the slot, e.g. for a cancelled request
+                    whose latency says nothing about MO
+        """
+        self.in_flight -= 1
+        if not record:
+            self._wake()
+            return
+        self.requests += 1
+        self._samples.append((latency, overloaded))
+        self._since_adjust += 1
+
+        if overloaded:
+            self.overloads += 1
+            now = self.clock()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self._since_adjust = 0
+                self.limit = max(self.min_limit, self.limit / 2)
+                logger.info("Concurrency limit decreased", limit=int(self.limit))
+        elif self._since_adjust >= self.window:
+            self._since_adjust = 0
+            healthy = (
+                self.p95() <= self.latency_target
+                and self.error_rate() <= self.error_threshold
+            )
+            if healthy and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1)
+                logger.debug("Concurrency limit increased", limit=int(self.limit))
+        self._wake()
+
+    def _wake(self) -> None:
+        # Wake the waiting requests, which recheck the limit
+        for future in self._waiters:
+            if not future.done():
+                future.set_result(None)
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "overloads": self.overloads,
+            "p95_latency": round(self.p95(), 3),
+            "error_rate": round(self.error_rate(), 3),
+        }
+
+
+class WriteLimiter:
+    """
+    Token bucket limiting the rate of mutations to MO, with its own limit on the
+    number of concurrent mutations.
+
+    Mutations are heavier on MO than queries, so they are limited separately from
+    the (adaptive) concurrency of the queries, which keep flowing while mutations
+    wait for a token.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        concurrency: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            rate: Tokens (mutations) per second
+            burst: Capacity of the bucket
+            concurrency: Maximum number of concurrent mutations
+            clock: Monotonic clock
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.writes = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """
+        Wait for a token and a free concurrency slot.
+
+        Returns:
+            Seconds waited
+        """
+        started = self.clock()
+        await self._semaphore.acquire()
+        try:
+            # Tokens are handed out in order of arrival
+            async with self._lock:
+                self._refill()
+                while self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    self._refill()
+                self.tokens -= 1
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        wait = self.clock() - started
+        self.writes += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def release(self) -> None:
+        """Free the concurrency slot of a completed mutation."""
+        self._semaphore.release()
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "writes": self.writes,
+            "total_wait": round(self.total_wait, 3),
+            "max_wait": round(self.max_wait, 3),
+        }
@@ -1,20 +1,41 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
+import asyncio
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 from contextlib import AsyncExitStack
+from functools import partial
 from typing import Any
 from uuid import UUID
 
+import httpx
 import structlog
 from fastapi import FastAPI
+from fastapi import HTTPException
 from raclients.graph.client import PersistentGraphQLClient  # type: ignore
 
+from .cache import ReadCache
 from .config import get_settings
 from .config import Settings
+from .events import Broker
+from .events import Debouncer
+from .events import start_consumer
+from .hedging import Hedger
+from .holstebro_managers import check_employee_managers
+from .holstebro_managers import reconcile_mutations
+from .holstebro_managers import update_leder_unit
 from .holstebro_managers import update_mo_managers  # type: ignore
 from .init import create_missing_manager_levels
+from .limiter import AdaptiveLimiter
+from .limiter import WriteLimiter
 from .log import setup_logging
+from .manager_index import ManagerIndex
+from .models import Event
+from .mutation_log import MutationLog
+from .pool import PoolMonitor
+from .state import StateStore
+from .transport import accept_encoding
+from .transport import FastJSONTransport
 
 logger = structlog.get_logger()
 
@@ -26,15 +47,36 @@ def construct_context() -> dict[str, Any]:
 
 def construct_client(
     settings: Settings,
+    pool_monitor: PoolMonitor | None = None,
 ) -> PersistentGraphQLClient:
     """Construct clients froms settings.
 
     Args:
         settings: Integration settings module.
+        pool_monitor: Statistics of the connection pool wait time
 
     Returns:
         PersistentGraphQLClient.
     """
+    timeout = httpx.Timeout(
+        settings.graphql_timeout,
+        connect=settings.graphql_connect_timeout or settings.graphql_timeout,
+        pool=settings.graphql_pool_timeout or settings.graphql_timeout,
+    )
+    limits = httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry,
+    )
+    httpx_client_kwargs: dict[str, Any] = {
+        "timeout": timeout,
+        "limits": limits,
+        "http2": settings.http2,
+        "headers": {"Accept-Encoding": accept_encoding(settings.http_compression)},
+    }
+    if pool_monitor is not None:
+        httpx_client_kwargs["event_hooks"] = {"request": [pool_monitor.on_request]}
+
     gql_client = PersistentGraphQLClient(
         url=settings.mo_url + "/graphql/v22",
         client_id=settings.client_id,
@@ -42,7 +84,27 @@ def construct_client(
         auth_server=settings.auth_server,
         auth_realm=settings.auth_realm,
         execute_timeout=settings.graphql_timeout,
-        httpx_client_kwargs={"timeout": settings.graphql_timeout},
+        httpx_client_kwargs=httpx_client_kwargs,
+    )
+    # Replace the transport of Ra-clients with one decoding responses faster
+    gql_client.transport = FastJSONTransport(
+        url=gql_client.transport.url,
+        client_cls=gql_client.transport.client_cls,
+        client_args=gql_client.transport.client_args,
+        persisted_queries=settings.graphql_persisted_queries,
+        limiter=AdaptiveLimiter(
+            initial=settings.concurrency_initial,
+            max_limit=settings.concurrency_max,
+            latency_target=settings.concurrency_latency_target,
+        )
+        if settings.adaptive_concurrency
+        else None,
+        hedger=Hedger(settings.hedge_percentile, settings.hedge_max_ratio)
+        if settings.hedged_reads
+        else None,
+        retry_attempts=settings.retry_attempts,
+        retry_backoff=settings.retry_backoff,
+        retry_backoff_max=settings.retry_backoff_max,
     )
     logger.info("Created graphql client")
 
@@ -59,13 +121,84 @@ def create_app(*args: Any, **kwargs: Any) -> FastAPI:
     @asynccontextmanager
     async def lifespan(app: FastAPI) -> AsyncGenerator:
         async with AsyncExitStack() as stack:
-            gql_client = construct_client(settings)
-            context["gql_client"] = await stack.enter_async_context(gql_client)
+            context["pool_monitor"] = PoolMonitor(settings.http_pool_wait_warning)
+            # The client is used as returned by entering it, like in the endpoints
+            gql_client = await stack.enter_async_context(
+                construct_client(settings, context["pool_monitor"])
+            )
+            context["gql_client"] = gql_client
             context["root_uuid"] = settings.root_uuid
+            context["failed_units"] = {}
+            context["read_cache"] = ReadCache(
+                settings.read_cache_maxsize,
+                settings.read_cache_ttl,
+                settings.read_cache_ttls,
+            )
+            context["state_store"] = None
+            if settings.state_store_path is not None:
+                state_store = StateStore(settings.state_store_path)
+                stack.callback(state_store.close)
+                context["state_store"] = state_store
+            context["mutation_log"] = None
+            if settings.mutation_log_path is not None:
+                mutation_log = MutationLog(settings.mutation_log_path)
+                stack.callback(mutation_log.close)
+                context["mutation_log"] = mutation_log
+            context["write_limiter"] = None
+            if settings.write_rate > 0:
+                context["write_limiter"] = WriteLimiter(
+                    settings.write_rate,
+                    settings.write_burst,
+                    settings.write_concurrency,
+                )
+
+            context["broker"] = None
+            if settings.event_consumer:
+                broker = Broker()
+                manager_index = ManagerIndex()
+                leder_units = Debouncer(
+                    settings.event_debounce,
+                    partial(
+                        update_leder_unit,
+                        gql_client,
+                        read_cache=context["read_cache"],
+                        write_limiter=context["write_limiter"],
+                        mutation_log=context["mutation_log"],
+                    ),
+                )
+                employees = Debouncer(
+                    settings.event_debounce,
+                    partial(
+                        check_employee_managers,
+                        gql_client,
+                        root_uuid=settings.root_uuid,
+                        manager_index=manager_index,
+                        write_limiter=context["write_limiter"],
+                        mutation_log=context["mutation_log"],
+                    ),
+                )
+                consumer = asyncio.create_task(
+                    start_consumer(
+                        gql_client,
+                        broker,
+                        leder_units,
+                        employees,
+                        manager_index,
+                        context["read_cache"],
+                    )
+                )
+                stack.callback(consumer.cancel)
+                stack.callback(leder_units.cancel)
+                stack.callback(employees.cancel)
+                context["broker"] = broker
 
             await create_missing_manager_levels(
                 gql_client, settings.manager_level_create
             )
+            if context["mutation_log"] is not None:
+                await reconcile_mutations(
+                    gql_client, context["mutation_log"], context["write_limiter"]
+                )
 
             yield
 
@@ -75,26 +208,83 @@ def create_app(*args: Any, **kwargs: Any) -> FastAPI:
     async def index() -> dict[str, str]:
         return {"Integration": "SD Managersync"}
 
+    @app.get("/metrics")
+    async def metrics() -> dict[str, Any]:
+        """Statistics of the connections to MO"""
+        transport = context["gql_client"].transport
+        return {
+            "http_pool": context["pool_monitor"].summary(),
+            "transport": transport.summary(),
+            "concurrency": transport.limiter.summary() if transport.limiter else None,
+            "hedging": transport.hedger.summary() if transport.hedger else None,
+            "writes": context["write_limiter"].summary()
+            if context["write_limiter"]
+            else None,
+        }
+
     @app.post("/trigger/single/{ou_uuid}")
     async def update_single_org_unit(ou_uuid: UUID, dry_run: bool = False) -> None:
         logger.info("Updating org unit", uuid=ou_uuid)
         gql_client = context["gql_client"]
         root_uuid = context["root_uuid"]
-        await update_mo_managers(
+        failures = await update_mo_managers(
             gql_client=gql_client,
             org_unit_uuid=ou_uuid,
             root_uuid=root_uuid,
             recursive=False,
             dry_run=dry_run,
+            read_cache=context["read_cache"],
+            state_store=context["state_store"],
+            write_limiter=context["write_limiter"],
+            mutation_log=context["mutation_log"],
         )
+        context["failed_units"].update(failures)
 
     @app.post("/trigger/all", status_code=202)
     async def run_update() -> None:
         """Starts update process of managers"""
         gql_client = context["gql_client"]
         root_uuid = context["root_uuid"]
-        await update_mo_managers(
-            gql_client=gql_client, org_unit_uuid=root_uuid, root_uuid=root_uuid
+        context["failed_units"] = await update_mo_managers(
+            gql_client=gql_client,
+            org_unit_uuid=root_uuid,
+            root_uuid=root_uuid,
+            read_cache=context["read_cache"],
+            state_store=context["state_store"],
+            write_limiter=context["write_limiter"],
+            mutation_log=context["mutation_log"],
         )
 
+    @app.post("/trigger/retry")
+    async def retry_failed_units(dry_run: bool = False) -> dict[UUID, str]:
+        """
+        Retry the "_leder" units which failed in the previous runs. Returns the
+        units which still fail.
+        """
+        failed_units: dict[UUID, str] = context["failed_units"]
+        for org_unit_uuid in list(failed_units):
+            try:
+                await update_leder_unit(
+                    context["gql_client"],
+                    org_unit_uuid,
+                    dry_run=dry_run,
+                    read_cache=context["read_cache"],
+                    write_limiter=context["write_limiter"],
+                    mutation_log=context["mutation_log"],
+                )
+            except Exception as error:
+                logger.exception("Retry failed", org_unit=str(org_unit_uuid))
+                failed_units[org_unit_uuid] = repr(error)
+            else:
+                del failed_units[org_unit_uuid]
+        return failed_units
+
+    @app.post("/events", status_code=202)
+    async def publish_event(event: Event) -> None:
+        """Publish a change event to the event consumer"""
+        broker = context["broker"]
+        if broker is None:
+            raise HTTPException(status_code=503, detail="Event consumer disabled")
+        await broker.publish(event)
+
     return app
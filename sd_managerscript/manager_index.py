@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from uuid import UUID
+
+import structlog
+from more_itertools import one
+from raclients.graph.client import PersistentGraphQLClient  # type: ignore
+
+from .config import get_settings
+from .queries import QUERY_MANAGER_ROLES
+from .util import query_paginated
+
+logger = structlog.get_logger()
+
+
+class ManagerIndex:
+    """
+    Reverse index from employee to the org-units in which they hold a manager role.
+
+    The index is loaded from the current manager roles in MO, and kept current by
+    refreshing the roles of changed managers.
+    """
+
+    def __init__(self) -> None:
+        # employee UUID -> manager UUID -> org-unit UUID
+        self._roles: dict[UUID, dict[UUID, UUID]] = {}
+        # manager UUID -> employee UUID
+        self._employees: dict[UUID, UUID] = {}
+
+    def __len__(self) -> int:
+        return len(self._employees)
+
+    def add(self, manager_uuid: UUID, employee_uuid: UUID, org_unit_uuid: UUID) -> None:
+        self.remove(manager_uuid)
+        self._roles.setdefault(employee_uuid, {})[manager_uuid] = org_unit_uuid
+        self._employees[manager_uuid] = employee_uuid
+
+    def remove(self, manager_uuid: UUID) -> None:
+        employee_uuid = self._employees.pop(manager_uuid, None)
+        if employee_uuid is None:
+            return
+        roles = self._roles[employee_uuid]
+        del roles[manager_uuid]
+        if not roles:
+            del self._roles[employee_uuid]
+
+    def org_units(self, employee_uuid: UUID) -> set[UUID]:
+        """The org-units in which the employee holds a manager role."""
+        return set(self._roles.get(employee_uuid, {}).values())
+
+    async def refresh(
+        self,
+        gql_client: PersistentGraphQLClient,
+        manager_uuids: list[UUID] | None = None,
+    ) -> None:
+        """
+        Load the current manager roles from MO.
+
+        Args:
+            gql_client: GraphQL client
+            manager_uuids: UUIDs of the manager roles to refresh. All manager roles
+                           are reloaded if not given.
+        """
+        objects = await query_paginated(
+            gql_client,
+            QUERY_MANAGER_ROLES,
+            {
+                "uuids": None
+                if manager_uuids is None
+                else [str(uuid) for uuid in manager_uuids]
+            },
+            get_settings().graphql_page_size,
+        )
+        if manager_uuids is None:
+            self._roles.clear()
+            self._employees.clear()
+        else:
+            for manager_uuid in manager_uuids:
+                self.remove(manager_uuid)
+
+        for obj in objects:
+            validity = one(obj["validities"])
+            # Vacant manager roles have no employee
+            if validity["employee_uuid"] is None:
+                continue
+            self.add(
+                UUID(validity["uuid"]),
+                UUID(validity["employee_uuid"]),
+                UUID(validity["org_unit_uuid"]),
+            )
+        logger.debug("Manager index refreshed", managers=len(self))
@@ -1,24 +1,71 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
 from datetime import datetime
+from functools import partial
 from uuid import UUID
 
 import structlog
 from raclients.graph.client import PersistentGraphQLClient  # type: ignore
 
+from .config import get_settings
 from .models import EngagementFrom
+from .queries import QUERY_CURRENT_ENGAGEMENTS
 from .queries import QUERY_ENGAGEMENTS
+from .util import DataLoader
+from .util import get_loader
 from .util import query_graphql
 
 logger = structlog.get_logger()
 
 
+async def load_engagements(
+    gql_client: PersistentGraphQLClient, employee_uuids: list[UUID]
+) -> dict[UUID, list[dict]]:
+    """
+    Batch load the engagement validities of employees (see `DataLoader`).
+
+    Only the current engagements are fetched, unless the engagement history is
+    enabled in the settings.
+
+    Args:
+        gql_client: GraphQL client
+        employee_uuids: UUIDs of the employees
+    Returns:
+        Engagement validities by employee UUID
+    """
+    variables = {"uuid": [str(uuid) for uuid in employee_uuids]}
+    if get_settings().engagement_history:
+        engagements = await query_graphql(gql_client, QUERY_ENGAGEMENTS, variables)
+        validities = [
+            validity
+            for eng in engagements["engagements"]["objects"]
+            for validity in eng["validities"]
+        ]
+    else:
+        engagements = await query_graphql(
+            gql_client, QUERY_CURRENT_ENGAGEMENTS, variables
+        )
+        validities = [
+            eng["current"]
+            for eng in engagements["engagements"]["objects"]
+            if eng["current"] is not None
+        ]
+    logger.debug("Engagements fetched.", response=engagements)
+
+    by_employee: dict[UUID, list[dict]] = {}
+    for validity in validities:
+        by_employee.setdefault(UUID(validity["employee_uuid"]), []).append(validity)
+    return by_employee
+
+
 async def get_active_engagements(
     gql_client: PersistentGraphQLClient, employee_uuid: UUID
 ) -> EngagementFrom:
     """
     Checks the manager has an active engagement and returns the latest, if any.
 
+    The engagements of concurrently checked employees are fetched in one query.
+
     Args:
         gql_client: GraphQL client
         employee_uuid: UUID for the employee we want to fetch engagements for.
@@ -27,15 +74,20 @@ async def get_active_engagements(
 
     """
 
-    variables = {"uuid": employee_uuid}
-    engagements = await query_graphql(gql_client, QUERY_ENGAGEMENTS, variables)
-    logger.debug("Engagements fetched.", response=engagements)
+    loader = get_loader(
+        "engagements",
+        lambda: DataLoader(
+            partial(load_engagements, gql_client),
+            get_settings().graphql_batch_size,
+            default=[],
+        ),
+    )
+    validities = await loader.load(UUID(str(employee_uuid)))
     latest_from_date = None
 
-    if engagements["engagements"]["objects"]:
+    if validities:
         latest_from_date = max(
             datetime.fromisoformat(validity["validity"]["from"])
-            for eng in engagements["engagements"]["objects"]
-            for validity in eng["validities"]
+            for validity in validities
         )
     return EngagementFrom(employee_uuid=employee_uuid, engagement_from=latest_from_date)
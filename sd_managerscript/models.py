@@ -73,6 +73,15 @@ class OrgUnitManager(BaseModel):
     manager_uuid: UUID
 
 
+class ManagerTarget(BaseModel):
+    """The org-units a "_leder" unit assigns its manager to, and the manager level"""
+
+    org_units: list[UUID] = Field(
+        description="UUIDs of the org-units the manager is assigned to."
+    )
+    manager_level: ManagerLevel = Field(description="Manager level object.")
+
+
 class OrgUnitManagers(BaseModel):
     """
     Organisation unit with managers
@@ -95,3 +104,21 @@ class OrgUnitManagers(BaseModel):
 class EngagementFrom(BaseModel):
     employee_uuid: UUID = Field(description="UUID of the related employee.")
     engagement_from: datetime | None = Field(description="Engagement from date.")
+
+
+class Changes(BaseModel):
+    """Org-units and employees changed in MO since a point in time"""
+
+    org_units: set[UUID] = Field(
+        set(), description="UUIDs of changed org-units, incl. their roles."
+    )
+    employees: set[UUID] = Field(set(), description="UUIDs of changed employees.")
+
+
+class Event(BaseModel):
+    """Change event, e.g. from the MO AMQP exchange"""
+
+    routing_key: str = Field(
+        description='Type of the changed object, e.g. "org_unit" or "association".'
+    )
+    uuid: UUID = Field(description="UUID of the changed object.")
@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import json
+import sqlite3
+import time
+from typing import Any
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class MutationLog:
+    """
+    Local SQLite write-ahead log of the mutations sent to MO.
+
+    A mutation is appended to the log before it is sent, and removed when MO has
+    answered. Entries left in the log, e.g. when the process died while waiting
+    for MO, are mutations which may or may not have been applied, and are
+    reconciled against MO on startup (see
+    `holstebro_managers.reconcile_mutations`).
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path: Path of the SQLite database, or ":memory:"
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS mutations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    operation TEXT NOT NULL,
+                    variables TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __len__(self) -> int:
+        row = self._connection.execute("SELECT COUNT(*) FROM mutations").fetchone()
+        count: int = row[0]
+        return count
+
+    def append(self, operation: str, variables: dict[str, Any]) -> int:
+        """
+        Log a mutation before it is sent.
+
+        Args:
+            operation: Name of the registered operation (see `operations.operation`)
+            variables: Variables of the mutation
+        Returns:
+            Id of the entry
+        """
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO mutations (operation, variables, created_at) "
+                "VALUES (?, ?, ?)",
+                (operation, json.dumps(variables, default=str), time.time()),
+            )
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def done(self, entry_id: int) -> None:
+        """Remove the entry of a mutation MO has answered."""
+        with self._connection:
+            self._connection.execute("DELETE FROM mutations WHERE id = ?", (entry_id,))
+
+    def pending(self) -> list[tuple[int, str, dict[str, Any]]]:
+        """Entries of the mutations which may not have been applied, oldest first."""
+        rows = self._connection.execute(
+            "SELECT id, operation, variables FROM mutations ORDER BY id"
+        ).fetchall()
+        return [
+            (entry_id, name, json.loads(variables))
+            for entry_id, name, variables in rows
+        ]
@@ -0,0 +1,70 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import hashlib
+from textwrap import dedent
+
+from gql import gql  # type: ignore
+from graphql import DocumentNode
+
+
+class Operation:
+    """
+    A GraphQL operation of the integration with a stable name and hash.
+
+    The document is parsed at first use rather than at import. The SHA-256 hash of
+    the source is the key of the operation in automatic persisted queries (see
+    `transport.FastJSONTransport`).
+    """
+
+    def __init__(self, name: str, source: str) -> None:
+        """
+        Args:
+            name: Name of the operation in the registry, e.g. "QUERY_ENGAGEMENTS"
+            source: GraphQL source of the operation
+        """
+        self.name = name
+        self.source = dedent(source).strip()
+        self.sha256 = hashlib.sha256(self.source.encode()).hexdigest()
+        self._document: DocumentNode | None = None
+
+    def __repr__(self) -> str:
+        return f"Operation({self.name!r})"
+
+    @property
+    def document(self) -> DocumentNode:
+        """The parsed document, parsed once at first use."""
+        if self._document is None:
+            self._document = gql(self.source)
+            _by_document[id(self._document)] = self
+        return self._document
+
+    @property
+    def parsed(self) -> bool:
+        return self._document is not None
+
+
+# Operations by name
+REGISTRY: dict[str, Operation] = {}
+# Operations by id of their parsed document
+_by_document: dict[int, Operation] = {}
+
+
+def operation(name: str, source: str) -> Operation:
+    """
+    Register a GraphQL operation.
+
+    Args:
+        name: Unique name of the operation
+        source: GraphQL source of the operation
+    Returns:
+        Operation
+    """
+    if name in REGISTRY:
+        raise ValueError(f"Operation {name} is already registered")
+    REGISTRY[name] = Operation(name, source)
+    return REGISTRY[name]
+
+
+def lookup_operation(document: DocumentNode) -> Operation | None:
+    """The registered operation of a parsed document, if any."""
+    return _by_document.get(id(document))
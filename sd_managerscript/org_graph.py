@@ -0,0 +1,322 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+from collections.abc import Iterable
+from typing import Any
+from uuid import UUID
+
+import structlog
+from more_itertools import chunked
+from more_itertools import one
+from raclients.graph.client import PersistentGraphQLClient  # type: ignore
+
+from .classification import classify
+from .classification import is_manager_unit
+from .classification import OrgUnitFlag
+from .classification import OrgUnitFlags
+from .config import get_settings
+from .interning import UUIDTable
+from .models import ManagerLevel
+from .models import ManagerTarget
+from .operations import Operation
+from .queries import QUERY_ORG_UNIT_CHILD_NODES
+from .queries import QUERY_ORG_UNIT_NODES
+from .queries import QUERY_ORG_UNIT_TREE
+from .util import query_graphql
+from .util import query_paginated
+
+logger = structlog.get_logger()
+
+
+class OrgGraph:
+    """
+    In-memory index of the org-unit hierarchy.
+
+    Org-units are identified by their ids in the UUID interning table of the run,
+    and the parent, children and org-unit level of each org-unit are stored in
+    arrays indexed by these ids. An Euler tour of the tree gives subtree slices,
+    and the target org-units of every "_leder" unit are computed once when the
+    graph is built. No hierarchy question needs a query to MO once the graph is
+    loaded.
+    """
+
+    def __init__(self, uuids: UUIDTable, org_units: Iterable[dict[str, Any]]) -> None:
+        """
+        Build the graph.
+
+        Args:
+            uuids: UUID interning table of the run
+            org_units: org-unit validities with "uuid", "name", "parent_uuid" and
+                       "org_unit_level_uuid" keys (see QUERY_ORG_UNIT_TREE)
+        """
+        self.uuids = uuids
+        self.flags = OrgUnitFlags(uuids)
+
+        nodes = [
+            (
+                uuids.intern(org_unit["uuid"]),
+                org_unit["name"],
+                org_unit.get("parent_uuid"),
+                org_unit.get("org_unit_level_uuid"),
+            )
+            for org_unit in org_units
+        ]
+        node_ids = {id_ for id_, *_ in nodes}
+        # Interning the level and parent UUIDs below may grow the table further
+        size = len(uuids)
+
+        self.parent = [-1] * size
+        self.children: list[list[int]] = [[] for _ in range(size)]
+        self.level = [-1] * size
+        self.names: dict[int, str] = {}
+        for id_, name, parent_uuid, level_uuid in nodes:
+            self.names[id_] = name
+            self.flags.add(uuids.as_str(id_), name)
+            if level_uuid is not None:
+                self.level[id_] = uuids.intern(level_uuid)
+            # Root org-units have the organisation (or nothing) as parent
+            if parent_uuid is not None and uuids.intern(parent_uuid) in node_ids:
+                self.parent[id_] = uuids.intern(parent_uuid)
+                self.children[self.parent[id_]].append(id_)
+        self._size = size
+        self.roots = [id_ for id_, *_ in nodes if self.parent[id_] == -1]
+
+        self._euler_tour()
+        self._leder_units = [
+            id_ for id_ in self.order if is_manager_unit(self.flags.by_id(id_))
+        ]
+        self._targets = {
+            leder_unit: self._target_units(leder_unit)
+            for leder_unit in self._leder_units
+        }
+        # Org-units changed (e.g. renamed) since the graph was loaded
+        self._changed: set[int] = set()
+        # Target org-unit -> "_leder" units assigning their manager to it
+        self._targeted_by: dict[int, set[int]] = {}
+        for leder_unit, targets in self._targets.items():
+            for target in targets:
+                self._targeted_by.setdefault(target, set()).add(leder_unit)
+
+    def _euler_tour(self) -> None:
+        """Compute entry/exit times and pre-order of every org-unit."""
+        self.tin = [-1] * self._size
+        self.tout = [-1] * self._size
+        self.order: list[int] = []
+
+        for root in self.roots:
+            stack = [(root, False)]
+            while stack:
+                node, exiting = stack.pop()
+                if exiting:
+                    self.tout[node] = len(self.order) - 1
+                    continue
+                self.tin[node] = len(self.order)
+                self.order.append(node)
+                stack.append((node, True))
+                for child in reversed(self.children[node]):
+                    stack.append((child, False))
+
+    def _target_units(self, leder_unit: int) -> list[int]:
+        targets = []
+        node = self.parent[leder_unit]
+        while node != -1:
+            targets.append(node)
+            if OrgUnitFlag.LED_ADM not in self.flags.by_id(node):
+                break
+            node = self.parent[node]
+        return targets
+
+    def __contains__(self, id_: int) -> bool:
+        return 0 <= id_ < self._size and self.tin[id_] != -1
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def id(self, uuid: UUID | str) -> int:
+        """Interned id of an org-unit UUID."""
+        return self.uuids.intern(uuid)
+
+    def subtree(self, node: int) -> list[int]:
+        """All org-units in the subtree of `node` (including itself) in pre-order."""
+        if node not in self:
+            return []
+        return self.order[self.tin[node] : self.tout[node] + 1]
+
+    def leder_units(self) -> list[int]:
+        """All "_leder" units not excluded with the "Ø_" prefix."""
+        return list(self._leder_units)
+
+    def mark_changed(self, uuid: UUID | str) -> None:
+        """Mark an org-unit as changed (e.g. renamed) since the graph was loaded."""
+        self._changed.add(self.id(uuid))
+
+    def may_be_leder_unit(self, uuid: UUID | str) -> bool:
+        """
+        Return False if the org-unit is known not to be a "_leder" unit, i.e. it is
+        in the graph, is no "_leder" unit and has not changed since.
+        """
+        if uuid not in self.uuids:
+            return True
+        id_ = self.id(uuid)
+        return (
+            id_ not in self
+            or id_ in self._changed
+            or is_manager_unit(self.flags.by_id(id_))
+        )
+
+    def manager_target_units(self, leder_unit: int) -> list[int]:
+        """
+        The effective set of org-units a "_leder" unit assigns its manager to.
+
+        This is the parent of the "_leder" unit, and if the parent is a "led-adm"
+        unit also the parent of that, following chains of "led-adm" units upwards.
+        The last org-unit is the highest ranking one.
+        """
+        if leder_unit in self._targets:
+            return self._targets[leder_unit]
+        return self._target_units(leder_unit)
+
+    def leder_units_targeting(self, org_units: set[int]) -> list[int]:
+        """The "_leder" units assigning their manager to any of the org-units."""
+        targeting = set().union(
+            *(self._targeted_by.get(org_unit, ()) for org_unit in org_units)
+        )
+        return [
+            leder_unit for leder_unit in self._leder_units if leder_unit in targeting
+        ]
+
+    def manager_targets(
+        self, leder_units: Iterable[int] | None = None
+    ) -> dict[int, ManagerTarget]:
+        """
+        Compute the target org-units and manager level of "_leder" units.
+
+        The manager level is based on the org-unit level of the highest ranking
+        target org-unit.
+
+        Args:
+            leder_units: ids of the "_leder" units. Defaults to all of them.
+        Returns:
+            Mapping from "_leder" unit id to ManagerTarget. Units without a parent
+            in the graph, or with an org-unit level missing from the manager level
+            mapping, are left out.
+        """
+        manager_level_ids = self.uuids.intern_mapping(
+            get_settings().manager_level_mapping
+        )
+        if leder_units is None:
+            leder_units = self.leder_units()
+
+        manager_targets = {}
+        for leder_unit in leder_units:
+            if leder_unit not in self:
+                continue
+            targets = self.manager_target_units(leder_unit)
+            level_id = self.level[targets[-1]] if targets else -1
+            if level_id not in manager_level_ids:
+                logger.warning(
+                    "No manager level for org-unit",
+                    org_unit=self.uuids.as_str(leder_unit),
+                )
+                continue
+            manager_targets[leder_unit] = ManagerTarget(
+                org_units=[self.uuids.uuid(target) for target in targets],
+                manager_level=ManagerLevel(
+                    uuid=self.uuids.uuid(manager_level_ids[level_id])
+                ),
+            )
+        return manager_targets
+
+
+async def load_org_graph(
+    gql_client: PersistentGraphQLClient, uuids: UUIDTable
+) -> OrgGraph:
+    """
+    Load the org-unit hierarchy from MO with a paginated, lightweight listing of
+    all org-units.
+
+    Args:
+        gql_client: GraphQL client
+        uuids: UUID interning table of the run
+    Returns:
+        OrgGraph
+    """
+    objects = await query_paginated(
+        gql_client, QUERY_ORG_UNIT_TREE, {}, get_settings().graphql_page_size
+    )
+    graph = OrgGraph(uuids, (one(obj["validities"]) for obj in objects))
+    logger.info("Org graph loaded", org_units=len(graph))
+    return graph
+
+
+async def _query_org_unit_nodes(
+    gql_client: PersistentGraphQLClient, query: Operation, org_unit_uuids: list[str]
+) -> list[dict[str, Any]]:
+    results = await asyncio.gather(
+        *(
+            query_graphql(gql_client, query, {"uuids": chunk})
+            for chunk in chunked(org_unit_uuids, get_settings().graphql_batch_size)
+        )
+    )
+    return [
+        one(obj["validities"])
+        for data in results
+        for obj in data["org_units"]["objects"]
+    ]
+
+
+async def load_org_subgraph(
+    gql_client: PersistentGraphQLClient, uuids: UUIDTable, org_unit_uuid: UUID
+) -> OrgGraph:
+    """
+    Load only the part of the org-unit hierarchy deciding the managers of an
+    org-unit, instead of paging through all org-units like `load_org_graph`.
+
+    This is the org-unit itself, its ancestors up through "led-adm" org-units
+    (the targets of a "_leder" unit, or the rest of the chain of a "led-adm"
+    unit), and its descendants down through "led-adm" org-units (the "_leder"
+    units assigning their manager to it). The manager targets computed from this
+    graph are the same as from the whole hierarchy.
+
+    Args:
+        gql_client: GraphQL client
+        uuids: UUID interning table of the run
+        org_unit_uuid: UUID of the org-unit
+    Returns:
+        OrgGraph
+    """
+    org_units: dict[str, dict[str, Any]] = {}
+
+    level = [str(org_unit_uuid)]
+    while level:
+        nodes = await _query_org_unit_nodes(gql_client, QUERY_ORG_UNIT_NODES, level)
+        level = []
+        for node in nodes:
+            org_units[node["uuid"]] = node
+            flags = classify(node["name"])
+            parent_uuid = node.get("parent_uuid")
+            if (
+                flags & (OrgUnitFlag.LEDER | OrgUnitFlag.LED_ADM)
+                and parent_uuid is not None
+                and parent_uuid not in org_units
+            ):
+                level.append(parent_uuid)
+
+    level = [str(org_unit_uuid)]
+    while level:
+        nodes = await _query_org_unit_nodes(
+            gql_client, QUERY_ORG_UNIT_CHILD_NODES, level
+        )
+        level = []
+        for node in nodes:
+            if node["uuid"] in org_units:
+                continue
+            org_units[node["uuid"]] = node
+            if OrgUnitFlag.LED_ADM in classify(node["name"]):
+                level.append(node["uuid"])
+
+    graph = OrgGraph(uuids, org_units.values())
+    logger.debug(
+        "Org subgraph loaded", org_unit=str(org_unit_uuid), org_units=len(graph)
+    )
+    return graph
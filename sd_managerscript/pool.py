@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import time
+from collections.abc import Callable
+from typing import Any
+
+import httpx
+import structlog
+
+logger = structlog.get_logger()
+
+# First trace events of a request once it has a connection from the pool
+CONNECTION_EVENTS = (
+    "connection.connect_tcp.started",
+    "http11.send_request_headers.started",
+    "http2.send_request_headers.started",
+)
+
+
+class PoolMonitor:
+    """
+    Statistics of the time requests wait for a connection from the HTTPX pool.
+
+    The wait time of a request is the time from it is sent until it gets a new or
+    reused connection, as reported by the HTTPCore trace extension. Long wait times
+    mean the concurrency is limited by the connection pool rather than by MO.
+    """
+
+    def __init__(
+        self, warning: float = 1.0, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        """
+        Args:
+            warning: Log a warning for requests waiting longer than this (seconds)
+            clock: Monotonic clock
+        """
+        self.warning = warning
+        self.clock = clock
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float) -> None:
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait > self.warning:
+            logger.warning("Waited for HTTP connection", wait=round(wait, 3))
+
+    async def on_request(self, request: httpx.Request) -> None:
+        """HTTPX request event hook adding a trace of the pool wait."""
+        sent = self.clock()
+        waiting = True
+
+        async def trace(name: str, info: dict[str, Any]) -> None:
+            nonlocal waiting
+            if waiting and name in CONNECTION_EVENTS:
+                waiting = False
+                self.record(self.clock() - sent)
+
+        request.extensions = {**request.extensions, "trace": trace}
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "requests": self.requests,
+            "total_wait": round(self.total_wait, 3),
+            "mean_wait": round(self.total_wait / self.requests, 3)
+            if self.requests
+            else 0.0,
+            "max_wait": round(self.max_wait, 3),
+        }
@@ -1,26 +1,70 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
-from gql import gql  # type: ignore
+from .operations import operation
 
 ORG_UNITS = "org_units"
 
-QUERY_ORG = gql("query {org { uuid }}")
+QUERY_ORG = operation("QUERY_ORG", "query {org { uuid }}")
 
-QUERY_ORG_UNIT_LEVEL = gql(
+QUERY_ORG_UNIT_TREE = operation(
+    "QUERY_ORG_UNIT_TREE",
+    """
+    query ($limit: int, $cursor: Cursor) {
+        org_units (limit: $limit, cursor: $cursor) {
+            page_info {
+                next_cursor
+            }
+            objects {
+                validities {
+                    uuid
+                    name
+                    parent_uuid
+                    org_unit_level_uuid
+                }
+            }
+        }
+    }
+    """,
+)
+
+QUERY_ORG_UNIT_NODES = operation(
+    "QUERY_ORG_UNIT_NODES",
     """
     query ($uuids: [UUID!]!) {
-        org_units (filter: {uuids: $uuids}) {
+        org_units (filter: { uuids: $uuids }) {
             objects {
                 validities {
+                    uuid
+                    name
+                    parent_uuid
                     org_unit_level_uuid
                 }
             }
         }
     }
+    """,
+)
+
+QUERY_ORG_UNIT_CHILD_NODES = operation(
+    "QUERY_ORG_UNIT_CHILD_NODES",
     """
+    query ($uuids: [UUID!]!) {
+        org_units (filter: { parent: { uuids: $uuids } }) {
+            objects {
+                validities {
+                    uuid
+                    name
+                    parent_uuid
+                    org_unit_level_uuid
+                }
+            }
+        }
+    }
+    """,
 )
 
-QUERY_ORG_UNITS = gql(
+QUERY_ORG_UNITS = operation(
+    "QUERY_ORG_UNITS",
     """
         query ($uuid: [UUID!]!) {
             org_units(filter: { parent: { uuids: $uuid } }) {
@@ -49,31 +93,53 @@ QUERY_ORG_UNITS = gql(
                 }
             }
         }
-"""
+""",
 )
 
-QUERY_ENGAGEMENTS = gql(
+QUERY_ENGAGEMENTS = operation(
+    "QUERY_ENGAGEMENTS",
     """
         query ($uuid: [UUID!]!){
             engagements (filter: { employee: { uuids: $uuid, from_date: null, to_date: null }} ){
                 objects {
                     validities {
+                        employee_uuid
                         validity{
                             from
-                            to
                         }
                     }
                 }
             }
         }
+    """,
+)
+
+# Only the engagements of the employees valid today
+QUERY_CURRENT_ENGAGEMENTS = operation(
+    "QUERY_CURRENT_ENGAGEMENTS",
     """
+        query ($uuid: [UUID!]!){
+            engagements (filter: { employee: { uuids: $uuid } }){
+                objects {
+                    current {
+                        employee_uuid
+                        validity {
+                            from
+                        }
+                    }
+                }
+            }
+        }
+    """,
 )
 
-CURRENT_MANAGER = gql(
+CURRENT_MANAGER = operation(
+    "CURRENT_MANAGER",
     """
     query ($uuid: [UUID!]!){
       org_units(filter: { uuids: $uuid }) {
         objects {
+            uuid
             validities {
                 managers {
                     uuid
@@ -90,70 +156,66 @@ CURRENT_MANAGER = gql(
         }
       }
     }
-    """
+    """,
 )
 
-UPDATE_MANAGER = gql(
+UPDATE_MANAGER = operation(
+    "UPDATE_MANAGER",
     """
         mutation UpdateManager($input: ManagerUpdateInput!) {
             manager_update(input: $input) {
                 uuid
             }
         }
-    """
+    """,
 )
 
-CREATE_MANAGER = gql(
+CREATE_MANAGER = operation(
+    "CREATE_MANAGER",
     """
         mutation CreateManager($input: ManagerCreateInput!) {
             manager_create(input: $input) {
                 uuid
             }
         }
-    """
+    """,
 )
 
-MANAGER_TERMINATE = gql(
+MANAGER_TERMINATE = operation(
+    "MANAGER_TERMINATE",
     """
         mutation ($input: ManagerTerminateInput!){
             manager_terminate(input: $input){
                 uuid
             }
         }
-    """
+    """,
 )
 
-ASSOCIATION_QUERY = gql(
+ASSOCIATION_QUERY = operation(
+    "ASSOCIATION_QUERY",
     """
         query ($employees: [UUID!]!, $org_units: [UUID!]!){
             associations(employees: $employees, org_units: $org_units) {
                 uuid
             }
         }
-    """
+    """,
 )
 
-ASSOCIATION_TERMINATE = gql(
+ASSOCIATION_TERMINATE = operation(
+    "ASSOCIATION_TERMINATE",
     """
         mutation($input: AssociationTerminateInput!){
             association_terminate(input: $input){
                 uuid
             }
         }
-    """
-)
-
-MANAGER_TERMINATE = gql(
-    """
-        mutation($input: ManagerTerminateInput!){
-            manager_terminate(input: $input){
-                uuid
-            }
-        }
-    """
+    """,
 )
 
-QUERY_ROOT_MANAGER_ENGAGEMENTS = gql(
+QUERY_ROOT_MANAGER_ENGAGEMENTS = operation(
+    "QUERY_ROOT_MANAGER_ENGAGEMENTS",
     """
         query ($uuid: [UUID!]!){
             org_units (filter: { uuids: $uuid }){
@@ -169,12 +231,10 @@ QUERY_ROOT_MANAGER_ENGAGEMENTS = gql(
                                         name
                                         uuid
                                         parent {
-                                            name
                                             uuid
                                         }
                                     }
                                     validity {
-                                        from
                                         to
                                     }
                                 }
@@ -184,10 +244,11 @@ QUERY_ROOT_MANAGER_ENGAGEMENTS = gql(
                 }
             }
         }
-    """
+    """,
 )
 
-QUERY_MANAGER_ENGAGEMENTS = gql(
+QUERY_MANAGER_ENGAGEMENTS = operation(
+    "QUERY_MANAGER_ENGAGEMENTS",
     """
         query ($uuid: [UUID!]!){
             org_units (filter: { parent: { uuids: $uuid } }){
@@ -203,12 +264,10 @@ QUERY_MANAGER_ENGAGEMENTS = gql(
                                         name
                                         uuid
                                         parent {
-                                            name
                                             uuid
                                         }
                                     }
                                     validity {
-                                        from
                                         to
                                     }
                                 }
@@ -218,13 +277,14 @@ QUERY_MANAGER_ENGAGEMENTS = gql(
                 }
             }
         }
-    """
+    """,
 )
 
-QUERY_LEDER_ORG_UNITS = gql(
+QUERY_LEDER_ORG_UNITS_BY_UUIDS = operation(
+    "QUERY_LEDER_ORG_UNITS_BY_UUIDS",
     """
-        query {
-            org_units(filter: { query: "_leder" }) {
+        query ($uuids: [UUID!]!) {
+            org_units(filter: { uuids: $uuids }) {
                 objects {
                     validities {
                         uuid
@@ -250,5 +310,188 @@ QUERY_LEDER_ORG_UNITS = gql(
                 }
             }
         }
-"""
+""",
+)
+
+QUERY_REGISTRATIONS = operation(
+    "QUERY_REGISTRATIONS",
+    """
+    query ($start: DateTime!, $models: [String!], $limit: int, $cursor: Cursor) {
+        registrations (
+            filter: { start: $start, models: $models }, limit: $limit, cursor: $cursor
+        ) {
+            page_info {
+                next_cursor
+            }
+            objects {
+                uuid
+                model
+            }
+        }
+    }
+    """,
+)
+
+QUERY_CHANGED_OBJECTS = operation(
+    "QUERY_CHANGED_OBJECTS",
+    """
+    query ($uuids: [UUID!]!) {
+        org_units (filter: { uuids: $uuids, from_date: null, to_date: null }) {
+            objects {
+                uuid
+            }
+        }
+        associations (filter: { uuids: $uuids, from_date: null, to_date: null }) {
+            objects {
+                validities {
+                    org_unit_uuid
+                    employee_uuid
+                }
+            }
+        }
+        engagements (filter: { uuids: $uuids, from_date: null, to_date: null }) {
+            objects {
+                validities {
+                    org_unit_uuid
+                    employee_uuid
+                }
+            }
+        }
+        managers (filter: { uuids: $uuids, from_date: null, to_date: null }) {
+            objects {
+                validities {
+                    org_unit_uuid
+                    employee_uuid
+                }
+            }
+        }
+    }
+    """,
+)
+
+QUERY_ENGAGEMENT_VALIDITIES = operation(
+    "QUERY_ENGAGEMENT_VALIDITIES",
+    """
+    query ($from_date: DateTime!, $to_date: DateTime!, $limit: int, $cursor: Cursor) {
+        engagements (
+            filter: { from_date: $from_date, to_date: $to_date },
+            limit: $limit,
+            cursor: $cursor
+        ) {
+            page_info {
+                next_cursor
+            }
+            objects {
+                uuid
+                validities {
+                    validity {
+                        from
+                        to
+                    }
+                }
+            }
+        }
+    }
+    """,
+)
+
+QUERY_MANAGER_VALIDITIES = operation(
+    "QUERY_MANAGER_VALIDITIES",
+    """
+    query ($from_date: DateTime!, $to_date: DateTime!, $limit: int, $cursor: Cursor) {
+        managers (
+            filter: { from_date: $from_date, to_date: $to_date },
+            limit: $limit,
+            cursor: $cursor
+        ) {
+            page_info {
+                next_cursor
+            }
+            objects {
+                uuid
+                validities {
+                    validity {
+                        from
+                        to
+                    }
+                }
+            }
+        }
+    }
+    """,
+)
+
+QUERY_EMPLOYEE_ROLES = operation(
+    "QUERY_EMPLOYEE_ROLES",
+    """
+    query ($uuids: [UUID!]!) {
+        associations (filter: { employee: { uuids: $uuids } }) {
+            objects {
+                validities {
+                    org_unit_uuid
+                }
+            }
+        }
+        managers (filter: { employee: { uuids: $uuids } }) {
+            objects {
+                validities {
+                    org_unit_uuid
+                }
+            }
+        }
+    }
+    """,
+)
+
+QUERY_MANAGER_ROLES = operation(
+    "QUERY_MANAGER_ROLES",
+    """
+    query ($uuids: [UUID!], $limit: int, $cursor: Cursor) {
+        managers (filter: { uuids: $uuids }, limit: $limit, cursor: $cursor) {
+            page_info {
+                next_cursor
+            }
+            objects {
+                validities {
+                    uuid
+                    employee_uuid
+                    org_unit_uuid
+                }
+            }
+        }
+    }
+    """,
+)
+
+QUERY_MANAGER_ROLE_ENGAGEMENTS = operation(
+    "QUERY_MANAGER_ROLE_ENGAGEMENTS",
+    """
+    query ($limit: int, $cursor: Cursor) {
+        managers (limit: $limit, cursor: $cursor) {
+            page_info {
+                next_cursor
+            }
+            objects {
+                validities {
+                    uuid
+                    org_unit_uuid
+                    employee {
+                        engagements {
+                            org_unit {
+                                name
+                                uuid
+                                parent {
+                                    uuid
+                                }
+                            }
+                            validity {
+                                to
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+    """,
 )
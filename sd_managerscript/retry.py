@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+import random
+from collections.abc import Awaitable
+from collections.abc import Callable
+from typing import TypeVar
+
+import httpx
+import structlog
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+# Errors of requests which may succeed if sent again
+TRANSIENT_ERRORS = (
+    httpx.TimeoutException,
+    httpx.NetworkError,
+    httpx.RemoteProtocolError,
+)
+
+
+def backoff_delay(
+    attempt: int,
+    base: float,
+    cap: float,
+    rand: Callable[[], float] = random.random,
+) -> float:
+    """
+    Delay before retrying a request, with exponential backoff and full jitter.
+
+    Args:
+        attempt: Number of the failed attempt, starting at 0
+        base: Delay after the first attempt (before jitter)
+        cap: Maximum delay
+        rand: Random number in [0, 1)
+    Returns:
+        Seconds to wait
+    """
+    return rand() * min(cap, base * 2.0**attempt)
+
+
+async def retry(
+    request: Callable[[], Awaitable[T]],
+    attempts: int,
+    base: float = 0.5,
+    cap: float = 10.0,
+    is_transient: Callable[[T], bool] = lambda result: False,
+    sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+) -> T:
+    """
+    Await `request`, retrying it on transient errors. Only idempotent requests
+    may be retried.
+
+    Args:
+        request: Function sending the request
+        attempts: Maximum number of attempts
+        base: Delay after the first attempt (see `backoff_delay`)
+        cap: Maximum delay between attempts
+        is_transient: Function returning True for results which should be retried,
+                      e.g. 5xx responses
+        sleep: Sleep function
+    Returns:
+        The result of the last attempt
+    """
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        try:
+            result = await request()
+        except TRANSIENT_ERRORS as error:
+            if last:
+                raise
+            reason = repr(error)
+        else:
+            if last or not is_transient(result):
+                return result
+            reason = repr(result)
+        delay = backoff_delay(attempt, base, cap)
+        logger.warning(
+            "Retrying request",
+            attempt=attempt + 1,
+            delay=round(delay, 3),
+            reason=reason,
+        )
+        await sleep(delay)
+    raise ValueError("attempts must be positive")
@@ -0,0 +1,434 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import hashlib
+import json
+import sqlite3
+import time
+from collections.abc import Iterable
+from datetime import datetime
+from uuid import UUID
+
+import structlog
+
+from .models import Manager
+from .models import ManagerTarget
+from .models import OrgUnitManager
+from .models import OrgUnitManagers
+
+logger = structlog.get_logger()
+
+
+def leder_unit_fingerprint(
+    org_unit: OrgUnitManagers,
+    target: ManagerTarget,
+    engagement_from: dict[UUID, datetime | None],
+) -> str:
+    """
+    Fingerprint of the input of the manager selection of a "_leder" unit: its
+    associations, the engagement from-dates of the associated employees, and the
+    target org-units and manager level of the manager.
+
+    Args:
+        org_unit: "_leder" OrgUnitManagers object
+        target: Target org-units and manager level of the "_leder" unit
+        engagement_from: Latest engagement from-date by employee UUID (see
+                         `get_active_engagements`)
+    Returns:
+        Hex digest
+    """
+    payload = {
+        "associations": sorted(
+            [
+                str(association.uuid),
+                str(association.employee_uuid),
+                str(engagement_from.get(association.employee_uuid)),
+            ]
+            for association in org_unit.associations
+        ),
+        "org_units": [str(uuid) for uuid in target.org_units],
+        "manager_level": str(target.manager_level.uuid),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def assigned_manager_role(manager: Manager) -> dict[str, str]:
+    """The UUID, org-unit, employee and manager level of a manager role."""
+    return {
+        "uuid": str(manager.uuid),
+        "org_unit": str(manager.org_unit),
+        "employee": str(manager.employee),
+        "manager_level": str(manager.manager_level.uuid),
+    }
+
+
+class StateStore:
+    """
+    Local SQLite store of the last observed state of each "_leder" unit.
+
+    For each "_leder" unit the store holds the fingerprint of its input (see
+    `leder_unit_fingerprint`) after it was last processed, the selected employee,
+    the org-units and manager level of the manager assigned, and the manager roles
+    assigned. Units whose fingerprint is unchanged, and whose manager roles are
+    unchanged in MO, can skip re-evaluation and writes in the next run.
+
+    The store also holds the start times of the last successful runs and the
+    "_leder" units failing in the last run, used by delta runs (see `delta.py`),
+    and the checkpoint of the current full run: the
+    work completed so far in each phase of the run, so a run interrupted e.g. by a
+    restart can be resumed without redoing it.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path: Path of the SQLite database, or ":memory:"
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leder_units (
+                    uuid TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    employee_uuid TEXT,
+                    org_units TEXT NOT NULL,
+                    manager_level_uuid TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    managers TEXT
+                )
+                """
+            )
+            columns = {
+                row[1]
+                for row in self._connection.execute("PRAGMA table_info(leder_units)")
+            }
+            if "managers" not in columns:
+                # Created before the manager roles were recorded
+                self._connection.execute(
+                    "ALTER TABLE leder_units ADD COLUMN managers TEXT"
+                )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS runs (
+                    kind TEXT PRIMARY KEY,
+                    started_at TEXT NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS failed_units (
+                    uuid TEXT PRIMARY KEY
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoint (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    started_at TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoint_items (
+                    phase TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (phase, key)
+                )
+                """
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def is_unchanged(
+        self, org_unit_uuid: UUID, fingerprint: str, max_age: float
+    ) -> bool:
+        """
+        Check if a "_leder" unit was processed with the same fingerprint no longer
+        than `max_age` seconds ago.
+        """
+        row = self._connection.execute(
+            "SELECT fingerprint, updated_at FROM leder_units WHERE uuid = ?",
+            (str(org_unit_uuid),),
+        ).fetchone()
+        if row is None:
+            return False
+        stored_fingerprint: str = row[0]
+        updated_at: float = row[1]
+        return stored_fingerprint == fingerprint and time.time() - updated_at < max_age
+
+    def assigned_managers(self, org_unit_uuid: UUID) -> list[dict[str, str]]:
+        """
+        Manager roles assigned when a "_leder" unit was last processed.
+
+        Returns:
+            The UUID, org-unit, employee and manager level of each manager role,
+            or an empty list if none were recorded
+        """
+        row = self._connection.execute(
+            "SELECT managers FROM leder_units WHERE uuid = ?", (str(org_unit_uuid),)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return []
+        managers: list[dict[str, str]] = json.loads(row[0])
+        return managers
+
+    def record(
+        self,
+        org_unit: OrgUnitManagers,
+        target: ManagerTarget,
+        engagement_from: dict[UUID, datetime | None],
+        managers: list[Manager],
+    ) -> None:
+        """
+        Record the state of a processed "_leder" unit.
+
+        Args:
+            org_unit: "_leder" OrgUnitManagers object with only the association
+                      of the selected employee left
+            target: Target org-units and manager level of the manager
+            engagement_from: Latest engagement from-date by employee UUID
+            managers: Manager roles assigned in the target org-units
+        """
+        employee_uuid = (
+            str(org_unit.associations[0].employee_uuid)
+            if org_unit.associations
+            else None
+        )
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO leder_units VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(org_unit.uuid),
+                    leder_unit_fingerprint(org_unit, target, engagement_from),
+                    employee_uuid,
+                    json.dumps([str(uuid) for uuid in target.org_units]),
+                    str(target.manager_level.uuid),
+                    time.time(),
+                    json.dumps(
+                        [assigned_manager_role(manager) for manager in managers]
+                    ),
+                ),
+            )
+
+    def last_run(self, full: bool = False) -> datetime | None:
+        """
+        Start time of the last successful run.
+
+        Args:
+            full: If true, only consider full (not delta) runs
+        Returns:
+            Timezone aware start time, or None if no run has completed
+        """
+        row = self._connection.execute(
+            "SELECT started_at FROM runs WHERE kind = ?", ("full" if full else "any",)
+        ).fetchone()
+        if row is None:
+            return None
+        return datetime.fromisoformat(row[0])
+
+    def open_checkpoint(self, started_at: datetime, window: float) -> datetime:
+        """
+        Resume the checkpoint of an interrupted run, or start a new checkpoint.
+
+        Args:
+            started_at: Timezone aware start time of this run
+            window: The checkpoint is only resumed if it was updated less than
+                    this many seconds ago
+        Returns:
+            Start time of the run, i.e. of the interrupted run if resumed
+        """
+        row = self._connection.execute(
+            "SELECT started_at, updated_at FROM checkpoint WHERE id = 1"
+        ).fetchone()
+        if row is not None and time.time() - row[1] < window:
+            logger.info("Resuming run from checkpoint", started_at=row[0])
+            return datetime.fromisoformat(row[0])
+
+        with self._connection:
+            self._connection.execute("DELETE FROM checkpoint_items")
+            self._connection.execute(
+                "INSERT OR REPLACE INTO checkpoint VALUES (1, ?, ?)",
+                (started_at.isoformat(), time.time()),
+            )
+        return started_at
+
+    def checkpointed(self, phase: str) -> set[str]:
+        """Keys checkpointed in a phase of the current run."""
+        rows = self._connection.execute(
+            "SELECT key FROM checkpoint_items WHERE phase = ?", (phase,)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def checkpoint(self, phase: str, key: str) -> None:
+        """
+        Checkpoint the completion of some work of the current run.
+
+        Args:
+            phase: Phase of the run, e.g. "processed"
+            key: Key of the completed work, e.g. the UUID of a "_leder" unit
+        """
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO checkpoint_items VALUES (?, ?)", (phase, key)
+            )
+            self._connection.execute(
+                "UPDATE checkpoint SET updated_at = ? WHERE id = 1", (time.time(),)
+            )
+
+    def close_checkpoint(self) -> None:
+        """Forget the checkpoint of a completed run."""
+        with self._connection:
+            self._connection.execute("DELETE FROM checkpoint")
+            self._connection.execute("DELETE FROM checkpoint_items")
+
+    def failed_units(self) -> set[UUID]:
+        """The "_leder" units failing in the last run."""
+        rows = self._connection.execute("SELECT uuid FROM failed_units").fetchall()
+        return {UUID(row[0]) for row in rows}
+
+    def record_run(
+        self, started_at: datetime, full: bool, failed_units: Iterable[UUID] = ()
+    ) -> None:
+        """
+        Record a completed run.
+
+        Args:
+            started_at: Timezone aware start time of the run
+            full: True for full runs, False for delta runs
+            failed_units: "_leder" units failing in the run. These are processed
+                          again by the next delta run.
+        """
+        kinds = ["any", "full"] if full else ["any"]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?)",
+                [(kind, started_at.isoformat()) for kind in kinds],
+            )
+            self._connection.execute("DELETE FROM failed_units")
+            self._connection.executemany(
+                "INSERT INTO failed_units VALUES (?)",
+                [(str(uuid),) for uuid in failed_units],
+            )
+
+
+class RunProgress:
+    """
+    Bookkeeping of a run in the state store.
+
+    Full runs are checkpointed (see `StateStore.open_checkpoint`): a full run
+    resuming an interrupted run keeps its start time, and skips the managers
+    terminated and the "_leder" units processed before the restart. Dry runs
+    record nothing.
+    """
+
+    def __init__(
+        self,
+        state_store: StateStore | None,
+        started_at: datetime,
+        full_run: bool,
+        delta: bool,
+        dry_run: bool,
+        checkpoint_window: float,
+    ) -> None:
+        """
+        Args:
+            state_store: State store, or None if disabled
+            started_at: Timezone aware start time of the run
+            full_run: True for runs of the whole organisation
+            delta: True for delta runs (see `delta.py`)
+            dry_run: True for dry runs
+            checkpoint_window: Seconds an interrupted full run can be resumed
+                               within (see `StateStore.open_checkpoint`)
+        """
+        self.state_store = None if dry_run else state_store
+        self.full_run = full_run
+        self.delta = delta
+        self.checkpoint = None
+        if full_run and not delta and checkpoint_window > 0:
+            self.checkpoint = self.state_store
+        self.started_at = started_at
+        self._terminated: set[str] = set()
+        self._processed: set[str] = set()
+        # Org-units whose manager was terminated in this run
+        self.changed_org_units: set[UUID] = set()
+        self.terminations_completed = False
+        if self.checkpoint is not None:
+            self.started_at = self.checkpoint.open_checkpoint(
+                started_at, checkpoint_window
+            )
+            self._terminated = self.checkpoint.checkpointed("terminated")
+            self._processed = self.checkpoint.checkpointed("processed")
+            self.changed_org_units = set(
+                map(UUID, self.checkpoint.checkpointed("terminated_org_units"))
+            )
+            self.terminations_completed = "terminate" in self.checkpoint.checkpointed(
+                "completed"
+            )
+
+    def pending_terminations(
+        self, managers: list[OrgUnitManager]
+    ) -> list[OrgUnitManager]:
+        """The managers to terminate, except those terminated before a restart."""
+        return [
+            manager
+            for manager in managers
+            if str(manager.manager_uuid) not in self._terminated
+        ]
+
+    def terminated(self, manager: OrgUnitManager) -> None:
+        """Record the termination of a manager."""
+        self.changed_org_units.add(manager.org_unit_uuid)
+        if self.checkpoint is not None:
+            self.checkpoint.checkpoint("terminated", str(manager.manager_uuid))
+            self.checkpoint.checkpoint(
+                "terminated_org_units", str(manager.org_unit_uuid)
+            )
+
+    def complete_terminations(self) -> None:
+        """Record that all unengaged managers are terminated."""
+        self.terminations_completed = True
+        if self.checkpoint is not None:
+            self.checkpoint.checkpoint("completed", "terminate")
+
+    def unprocessed(
+        self, manager_org_units: list[OrgUnitManagers]
+    ) -> list[OrgUnitManagers]:
+        """The "_leder" units, except those processed before a restart."""
+        if self._processed:
+            logger.info(
+                "Skipping units processed before the restart",
+                units=len(self._processed),
+            )
+        return [
+            org_unit
+            for org_unit in manager_org_units
+            if str(org_unit.uuid) not in self._processed
+        ]
+
+    def processed(
+        self,
+        org_unit: OrgUnitManagers,
+        target: ManagerTarget,
+        engagement_from: dict[UUID, datetime | None],
+        managers: list[Manager],
+    ) -> None:
+        """Record a processed "_leder" unit (see `StateStore.record`)."""
+        if self.state_store is not None:
+            self.state_store.record(org_unit, target, engagement_from, managers)
+        if self.checkpoint is not None:
+            self.checkpoint.checkpoint("processed", str(org_unit.uuid))
+
+    def complete(self, failed_units: Iterable[UUID]) -> None:
+        """Record the completed run (see `StateStore.record_run`)."""
+        if self.state_store is not None and self.full_run:
+            self.state_store.record_run(
+                self.started_at, full=not self.delta, failed_units=failed_units
+            )
+        if self.checkpoint is not None:
+            self.checkpoint.close_checkpoint()
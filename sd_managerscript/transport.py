@@ -0,0 +1,248 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+import json
+import time
+from collections.abc import Callable
+from importlib.util import find_spec
+from typing import Any
+
+import httpx
+import orjson
+from gql.transport.exceptions import TransportClosed  # type: ignore
+from graphql import DocumentNode
+from graphql import ExecutionResult
+from graphql import print_ast
+from raclients.graph.transport import AsyncHTTPXTransport  # type: ignore
+from raclients.graph.util import graphql_error_from_dict  # type: ignore
+
+from .hedging import Hedger
+from .limiter import AdaptiveLimiter
+from .operations import lookup_operation
+from .retry import retry
+from .util import is_query
+
+
+def accept_encoding(compression: bool = True) -> str:
+    """
+    Accept-Encoding header of the requests to MO.
+
+    Brotli is only negotiated if a Brotli decoder is installed for HTTPX.
+    """
+    if not compression:
+        return "identity"
+    if find_spec("brotli") is not None or find_spec("brotlicffi") is not None:
+        return "br, gzip"
+    return "gzip"
+
+
+def is_server_error(response: httpx.Response) -> bool:
+    """Return True for 5xx responses, which may succeed if the request is retried."""
+    return response.status_code >= 500
+
+
+def is_persisted_query_not_found(result: ExecutionResult) -> bool:
+    """Return True if the server does not know the hash of a persisted query."""
+    return any(
+        error.message == "PersistedQueryNotFound"
+        or (error.extensions or {}).get("code") == "PERSISTED_QUERY_NOT_FOUND"
+        for error in result.errors or []
+    )
+
+
+class FastJSONTransport(AsyncHTTPXTransport):
+    """
+    GraphQL transport decoding the responses with orjson.
+
+    Registered operations (see `operations.py`) are sent as their source, without
+    printing the parsed document again. With automatic persisted queries, an
+    operation is sent with its SHA-256 hash the first time, and with only the hash
+    afterwards. If the server has forgotten the hash, the query is sent again.
+
+    Unlike the Ra-clients transport, the response text is not decoded for debug
+    logging. The number of bytes received (compressed) and decoded, and the CPU time
+    spent decoding, are counted for the `/metrics` endpoint.
+
+    The concurrency of the queries is limited by the adaptive `limiter`, if any.
+    Mutations are limited separately (see `util.execute_mutator`). Slow queries are
+    hedged by the `hedger`, if any, and queries failing with a transient error or a
+    5xx response are retried up to `retry_attempts` times in total.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        fast_json: bool = True,
+        persisted_queries: bool = False,
+        limiter: AdaptiveLimiter | None = None,
+        hedger: Hedger | None = None,
+        retry_attempts: int = 1,
+        retry_backoff: float = 0.5,
+        retry_backoff_max: float = 10.0,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Args:
+            *args: Arguments of AsyncHTTPXTransport
+            fast_json: Use orjson instead of the standard library
+            persisted_queries: Use automatic persisted queries
+            limiter: Adaptive limit on the number of concurrent requests
+            hedger: Hedging of slow (idempotent) queries
+            retry_attempts: Maximum number of attempts of a query
+            retry_backoff: Delay after the first attempt (see `retry.backoff_delay`)
+            retry_backoff_max: Maximum delay between attempts
+            **kwargs: Keyword arguments of AsyncHTTPXTransport
+        """
+        super().__init__(*args, **kwargs)
+        self.persisted_queries = persisted_queries
+        self.limiter = limiter
+        self.hedger = hedger
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        # Hashes of the operations known by the server
+        self._persisted: set[str] = set()
+        self.loads: Callable[[bytes], Any] = json.loads
+        if fast_json:
+            self.loads = orjson.loads
+        self.responses = 0
+        self.received_bytes = 0
+        self.decoded_bytes = 0
+        self.decode_time = 0.0
+
+    def _payload(
+        self,
+        document: DocumentNode,
+        variable_values: dict[str, Any] | None,
+        operation_name: str | None,
+        persisted: bool,
+    ) -> dict[str, Any]:
+        operation = lookup_operation(document)
+        payload: dict[str, Any] = {}
+        if operation is None:
+            payload["query"] = print_ast(document)
+        else:
+            if not persisted:
+                payload["query"] = operation.source
+            if self.persisted_queries:
+                payload["extensions"] = {
+                    "persistedQuery": {"version": 1, "sha256Hash": operation.sha256}
+                }
+        if variable_values:
+            payload["variables"] = variable_values
+        if operation_name:
+            payload["operationName"] = operation_name
+        return payload
+
+    async def execute(
+        self,
+        document: DocumentNode,
+        variable_values: dict[str, Any] | None = None,
+        operation_name: str | None = None,
+        extra_args: dict[str, Any] | None = None,
+    ) -> ExecutionResult:
+        if self.client is None:
+            raise TransportClosed("Transport is not connected")
+
+        operation = lookup_operation(document)
+        persisted = (
+            self.persisted_queries
+            and operation is not None
+            and operation.sha256 in self._persisted
+        )
+        payload = self._payload(document, variable_values, operation_name, persisted)
+        if is_query(document):
+            response = await retry(
+                lambda: self._read(payload, extra_args),
+                self.retry_attempts,
+                self.retry_backoff,
+                self.retry_backoff_max,
+                is_transient=is_server_error,
+            )
+        else:
+            response = await self._post(payload, extra_args, limited=False)
+        result = self._decode_response(response, query=payload.get("query"))
+
+        if operation is None or not self.persisted_queries:
+            return result
+        if persisted and is_persisted_query_not_found(result):
+            self._persisted.discard(operation.sha256)
+            return await self.execute(
+                document, variable_values, operation_name, extra_args
+            )
+        self._persisted.add(operation.sha256)
+        return result
+
+    async def _read(
+        self, payload: dict[str, Any], extra_args: dict[str, Any] | None
+    ) -> httpx.Response:
+        if self.hedger is None:
+            return await self._post(payload, extra_args)
+        return await self.hedger.run(lambda: self._post(payload, extra_args))
+
+    async def _post(
+        self,
+        payload: dict[str, Any],
+        extra_args: dict[str, Any] | None,
+        limited: bool = True,
+    ) -> httpx.Response:
+        assert self.client is not None
+        limiter = self.limiter if limited else None
+        if limiter is not None:
+            await limiter.acquire()
+        started = time.monotonic()
+        overloaded = False
+        record = True
+        try:
+            response: httpx.Response = await self.client.post(
+                url=self.url, json=payload, **(extra_args or {})
+            )
+            overloaded = response.status_code >= 500
+        except (httpx.TimeoutException, httpx.NetworkError):
+            overloaded = True
+            raise
+        except asyncio.CancelledError:
+            # E.g. the loser of a hedged read. Its truncated latency is no sample
+            record = False
+            raise
+        finally:
+            if limiter is not None:
+                limiter.release(time.monotonic() - started, overloaded, record=record)
+        return response
+
+    def _decode_response(
+        self, response: httpx.Response, query: str | None = None
+    ) -> ExecutionResult:
+        started = time.process_time()
+        try:
+            result = self.loads(response.content)
+        except ValueError:
+            self._raise_response_error(response, "Not a JSON answer")
+        finally:
+            self.responses += 1
+            self.received_bytes += response.num_bytes_downloaded
+            self.decoded_bytes += len(response.content)
+            self.decode_time += time.process_time() - started
+
+        if not isinstance(result, dict) or (
+            "errors" not in result and "data" not in result
+        ):
+            self._raise_response_error(response, "No 'data' or 'errors' keys in answer")
+
+        errors = None
+        if "errors" in result:
+            errors = [graphql_error_from_dict(e, query) for e in result["errors"]]
+
+        return ExecutionResult(
+            data=result.get("data"),
+            errors=errors,
+            extensions=result.get("extensions"),
+        )
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "responses": self.responses,
+            "received_bytes": self.received_bytes,
+            "decoded_bytes": self.decoded_bytes,
+            "decode_time": round(self.decode_time, 3),
+        }
@@ -1,19 +1,328 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
+import asyncio
+import json
+import re
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Hashable
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any
+from typing import Generic
 from typing import no_type_check
+from typing import TypeVar
 
+import structlog
+from gql.transport.exceptions import TransportQueryError  # type: ignore
+from graphql import DocumentNode
+from graphql import OperationDefinitionNode
+from graphql import OperationType
+from more_itertools import chunked
 from more_itertools import one  # type: ignore
 from raclients.graph.client import PersistentGraphQLClient  # type: ignore
 
+from .cache import operation_name
+from .cache import ReadCache
+from .limiter import WriteLimiter
 from .models import OrgUnitManagers  # type: ignore
+from .mutation_log import MutationLog
+from .operations import lookup_operation
+from .operations import Operation
+
+logger = structlog.get_logger()
+
+
+def as_document(query: Any) -> Any:
+    """The parsed document of a registered operation, or the query itself."""
+    if isinstance(query, Operation):
+        return query.document
+    return query
+
+
+def is_query(document: Any) -> bool:
+    """Return True if the document only contains (idempotent) query operations."""
+    return isinstance(document, DocumentNode) and all(
+        isinstance(definition, OperationDefinitionNode)
+        and definition.operation == OperationType.QUERY
+        for definition in document.definitions
+    )
+
+
+def query_key(document: Any, variables: dict | None) -> Hashable:
+    """Key identifying a query operation and its canonicalised variables."""
+    return id(document), json.dumps(variables or {}, sort_keys=True, default=str)
+
+
+UUID_PATTERN = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE
+)
+
+
+def uuid_tags(*objs: Any) -> set[str]:
+    """All UUIDs found (as strings) in nested dicts and lists."""
+    tags: set[str] = set()
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, list):
+            stack.extend(obj)
+        elif isinstance(obj, str) and UUID_PATTERN.fullmatch(obj):
+            tags.add(obj.lower())
+        elif not isinstance(obj, (str, int, float, bool, type(None))):
+            # e.g. UUID objects
+            tags.update(uuid_tags(str(obj)))
+    return tags
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class DataLoader(Generic[K, V]):
+    """
+    Batches the `load` calls of concurrent coroutines into batched queries.
+
+    Keys loaded within the same tick of the event loop (or within `delay` seconds)
+    are collected, deduplicated and passed to `batch_load` in chunks of at most
+    `max_batch_size` keys. `batch_load` returns a mapping from key to value, and
+    keys missing from it get `default`. An exception as the value of a key fails
+    only the `load` calls of that key, while an exception raised by `batch_load`
+    fails all keys of the chunk.
+
+    The value of each key is kept, so a key already loaded (or being loaded) is
+    not part of another batch. Failed keys are not kept, and `invalidate` forgets
+    the keys whose key or value contains any of the given UUIDs.
+    """
+
+    def __init__(
+        self,
+        batch_load: Callable[[list[K]], Awaitable[Mapping[K, Any]]],
+        max_batch_size: int = 100,
+        delay: float = 0.0,
+        default: Any = None,
+    ) -> None:
+        """
+        Args:
+            batch_load: Coroutine function loading the values of a list of keys
+            max_batch_size: Maximum number of keys passed to `batch_load`
+            delay: Seconds to wait for more keys before dispatching a batch
+            default: Value of keys missing from the result of `batch_load`
+        """
+        self.batch_load = batch_load
+        self.max_batch_size = max_batch_size
+        self.delay = delay
+        self.default = default
+        self._pending: dict[K, asyncio.Future] = {}
+        self._futures: dict[K, asyncio.Future] = {}
+        self._tagged: dict[str, set[K]] = {}
+        self._handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.hits = 0
+
+    async def load(self, key: K) -> V:
+        """Load the value of a key as part of the next batch, unless known."""
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._tag(key, uuid_tags(key))
+            self._pending[key] = future
+            if self._handle is None:
+                self._handle = loop.call_later(self.delay, self._dispatch)
+        else:
+            self.hits += 1
+        # Shield the shared future from cancellation of a single caller
+        return await asyncio.shield(future)
+
+    def invalidate(self, tags: set[str]) -> None:
+        """Forget the values of the keys tagged with any of the given UUIDs."""
+        for tag in tags:
+            for key in self._tagged.pop(tag, ()):
+                self._futures.pop(key, None)
+
+    def _tag(self, key: K, tags: set[str]) -> None:
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+
+    def _dispatch(self) -> None:
+        pending, self._pending, self._handle = self._pending, {}, None
+        for chunk in chunked(pending.items(), self.max_batch_size):
+            task = asyncio.create_task(self._load_chunk(dict(chunk)))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _load_chunk(self, futures: dict[K, asyncio.Future]) -> None:
+        self.batches += 1
+        try:
+            values = await self.batch_load(list(futures))
+        except Exception as e:
+            for key, future in futures.items():
+                self._forget(key, future)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in futures.items():
+            if future.done():
+                continue
+            value = values.get(key, self.default)
+            if isinstance(value, Exception):
+                self._forget(key, future)
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+                if self._futures.get(key) is future:
+                    self._tag(key, uuid_tags(value))
+
+    def _forget(self, key: K, future: asyncio.Future) -> None:
+        if self._futures.get(key) is future:
+            del self._futures[key]
+
+
+class QueryScope:
+    """
+    Request-scoped state of the GraphQL query layer, e.g. for a single run.
+
+    Identical queries (same operation and variables) executed concurrently within
+    the scope share one in-flight request, and completed results are kept for the
+    rest of the scope. Failed requests are not kept. As the results are shared,
+    callers must not modify them.
+
+    Each result is tagged with the UUIDs found in its variables and data, and a
+    mutation executed within the scope invalidates the results tagged with any of
+    the UUIDs it touched.
+
+    Queries are read through the cross-run `read_cache` of the scope, if any, and
+    the data loaders of the scope (see `get_loader`) are shared by its tasks.
+    Mutations wait for the `write_limiter` of the scope, if any, and the number of
+    mutations and the time they waited are counted. Mutations are written ahead to
+    the `mutation_log` of the scope, if any.
+    """
+
+    def __init__(
+        self,
+        read_cache: ReadCache | None = None,
+        write_limiter: WriteLimiter | None = None,
+        mutation_log: MutationLog | None = None,
+    ) -> None:
+        self.read_cache = read_cache
+        self.write_limiter = write_limiter
+        self.mutation_log = mutation_log
+        self.loaders: dict[Hashable, DataLoader] = {}
+        self._results: dict[Hashable, asyncio.Future] = {}
+        self._tagged: dict[str, set[Hashable]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.write_wait = 0.0
+
+    async def singleflight(
+        self,
+        key: Hashable,
+        factory: Callable[[], Awaitable[dict]],
+        tags: set[str] | None = None,
+    ) -> dict:
+        """
+        Await the result of `factory` for `key`, sharing it with all other
+        callers of the same key.
+        """
+        future = self._results.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(factory())
+            self._results[key] = future
+            self._tag(key, tags or set())
+            future.add_done_callback(lambda f: self._on_done(key, f))
+        else:
+            self.hits += 1
+        # Shield the shared request from cancellation of a single caller
+        return await asyncio.shield(future)
+
+    def _tag(self, key: Hashable, tags: set[str]) -> None:
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+
+    def _on_done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._results.get(key) is not future:
+            return  # Invalidated while in flight
+        if future.cancelled() or future.exception() is not None:
+            del self._results[key]
+            return
+        self._tag(key, uuid_tags(future.result()))
+
+    def invalidate(self, tags: set[str]) -> None:
+        """Forget the results tagged with any of the given UUIDs."""
+        if self.read_cache is not None:
+            self.read_cache.invalidate(tags)
+        for loader in self.loaders.values():
+            loader.invalidate(tags)
+        for tag in tags:
+            for key in self._tagged.pop(tag, ()):
+                self._results.pop(key, None)
+
+
+_query_scope: ContextVar[QueryScope | None] = ContextVar("query_scope", default=None)
+
+
+@asynccontextmanager
+async def query_scope(
+    read_cache: ReadCache | None = None,
+    write_limiter: WriteLimiter | None = None,
+    mutation_log: MutationLog | None = None,
+) -> AsyncIterator[QueryScope]:
+    """
+    Open a query scope for the current context. Tasks started within the
+    context (e.g. by `asyncio.gather`) share the scope.
+
+    Args:
+        read_cache: Cross-run cache to read queries through
+        write_limiter: Rate limiter of the mutations
+        mutation_log: Write-ahead log of the mutations
+    """
+    scope = QueryScope(read_cache, write_limiter, mutation_log)
+    token = _query_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _query_scope.reset(token)
+        logger.debug(
+            "Query scope closed",
+            hits=scope.hits,
+            misses=scope.misses,
+            writes=scope.writes,
+            write_wait=round(scope.write_wait, 3),
+        )
+
+
+def get_loader(key: Hashable, factory: Callable[[], DataLoader]) -> DataLoader:
+    """
+    Get the data loader of the current query scope with the given key, creating
+    it with `factory` if needed. Outside a query scope a new loader is returned,
+    so the loads are not batched with those of other callers.
+    """
+    scope = _query_scope.get()
+    if scope is None:
+        return factory()
+    if key not in scope.loaders:
+        scope.loaders[key] = factory()
+    return scope.loaders[key]
 
 
 @no_type_check
 async def query_graphql(
-    gql_client: PersistentGraphQLClient, query: str, variables: dict
+    gql_client: PersistentGraphQLClient, query: Operation, variables: dict
 ) -> dict[str, list]:
     """Graphql query. Returns List[Dict]
 
+    Within a query scope, identical queries are deduplicated (see `QueryScope`)
+    and read through the read cache of the scope.
+
     Args:
         gql_client: GraphQL client
         query: String for grapqhql query.
@@ -22,11 +331,65 @@ async def query_graphql(
     Returns:
         dict[str, list[dict[str, Any]]]
     """
-    return await gql_client.execute(query, variable_values=variables)
+    name = operation_name(query)
+    query = as_document(query)
+    scope = _query_scope.get()
+    if scope is None or not is_query(query):
+        return await gql_client.execute(query, variable_values=variables)
+
+    key = query_key(query, variables)
+    tags = uuid_tags(variables)
+    read_cache = scope.read_cache
+
+    async def execute() -> dict:
+        if read_cache is None:
+            return await gql_client.execute(query, variable_values=variables)
+
+        result = read_cache.get(key)
+        if result is None:
+            generation = read_cache.generation
+            result = await gql_client.execute(query, variable_values=variables)
+            read_cache.put(key, name, result, tags | uuid_tags(result), generation)
+        return result
+
+    return await scope.singleflight(key, execute, tags)
+
+
+async def query_paginated(
+    gql_client: PersistentGraphQLClient,
+    query: Operation,
+    variables: dict,
+    limit: int,
+) -> list[dict]:
+    """
+    Graphql query of a paginated collection. Follows the cursor of the
+    collection until all pages have been fetched.
+
+    Args:
+        gql_client: GraphQL client
+        query: Grapqhql query. Must take `$limit` and `$cursor` variables
+               and select `page_info { next_cursor }`.
+        variables: Values to query over.
+        limit: Page size.
+
+    Returns:
+        list of the objects of all pages
+    """
+    objects: list[dict] = []
+    cursor = None
+    while True:
+        data = await query_graphql(
+            gql_client, query, {**variables, "limit": limit, "cursor": cursor}
+        )
+        collection = one(data.values())
+        objects.extend(collection["objects"])
+        cursor = collection["page_info"]["next_cursor"]
+        if cursor is None:
+            return objects
 
 
 async def query_org_unit(
-    gql_client: PersistentGraphQLClient, query: str, variables: dict
+    gql_client: PersistentGraphQLClient, query: Operation, variables: dict
 ) -> list[OrgUnitManagers]:
     """
     Calling graphql function and turn payload into list of org-unit objects
@@ -49,15 +412,49 @@ async def query_org_unit(
 
 
 async def execute_mutator(
-    gql_client: PersistentGraphQLClient, mutate_param: str, variables: dict
-) -> None:
+    gql_client: PersistentGraphQLClient, mutate_param: Operation, variables: dict
+) -> dict[str, Any]:
     """Generic graphql mutation.
 
+    Within a query scope with a write limiter, the mutation waits for the limiter.
+    Within a query scope with a mutation log, a registered mutation is logged
+    before it is sent, and removed from the log when MO has answered (applied or
+    rejected it).
+
     Args:
         mutate_param: The object you want to change. Eg. "org-units"
         variables: Dict of parameters to input to mutator.
     Returns:
-        uuid: uuid of the modified object
+        The result of the mutation, e.g. with the uuid of the modified object
     """
 
-    _ = await gql_client.execute(mutate_param, variables)
+    scope = _query_scope.get()
+    write_limiter = scope.write_limiter if scope is not None else None
+    mutation_log = scope.mutation_log if scope is not None else None
+    operation = lookup_operation(as_document(mutate_param))
+    entry_id = None
+    if mutation_log is not None and operation is not None:
+        entry_id = mutation_log.append(operation.name, variables)
+
+    if scope is not None:
+        scope.writes += 1
+    if scope is not None and write_limiter is not None:
+        scope.write_wait += await write_limiter.acquire()
+    try:
+        result: dict[str, Any] = await gql_client.execute(
+            as_document(mutate_param), variables
+        )
+    except TransportQueryError:
+        # Rejected by MO, so not applied
+        if mutation_log is not None and entry_id is not None:
+            mutation_log.done(entry_id)
+        raise
+    finally:
+        if write_limiter is not None:
+            write_limiter.release()
+    if mutation_log is not None and entry_id is not None:
+        mutation_log.done(entry_id)
+
+    if scope is not None:
+        scope.invalidate(uuid_tags(variables, result))
+    return result
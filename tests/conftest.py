@@ -1,7 +1,16 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
+from typing import TYPE_CHECKING
+from uuid import UUID
+from uuid import uuid4
+
+import pytest
 from pytest import MonkeyPatch  # type: ignore
 
+if TYPE_CHECKING:
+    from sd_managerscript.org_graph import OrgGraph
+
+
 ENV_ROOT_UUID = "8315443f-a918-4eea-9605-150472418101"
 ENV_CLIENT_SECRET = "08eaf849-e9f9-53e0-b6b9-3cd45763ecbb"
 ENV_MANAGER_TYPE_UUID = "75fee2b6-f405-4c77-b62e-32421c2e43d5"
@@ -56,3 +65,58 @@ mp.setenv("MANAGER_TYPE_UUID", ENV_MANAGER_TYPE_UUID)
 mp.setenv("RESPONSIBILITY_UUID", ENV_RESPONSIBILITY_UUID)
 mp.setenv("MANAGER_LEVEL_MAPPING", ENV_MANAGER_LEVEL_MAPPING)
 mp.setenv("MANAGER_LEVEL_CREATE", ENV_MANAGER_LEVEL_CREATE)
+
+
+# Org-unit levels from the manager level mapping above
+NY4 = "0263522a-2c1e-9c80-1880-92c1b97cfead"
+NY5 = "891603db-cc28-6ed2-6d48-25e14d3f142f"
+
+# Kommune
+# ├── Borgmesterens Afdeling
+# │   └── Byudvikling led-adm
+# │       ├── Byudvikling_leder
+# │       └── Plan led-adm
+# │           └── Plan_leder
+# └── Skoler
+#     ├── Skoler_leder
+#     └── Ø_Skoler_leder
+NAMES = [
+    ("Kommune", None, NY5),
+    ("Borgmesterens Afdeling", "Kommune", NY5),
+    ("Byudvikling led-adm", "Borgmesterens Afdeling", NY4),
+    ("Byudvikling_leder", "Byudvikling led-adm", NY4),
+    ("Plan led-adm", "Byudvikling led-adm", NY4),
+    ("Plan_leder", "Plan led-adm", NY4),
+    ("Skoler", "Kommune", NY4),
+    ("Skoler_leder", "Skoler", NY4),
+    ("Ø_Skoler_leder", "Skoler", NY4),
+]
+
+
+@pytest.fixture
+def org_uuids() -> dict[str, UUID]:
+    return {name: uuid4() for name, *_ in NAMES}
+
+
+@pytest.fixture
+def org_units(org_uuids: dict[str, UUID]) -> list[dict]:
+    """The org-tree above as returned by QUERY_ORG_UNIT_TREE"""
+    organisation = str(uuid4())
+    return [
+        {
+            "uuid": str(org_uuids[name]),
+            "name": name,
+            "parent_uuid": str(org_uuids[parent]) if parent else organisation,
+            "org_unit_level_uuid": level,
+        }
+        for name, parent, level in NAMES
+    ]
+
+
+@pytest.fixture
+def graph(org_units: list[dict]) -> "OrgGraph":
+    # Imported here as importing the package reads the settings set up above
+    from sd_managerscript.interning import UUIDTable
+    from sd_managerscript.org_graph import OrgGraph
+
+    return OrgGraph(UUIDTable(), org_units)
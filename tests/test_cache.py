@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from gql import gql  # type: ignore
+
+from sd_managerscript.cache import operation_name
+from sd_managerscript.cache import ReadCache
+from sd_managerscript.queries import QUERY_ENGAGEMENTS
+from sd_managerscript.queries import QUERY_ORG_UNITS
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_operation_name() -> None:
+    assert operation_name(QUERY_ORG_UNITS) == "QUERY_ORG_UNITS"
+    assert operation_name(QUERY_ENGAGEMENTS.document) == "QUERY_ENGAGEMENTS"
+    assert operation_name(gql("{ org_units { objects { uuid } } }")) == "org_units"
+    assert operation_name(gql("query Named { org_units { objects { uuid } } }")) == (
+        "Named"
+    )
+    assert operation_name("not a document") == ""
+
+
+def test_read_cache_ttl() -> None:
+    clock = Clock()
+    cache = ReadCache(10, 5, {"classes": 60, "engagements": 0}, clock=clock)
+
+    cache.put("a", "org_units", {"a": 1}, set())
+    cache.put("b", "classes", {"b": 1}, set())
+    cache.put("c", "engagements", {"c": 1}, set())
+    assert cache.get("a") == {"a": 1}
+    assert cache.get("c") is None
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.get("b") == {"b": 1}
+    assert len(cache) == 1
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_read_cache_lru() -> None:
+    cache = ReadCache(2, 60)
+
+    cache.put("a", "", {"a": 1}, set())
+    cache.put("b", "", {"b": 1}, set())
+    cache.get("a")
+    cache.put("c", "", {"c": 1}, set())
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"a": 1}
+    assert cache.get("c") == {"c": 1}
+
+
+def test_read_cache_invalidate() -> None:
+    cache = ReadCache(10, 60)
+    cache.put("a", "", {"a": 1}, {"uuid-1", "uuid-2"})
+    cache.put("b", "", {"b": 1}, {"uuid-2"})
+    cache.put("c", "", {"c": 1}, {"uuid-3"})
+
+    cache.invalidate({"uuid-2"})
+
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") == {"c": 1}
+
+
+def test_read_cache_ignores_results_fetched_during_invalidation() -> None:
+    cache = ReadCache(10, 60)
+    generation = cache.generation
+
+    cache.invalidate({"uuid-1"})
+    cache.put("a", "", {"a": 1}, set(), generation)
+
+    assert cache.get("a") is None
+
+
+def test_read_cache_disabled() -> None:
+    cache = ReadCache(0, 60)
+    cache.put("a", "", {"a": 1}, set())
+    assert cache.get("a") is None
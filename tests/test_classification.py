@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from uuid import uuid4
+
+import pytest
+
+from sd_managerscript.classification import classify
+from sd_managerscript.classification import is_manager_unit
+from sd_managerscript.classification import OrgUnitFlag
+from sd_managerscript.classification import OrgUnitFlags
+from sd_managerscript.interning import UUIDTable
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("Almind skole", OrgUnitFlag.NONE),
+        ("Almind skole_leder", OrgUnitFlag.LEDER),
+        ("Almind skole_LEDER ", OrgUnitFlag.LEDER),
+        ("Ø_Almind skole_leder", OrgUnitFlag.LEDER | OrgUnitFlag.EXCLUDED),
+        ("IT-Support led-adm", OrgUnitFlag.LED_ADM),
+        (" IT-Support Led-Adm ", OrgUnitFlag.LED_ADM),
+    ],
+)
+def test_classify(name: str, expected: OrgUnitFlag) -> None:
+    assert classify(name) == expected
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("Almind skole", False),
+        ("Almind skole_leder", True),
+        ("Ø_Almind skole_leder", False),
+    ],
+)
+def test_is_manager_unit(name: str, expected: bool) -> None:
+    assert is_manager_unit(classify(name)) is expected
+
+
+def test_org_unit_flags() -> None:
+    # Arrange
+    flags = OrgUnitFlags(UUIDTable())
+    leder_uuid, led_adm_uuid = uuid4(), uuid4()
+
+    # Act
+    flags.add(leder_uuid, "Byudvikling_leder")
+    flags.add(str(led_adm_uuid), "Byudvikling led-adm")
+
+    # Assert
+    assert flags[str(leder_uuid)] == OrgUnitFlag.LEDER
+    assert flags[led_adm_uuid] == OrgUnitFlag.LED_ADM
+    assert led_adm_uuid in flags
+    assert uuid4() not in flags
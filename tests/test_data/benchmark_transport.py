@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""
+Benchmark of response compression and JSON decoding against a local OS2mo.
+
+Runs the largest queries of a run with and without compression, and with orjson
+and the standard library JSON decoder, and prints the bytes received and the CPU
+time spent decoding the responses.
+"""
+import asyncio
+import time
+
+import click
+from raclients.graph.client import PersistentGraphQLClient  # type: ignore
+
+from sd_managerscript.queries import QUERY_MANAGER_ENGAGEMENTS
+from sd_managerscript.queries import QUERY_ORG_UNIT_TREE
+from sd_managerscript.transport import accept_encoding
+from sd_managerscript.transport import FastJSONTransport
+
+
+def construct_client(
+    client_secret: str, compression: bool, fast_json: bool
+) -> PersistentGraphQLClient:
+    gql_client = PersistentGraphQLClient(
+        url="http://localhost:5000/graphql/v22",
+        client_id="dipex",
+        client_secret=client_secret,
+        auth_server="http://localhost:5000/auth",
+        auth_realm="mo",
+        execute_timeout=120,
+        httpx_client_kwargs={
+            "timeout": 120,
+            "headers": {"Accept-Encoding": accept_encoding(compression)},
+        },
+    )
+    gql_client.transport = FastJSONTransport(
+        url=gql_client.transport.url,
+        client_cls=gql_client.transport.client_cls,
+        client_args=gql_client.transport.client_args,
+        fast_json=fast_json,
+    )
+    return gql_client
+
+
+async def run(
+    client_secret: str, root_uuid: str, compression: bool, fast_json: bool, rounds: int
+) -> dict[str, float]:
+    gql_client = construct_client(client_secret, compression, fast_json)
+    async with gql_client as session:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            await session.execute(
+                QUERY_ORG_UNIT_TREE.document, {"limit": None, "cursor": None}
+            )
+            await session.execute(
+                QUERY_MANAGER_ENGAGEMENTS.document, {"uuid": [root_uuid]}
+            )
+        elapsed = time.perf_counter() - started
+    return {**gql_client.transport.summary(), "elapsed": round(elapsed, 3)}
+
+
+@click.command()
+@click.argument("client_password")
+@click.argument("root_uuid")
+@click.option("--rounds", default=5, help="Number of times each query is run")
+def benchmark(client_password: str, root_uuid: str, rounds: int) -> None:
+    for compression in (False, True):
+        for fast_json in (False, True):
+            summary = asyncio.run(
+                run(client_password, root_uuid, compression, fast_json, rounds)
+            )
+            click.echo(
+                f"compression={compression!s:5} orjson={fast_json!s:5} "
+                + " ".join(f"{key}={value}" for key, value in summary.items())
+            )
+
+
+if __name__ == "__main__":
+    benchmark()
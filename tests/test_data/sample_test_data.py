@@ -4,6 +4,7 @@ from collections.abc import Iterable
 from datetime import datetime
 from typing import Any
 from uuid import UUID
+from uuid import uuid4
 
 from dateutil.tz import tzoffset  # type: ignore
 from gql import gql  # type: ignore
@@ -1520,3 +1521,54 @@ def get_unengaged_managers_data() -> (
     list
 ):  # This is terribly typed, but makes mypy happy for now :awesome:
     return unengaged_managers_sample
+
+
+def manager_role(
+    org_unit: UUID,
+    employee: UUID | None,
+    engagement_units: Iterable[tuple[str, UUID, UUID]] = (),
+    manager: UUID | None = None,
+) -> dict:
+    """
+    Manager role as returned by QUERY_MANAGER_ROLES and
+    QUERY_MANAGER_ROLE_ENGAGEMENTS.
+
+    Args:
+        org_unit: Org-unit of the manager role
+        employee: Employee holding the manager role, or None if vacant
+        engagement_units: (name, uuid, parent uuid) of the org-units in which the
+                          employee has an active engagement
+        manager: UUID of the manager role, random if not given
+    """
+    return {
+        "validities": [
+            {
+                "uuid": str(manager or uuid4()),
+                "org_unit_uuid": str(org_unit),
+                "employee_uuid": str(employee) if employee else None,
+                "employee": [
+                    {
+                        "uuid": str(employee),
+                        "engagements": [
+                            {
+                                "org_unit": [
+                                    {
+                                        "name": name,
+                                        "uuid": str(uuid),
+                                        "parent": {"name": "", "uuid": str(parent)},
+                                    }
+                                ],
+                                "validity": {
+                                    "from": "2020-01-01T00:00:00+01:00",
+                                    "to": None,
+                                },
+                            }
+                            for name, uuid, parent in engagement_units
+                        ],
+                    }
+                ]
+                if employee
+                else None,
+            }
+        ]
+    }
@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from collections.abc import Generator
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+from uuid import UUID
+from uuid import uuid4
+
+import pytest
+
+from sd_managerscript.config import get_settings
+from sd_managerscript.delta import affected_leder_units
+from sd_managerscript.delta import changed_managed_units
+from sd_managerscript.delta import delta_start
+from sd_managerscript.delta import get_changes
+from sd_managerscript.delta import get_run_changes
+from sd_managerscript.models import Changes
+from sd_managerscript.org_graph import OrgGraph
+from sd_managerscript.state import StateStore
+
+NOW = datetime(2023, 1, 8, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def delta_sync() -> Generator[None, None, None]:
+    settings = get_settings()
+    with patch.object(settings, "delta_sync", True):
+        yield
+
+
+@pytest.mark.usefixtures("delta_sync")
+def test_delta_start() -> None:
+    state_store = StateStore(":memory:")
+    # No run yet
+    assert delta_start(state_store, NOW) is None
+
+    failed_unit = uuid4()
+    state_store.record_run(NOW - timedelta(days=2), full=True, failed_units=[uuid4()])
+    state_store.record_run(
+        NOW - timedelta(days=1), full=False, failed_units=[failed_unit]
+    )
+    assert state_store.last_run(full=True) == NOW - timedelta(days=2)
+    assert delta_start(state_store, NOW) == NOW - timedelta(days=1)
+    # Only the units failing in the last run are kept
+    assert state_store.failed_units() == {failed_unit}
+
+    # Full reconciliation due
+    assert delta_start(state_store, NOW + timedelta(days=6)) is None
+
+
+def test_delta_start_disabled() -> None:
+    state_store = StateStore(":memory:")
+    state_store.record_run(NOW - timedelta(days=1), full=True)
+    assert delta_start(state_store, NOW) is None
+
+
+@pytest.mark.usefixtures("delta_sync")
+@patch("sd_managerscript.delta.get_changes")
+async def test_get_run_changes(mock_get_changes: AsyncMock) -> None:
+    state_store = StateStore(":memory:")
+    changed, failed_unit = uuid4(), uuid4()
+    mock_get_changes.return_value = Changes(org_units={changed})
+    # No run yet
+    assert await get_run_changes(AsyncMock(), state_store, NOW) is None
+
+    since = NOW - timedelta(days=1)
+    state_store.record_run(since, full=True, failed_units=[failed_unit])
+    changes = await get_run_changes(AsyncMock(), state_store, NOW)
+
+    # The units failing in the last run are processed again
+    assert changes == Changes(org_units={changed, failed_unit})
+    assert mock_get_changes.call_args.args[1:] == (since, NOW)
+
+
+@patch("sd_managerscript.delta.query_graphql")
+@patch("sd_managerscript.delta.query_paginated")
+async def test_get_changes(
+    mock_query_paginated: AsyncMock, mock_query_graphql: AsyncMock
+) -> None:
+    org_unit, leder_unit, managed_unit, employee = (uuid4() for _ in range(4))
+    changed_engagement, ended_engagement, started_manager = (uuid4() for _ in range(3))
+
+    def validity(from_: datetime, to: datetime | None = None) -> dict:
+        return {
+            "validity": {
+                "from": from_.isoformat(),
+                "to": to.isoformat() if to else None,
+            }
+        }
+
+    since = NOW - timedelta(days=1)
+    mock_query_paginated.side_effect = [
+        [
+            {"uuid": str(org_unit), "model": "org_unit"},
+            {"uuid": str(changed_engagement), "model": "engagement"},
+            {"uuid": str(changed_engagement), "model": "engagement"},
+        ],
+        [
+            # Ends in the interval
+            {"uuid": str(ended_engagement), "validities": [validity(since, NOW)]},
+            # Started before and still running
+            {"uuid": str(uuid4()), "validities": [validity(since)]},
+        ],
+        [
+            {
+                "uuid": str(started_manager),
+                "validities": [
+                    validity(since - timedelta(days=1), since),
+                    validity(NOW),
+                ],
+            },
+            # Starts after the interval
+            {"uuid": str(uuid4()), "validities": [validity(NOW + timedelta(days=1))]},
+        ],
+    ]
+
+    def validities(*org_units: UUID, employee: UUID | None = None) -> dict:
+        return {
+            "objects": [
+                {
+                    "validities": [
+                        {"org_unit_uuid": str(uuid)}
+                        | ({"employee_uuid": str(employee)} if employee else {})
+                        for uuid in org_units
+                    ]
+                }
+            ]
+            if org_units
+            else []
+        }
+
+    mock_query_graphql.side_effect = [
+        {
+            "org_units": {"objects": [{"uuid": str(org_unit)}]},
+            "associations": validities(),
+            "engagements": validities(org_unit, employee=employee),
+            "managers": validities(),
+        },
+        {
+            "associations": validities(leder_unit),
+            "managers": validities(managed_unit),
+        },
+    ]
+
+    changes = await get_changes(AsyncMock(), since, NOW)
+
+    assert changes == Changes(
+        org_units={org_unit, leder_unit, managed_unit}, employees={employee}
+    )
+    assert mock_query_paginated.call_args_list[0].args[2]["start"] == since.isoformat()
+    assert mock_query_paginated.call_args.args[2] == {
+        "from_date": since.isoformat(),
+        "to_date": NOW.isoformat(),
+    }
+    assert mock_query_graphql.call_args_list[0].args[2] == {
+        "uuids": sorted(
+            map(str, {org_unit, changed_engagement, ended_engagement, started_manager})
+        )
+    }
+    assert mock_query_graphql.call_args_list[1].args[2] == {"uuids": [str(employee)]}
+
+
+def test_changed_managed_units(graph: OrgGraph, org_uuids: dict[str, UUID]) -> None:
+    changes = Changes(org_units={org_uuids["Plan led-adm"], uuid4()})
+
+    assert set(changed_managed_units(graph, changes)) == {
+        org_uuids["Plan led-adm"],
+        org_uuids["Byudvikling led-adm"],
+    }
+
+
+def test_affected_leder_units(graph: OrgGraph, org_uuids: dict[str, UUID]) -> None:
+    def ids(*names: str) -> list[int]:
+        return [graph.id(org_uuids[name]) for name in names]
+
+    # Changed target org-unit of a led-adm chain
+    changes = Changes(org_units={org_uuids["Borgmesterens Afdeling"]})
+    assert affected_leder_units(graph, changes) == ids(
+        "Byudvikling_leder", "Plan_leder"
+    )
+
+    # Changed associations of a "_leder" unit
+    changes = Changes(
+        org_units={org_uuids["Skoler_leder"], org_uuids["Ø_Skoler_leder"]}
+    )
+    assert affected_leder_units(graph, changes) == ids("Skoler_leder")
+
+    assert affected_leder_units(graph, Changes()) == []
@@ -0,0 +1,207 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from unittest.mock import patch
+from uuid import UUID
+from uuid import uuid4
+
+from structlog.testing import capture_logs
+
+from sd_managerscript.cache import ReadCache
+from sd_managerscript.events import Broker
+from sd_managerscript.events import consume_events
+from sd_managerscript.events import Debouncer
+from sd_managerscript.events import handle_event
+from sd_managerscript.events import start_consumer
+from sd_managerscript.manager_index import ManagerIndex
+from sd_managerscript.models import Changes
+from sd_managerscript.models import Event
+from sd_managerscript.org_graph import OrgGraph
+
+
+async def test_debouncer_collapses_bursts() -> None:
+    processed: list[UUID] = []
+
+    async def process(org_unit_uuid: UUID) -> None:
+        processed.append(org_unit_uuid)
+
+    debouncer = Debouncer(0.01, process)
+    unit, other = uuid4(), uuid4()
+    for _ in range(5):
+        debouncer.submit(unit)
+        await asyncio.sleep(0)
+    debouncer.submit(other)
+    await debouncer.drain()
+
+    assert sorted(processed) == sorted([unit, other])
+    assert len(debouncer) == 0
+
+
+async def test_debouncer_reprocesses_on_event_during_processing() -> None:
+    unit = uuid4()
+    calls = 0
+
+    async def process(org_unit_uuid: UUID) -> None:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            debouncer.submit(org_unit_uuid)
+
+    debouncer = Debouncer(0, process)
+    debouncer.submit(unit)
+    await debouncer.drain()
+
+    assert calls == 2
+
+
+async def test_debouncer_logs_failures() -> None:
+    debouncer = Debouncer(0, AsyncMock(side_effect=ValueError("MO is down")))
+    with capture_logs() as cap_logs:
+        debouncer.submit(uuid4())
+        await debouncer.drain()
+
+    assert [log["event"] for log in cap_logs] == ["Processing failed"]
+
+
+@patch("sd_managerscript.events.resolve_changes")
+async def test_handle_event(mock_resolve_changes: AsyncMock) -> None:
+    org_unit, employee = uuid4(), uuid4()
+    mock_resolve_changes.return_value = Changes(
+        org_units={org_unit}, employees={employee}
+    )
+    gql_client = AsyncMock()
+    leder_units, employees = MagicMock(), MagicMock()
+    manager_index = MagicMock(refresh=AsyncMock())
+
+    async def handle(routing_key: str, uuid: UUID) -> None:
+        await handle_event(
+            gql_client,
+            Event(routing_key=routing_key, uuid=uuid),
+            leder_units,
+            employees,
+            manager_index,
+        )
+
+    other_org_unit = uuid4()
+    await handle("org_unit", other_org_unit)
+    leder_units.submit.assert_called_once_with(other_org_unit)
+    mock_resolve_changes.assert_not_awaited()
+
+    association = uuid4()
+    await handle("association", association)
+    mock_resolve_changes.assert_awaited_once_with(gql_client, {str(association)})
+    leder_units.submit.assert_called_with(org_unit)
+
+    await handle("engagement", uuid4())
+    employees.submit.assert_called_once_with(employee)
+
+    manager = uuid4()
+    await handle("manager", manager)
+    manager_index.refresh.assert_awaited_once_with(gql_client, [manager])
+
+    await handle("address", uuid4())
+    assert leder_units.submit.call_count == 2
+
+
+@patch("sd_managerscript.events.resolve_changes")
+async def test_handle_event_invalidates_read_cache(
+    mock_resolve_changes: AsyncMock,
+) -> None:
+    association, org_unit = uuid4(), uuid4()
+    mock_resolve_changes.return_value = Changes(org_units={org_unit})
+    read_cache = ReadCache(10, 60)
+    read_cache.put("a", "", {}, {str(org_unit)})
+    read_cache.put("b", "", {}, {str(uuid4())})
+
+    await handle_event(
+        AsyncMock(),
+        Event(routing_key="association", uuid=association),
+        MagicMock(),
+        read_cache=read_cache,
+    )
+
+    assert read_cache.get("a") is None
+    assert read_cache.get("b") == {}
+
+
+async def test_consume_events() -> None:
+    unit = uuid4()
+    process = AsyncMock()
+    broker = Broker()
+    debouncer = Debouncer(0.01, process)
+    consumer = asyncio.create_task(consume_events(AsyncMock(), broker, debouncer))
+
+    for _ in range(3):
+        await broker.publish(Event(routing_key="org_unit", uuid=unit))
+    await broker.join()
+    await debouncer.drain()
+    consumer.cancel()
+
+    process.assert_awaited_once_with(unit)
+
+
+@patch("sd_managerscript.events.resolve_changes")
+async def test_handle_event_org_graph(
+    mock_resolve_changes: AsyncMock, graph: OrgGraph, org_uuids: dict[str, UUID]
+) -> None:
+    leder, other, unknown = org_uuids["Skoler_leder"], org_uuids["Skoler"], uuid4()
+    leder_units = MagicMock()
+
+    # Only the "_leder" unit and the org-unit unknown to the graph are scheduled
+    for uuid in (leder, other, unknown):
+        mock_resolve_changes.return_value = Changes(org_units={uuid})
+        await handle_event(
+            AsyncMock(),
+            Event(routing_key="association", uuid=uuid4()),
+            leder_units,
+            graph=graph,
+        )
+    assert [call.args[0] for call in leder_units.submit.call_args_list] == [
+        leder,
+        unknown,
+    ]
+
+    # The org-unit may have been renamed to a "_leder" unit
+    leder_units.reset_mock()
+    await handle_event(
+        AsyncMock(), Event(routing_key="org_unit", uuid=other), leder_units, graph=graph
+    )
+    assert graph.may_be_leder_unit(other)
+    leder_units.submit.assert_called_once_with(other)
+
+
+@patch("sd_managerscript.events.load_org_graph")
+async def test_start_consumer_waits_for_manager_index(
+    mock_load_org_graph: AsyncMock, graph: OrgGraph, org_uuids: dict[str, UUID]
+) -> None:
+    mock_load_org_graph.return_value = graph
+    loaded = asyncio.Event()
+    manager_index = ManagerIndex()
+
+    async def refresh(gql_client: AsyncMock) -> None:
+        await loaded.wait()
+
+    manager_index.refresh = refresh  # type: ignore
+    broker = Broker()
+    leder_units, employees = MagicMock(), MagicMock()
+    consumer = asyncio.create_task(
+        start_consumer(AsyncMock(), broker, leder_units, employees, manager_index)
+    )
+
+    leder = org_uuids["Skoler_leder"]
+    await broker.publish(Event(routing_key="org_unit", uuid=leder))
+    await asyncio.sleep(0.01)
+    # The event is kept by the broker until the manager index is loaded
+    assert len(broker) == 1
+    leder_units.submit.assert_not_called()
+
+    with capture_logs() as cap_logs:
+        loaded.set()
+        await asyncio.wait_for(broker.join(), 1)
+    consumer.cancel()
+
+    leder_units.submit.assert_called_once_with(leder)
+    assert cap_logs[0]["event"] == "Event consumer started"
+    assert cap_logs[0]["buffered_events"] == 1
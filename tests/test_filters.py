@@ -1,13 +1,18 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
+import asyncio
 from datetime import datetime
 from unittest.mock import AsyncMock
 from unittest.mock import MagicMock
 from unittest.mock import patch
+from uuid import UUID
 from uuid import uuid4
 
+import pytest
 from ramodels.mo import Validity  # type: ignore
 
+from sd_managerscript.config import get_settings
+from sd_managerscript.exceptions import ConflictingManagers
 from sd_managerscript.filters import filter_manager_org_units
 from sd_managerscript.filters import remove_org_units_without_associations
 from sd_managerscript.models import Association
@@ -70,3 +75,99 @@ async def test_manager_units_without_associations_are_removed(
 
     # Assert
     mock_remove_org_unit_without_associations.assert_called_once()
+
+
+@patch("sd_managerscript.filters.filter_managers")
+async def test_failing_units_are_recorded_and_skipped(
+    mock_filter_managers: AsyncMock,
+) -> None:
+    # Arrange
+    parent = Parent(
+        uuid=uuid4(),
+        name="Parent OU name",
+        parent_uuid=uuid4(),
+        org_unit_level_uuid=uuid4(),
+    )
+    association = Association(
+        uuid=uuid4(),
+        org_unit_uuid=uuid4(),
+        employee_uuid=uuid4(),
+        association_type_uuid=uuid4(),
+        validity=Validity(from_date=datetime.now()),
+    )
+    failing, ok = (
+        OrgUnitManagers(
+            uuid=uuid4(),
+            name="OU name",
+            has_children=False,
+            associations=[association],
+            parent=parent,
+        )
+        for _ in range(2)
+    )
+    mock_filter_managers.side_effect = [ConflictingManagers("Conflict"), ok]
+    failures: dict[UUID, str] = {}
+
+    # Act
+    filtered = await filter_manager_org_units(
+        AsyncMock(), [failing, ok], failures=failures
+    )
+
+    # Assert
+    assert filtered == [ok]
+    assert list(failures) == [failing.uuid]
+    assert "Conflict" in failures[failing.uuid]
+
+    # Without a failure record the error is raised
+    mock_filter_managers.side_effect = ConflictingManagers("Conflict")
+    with pytest.raises(ConflictingManagers):
+        await filter_manager_org_units(AsyncMock(), [failing])
+
+
+@patch("sd_managerscript.filters.filter_managers")
+async def test_units_are_selected_concurrently(
+    mock_filter_managers: AsyncMock,
+) -> None:
+    # Arrange
+    parent = Parent(
+        uuid=uuid4(),
+        name="Parent OU name",
+        parent_uuid=uuid4(),
+        org_unit_level_uuid=uuid4(),
+    )
+    association = Association(
+        uuid=uuid4(),
+        org_unit_uuid=uuid4(),
+        employee_uuid=uuid4(),
+        association_type_uuid=uuid4(),
+        validity=Validity(from_date=datetime.now()),
+    )
+    org_units = [
+        OrgUnitManagers(
+            uuid=uuid4(),
+            name="OU name",
+            has_children=False,
+            associations=[association],
+            parent=parent,
+        )
+        for _ in range(3)
+    ]
+    running = []
+
+    async def filter_managers(gql_client: AsyncMock, org_unit: OrgUnitManagers):
+        running.append(org_unit)
+        # Wait until all units are being selected
+        while len(running) < len(org_units):
+            await asyncio.sleep(0)
+        return org_unit
+
+    mock_filter_managers.side_effect = filter_managers
+
+    # Act
+    with patch.object(get_settings(), "unit_concurrency", 3):
+        filtered = await asyncio.wait_for(
+            filter_manager_org_units(AsyncMock(), org_units), 1
+        )
+
+    # Assert
+    assert filtered == org_units
@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+
+import pytest
+
+from sd_managerscript.hedging import Hedger
+
+
+def warm_hedger(**kwargs: float) -> Hedger:
+    hedger = Hedger(min_samples=2, **kwargs)
+    hedger._latencies.extend([0.01, 0.01])
+    hedger.requests = 100
+    return hedger
+
+
+async def test_fast_requests_are_not_hedged() -> None:
+    hedger = warm_hedger()
+    calls = 0
+
+    async def request() -> str:
+        nonlocal calls
+        calls += 1
+        return "fast"
+
+    assert await hedger.run(request) == "fast"
+    assert calls == 1
+    assert hedger.hedges == 0
+
+
+async def test_slow_request_is_hedged() -> None:
+    hedger = warm_hedger()
+    slow = asyncio.Event()
+    cancelled = False
+
+    async def request() -> str:
+        nonlocal cancelled
+        if not slow.is_set():
+            slow.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            return "slow"
+        return "hedge"
+
+    assert await asyncio.wait_for(hedger.run(request), 1) == "hedge"
+    await asyncio.sleep(0)
+    assert cancelled
+    assert hedger.summary()["hedges"] == hedger.summary()["hedge_wins"] == 1
+
+
+async def test_hedge_ratio_is_capped() -> None:
+    hedger = warm_hedger(max_ratio=0.0)
+
+    async def request() -> str:
+        await asyncio.sleep(0.05)
+        return "slow"
+
+    assert await hedger.run(request) == "slow"
+    assert hedger.hedges == 0
+
+
+async def test_failure_falls_back_to_other_request() -> None:
+    hedger = warm_hedger()
+    calls = 0
+
+    async def request() -> str:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(0.05)
+            raise ValueError("MO is down")
+        await asyncio.sleep(0.1)
+        return "hedge"
+
+    assert await hedger.run(request) == "hedge"
+
+    # Without a hedge the failure is raised
+    hedger = Hedger()
+    with pytest.raises(ValueError):
+        calls = 0
+        await hedger.run(request)
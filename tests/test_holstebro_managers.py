@@ -1,10 +1,13 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
+import asyncio
 from collections.abc import Generator
 from copy import deepcopy
 from datetime import datetime
 from datetime import timedelta
+from datetime import timezone
 from unittest import mock
+from unittest.mock import ANY
 from unittest.mock import AsyncMock
 from unittest.mock import call
 from unittest.mock import MagicMock
@@ -16,32 +19,60 @@ import pytest
 from dateutil.tz import tzoffset  # type: ignore
 from freezegun import freeze_time  # type: ignore
 from gql import gql  # type: ignore
+from graphql import print_ast
+from more_itertools import one
 from ramodels.mo import Validity  # type: ignore
 from structlog.testing import capture_logs
 
+from sd_managerscript.classification import OrgUnitFlags
+from sd_managerscript.config import get_settings
 from sd_managerscript.exceptions import ConflictingManagers  # type: ignore
 from sd_managerscript.filters import filter_managers
+from sd_managerscript.holstebro_managers import check_employee_managers
 from sd_managerscript.holstebro_managers import check_manager_engagement
+from sd_managerscript.holstebro_managers import check_manager_engagement_by_level
+from sd_managerscript.holstebro_managers import check_manager_roles
 from sd_managerscript.holstebro_managers import create_manager_object
 from sd_managerscript.holstebro_managers import create_update_manager
+from sd_managerscript.holstebro_managers import create_update_managers
+from sd_managerscript.holstebro_managers import find_manager_org_units
+from sd_managerscript.holstebro_managers import find_managers_to_terminate
 from sd_managerscript.holstebro_managers import get_current_manager
-from sd_managerscript.holstebro_managers import get_manager_level
 from sd_managerscript.holstebro_managers import get_manager_org_units
 from sd_managerscript.holstebro_managers import get_unengaged_managers
+from sd_managerscript.holstebro_managers import get_unengaged_managers_columnar
+from sd_managerscript.holstebro_managers import is_led_adm_unit
 from sd_managerscript.holstebro_managers import is_manager_correct
+from sd_managerscript.holstebro_managers import reconcile_mutations
+from sd_managerscript.holstebro_managers import skip_unchanged_org_units
+from sd_managerscript.holstebro_managers import update_leder_unit
 from sd_managerscript.holstebro_managers import update_manager
+from sd_managerscript.holstebro_managers import update_mo_managers
+from sd_managerscript.interning import UUIDTable
+from sd_managerscript.manager_index import ManagerIndex
 from sd_managerscript.mo import get_active_engagements
 from sd_managerscript.models import Association
+from sd_managerscript.models import Changes
 from sd_managerscript.models import EngagementFrom
 from sd_managerscript.models import Manager
 from sd_managerscript.models import ManagerLevel
+from sd_managerscript.models import ManagerTarget
 from sd_managerscript.models import ManagerType
 from sd_managerscript.models import OrgUnitManager
 from sd_managerscript.models import OrgUnitManagers
 from sd_managerscript.models import Parent
-from sd_managerscript.queries import QUERY_ORG_UNIT_LEVEL
+from sd_managerscript.mutation_log import MutationLog
+from sd_managerscript.operations import lookup_operation
+from sd_managerscript.org_graph import OrgGraph
+from sd_managerscript.queries import QUERY_CURRENT_ENGAGEMENTS
+from sd_managerscript.queries import QUERY_ENGAGEMENTS
+from sd_managerscript.queries import QUERY_MANAGER_ENGAGEMENTS
+from sd_managerscript.queries import QUERY_ROOT_MANAGER_ENGAGEMENTS
+from sd_managerscript.state import RunProgress
+from sd_managerscript.state import StateStore
 from sd_managerscript.terminate import terminate_association
 from sd_managerscript.terminate import terminate_manager
+from sd_managerscript.util import query_scope
 from tests.test_data.sample_test_data import get_active_engagements_data  # type: ignore
 from tests.test_data.sample_test_data import get_create_manager_data
 from tests.test_data.sample_test_data import get_create_update_manager_data
@@ -52,6 +83,7 @@ from tests.test_data.sample_test_data import get_filter_managers_terminate
 from tests.test_data.sample_test_data import get_manager_engagement_data
 from tests.test_data.sample_test_data import get_unengaged_managers_data
 from tests.test_data.sample_test_data import get_update_managers_data
+from tests.test_data.sample_test_data import manager_role
 
 # from tests.test_data.sample_test_data import get_sample_data
 
@@ -125,7 +157,9 @@ async def test_get_manager_org_units(
         ),
     ]
 
-    manager_org_units = await get_manager_org_units(mock_query_graphql)
+    manager_org_units = await get_manager_org_units(
+        mock_query_graphql, None, [UUID("72d8e92f-9481-43af-8cb0-a83823c9f35e")]
+    )
 
     # Assert
     assert manager_org_units == [
@@ -219,6 +253,52 @@ async def test_get_unengaged_managers(
     assert managers_to_terminate == expected
 
 
+@freeze_time("2023-01-01")
+@pytest.mark.parametrize("query_dict, expected", get_unengaged_managers_data())
+def test_get_unengaged_managers_columnar(
+    query_dict: dict[str, str | dict[str, str]], expected: UUID | None
+) -> None:
+    """Test the columnar evaluation finds the same managers as the scalar one"""
+    pytest.importorskip("numpy")
+
+    managers_to_terminate = get_unengaged_managers_columnar([query_dict])
+
+    assert managers_to_terminate == expected
+
+
+@freeze_time("2023-01-01")
+async def test_get_unengaged_managers_columnar_batch() -> None:
+    """Test the columnar evaluation matches the scalar one on a batch of org-units"""
+    pytest.importorskip("numpy")
+
+    query_dicts = [
+        org_unit
+        for data in get_manager_engagement_data()
+        for org_unit in data["org_units"]["objects"]
+    ] + [query_dict for query_dict, _ in get_unengaged_managers_data()]
+    expected = [
+        org_unit_manager
+        for query_dict in query_dicts
+        for org_unit_manager in await get_unengaged_managers(query_dict)
+    ]
+
+    assert get_unengaged_managers_columnar(query_dicts) == expected
+
+
+def test_is_led_adm_unit_uses_flags() -> None:
+    """Test precomputed classification flags are used for known org-units"""
+    known, unknown = str(uuid4()), str(uuid4())
+    flags = OrgUnitFlags(UUIDTable())
+    flags.add(known, "Plan led-adm")
+
+    # The name is not classified again for known org-units
+    with patch("sd_managerscript.holstebro_managers.classify") as mock_classify:
+        assert is_led_adm_unit({"uuid": known, "name": "Plan led-adm"}, flags)
+        mock_classify.assert_not_called()
+    assert is_led_adm_unit({"uuid": unknown, "name": "Skoler led-adm"}, flags)
+    assert not is_led_adm_unit({"uuid": unknown, "name": "Skoler"}, flags)
+
+
 @pytest.mark.parametrize(
     "query_dict",
     [
@@ -276,15 +356,53 @@ async def test_get_active_engagements(
 ) -> None:
     """Test the "get_active_engagements" method returns correct Manager objects."""
     # Arrange
+    for obj in engagement["engagements"]["objects"]:
+        for validity in obj["validities"]:
+            validity["employee_uuid"] = str(employee_uuid)
     mock_query_gql.return_value = engagement
 
     # Act
-    returned_managers = await get_active_engagements(gql_client, employee_uuid)
+    with patch.object(get_settings(), "engagement_history", True):
+        returned_managers = await get_active_engagements(gql_client, employee_uuid)
 
     # Assert
+    assert mock_query_gql.call_args.args[1] == QUERY_ENGAGEMENTS
     assert returned_managers == EngagementFrom.parse_obj(expected)
 
 
+@patch("sd_managerscript.mo.query_graphql")
+async def test_get_active_engagements_current(mock_query_gql: AsyncMock) -> None:
+    """Test only the current engagements are fetched by default"""
+    employee_uuid = uuid4()
+
+    def current(from_: str) -> dict:
+        return {"employee_uuid": str(employee_uuid), "validity": {"from": from_}}
+
+    mock_query_gql.return_value = {
+        "engagements": {
+            "objects": [
+                {"current": current("2001-01-01T00:00:00+01:00")},
+                {"current": current("2010-01-01T00:00:00+01:00")},
+                # Past or future engagement
+                {"current": None},
+            ]
+        }
+    }
+
+    engagement = await get_active_engagements(AsyncMock(), employee_uuid)
+
+    assert mock_query_gql.call_args.args[1] == QUERY_CURRENT_ENGAGEMENTS
+    assert engagement == EngagementFrom(
+        employee_uuid=employee_uuid,
+        engagement_from=datetime.fromisoformat("2010-01-01T00:00:00+01:00"),
+    )
+
+    # No current engagements
+    mock_query_gql.return_value = {"engagements": {"objects": [{"current": None}]}}
+    engagement = await get_active_engagements(AsyncMock(), employee_uuid)
+    assert engagement.engagement_from is None
+
+
 @pytest.mark.parametrize("org_unit, engagements, expected", get_filter_managers_data())
 @patch("sd_managerscript.terminate.terminate_association")
 @patch("sd_managerscript.filters.get_active_engagements")
@@ -381,7 +499,10 @@ async def test_terminate_association(
 
     await terminate_association(gql_client, UUID(association_uuid))
 
-    mock_execute_mutator.assert_called_once_with(gql_client, mut_query, input_)
+    mock_execute_mutator.assert_called_once_with(gql_client, ANY, input_)
+    assert print_ast(mock_execute_mutator.call_args.args[1].document) == print_ast(
+        mut_query
+    )
 
 
 @pytest.mark.parametrize(
@@ -418,7 +539,10 @@ async def test_terminate_manager(
 
     await terminate_manager(gql_client, UUID(manager_uuid))
 
-    mock_execute_mutator.assert_called_once_with(gql_client, mut_query, input)
+    mock_execute_mutator.assert_called_once_with(gql_client, ANY, input)
+    assert print_ast(mock_execute_mutator.call_args.args[1].document) == print_ast(
+        mut_query
+    )
 
 
 @patch("sd_managerscript.holstebro_managers.query_graphql")
@@ -440,6 +564,7 @@ async def test_get_current_manager_uuid(
         "org_units": {
             "objects": [
                 {
+                    "uuid": str(ou_uuid),
                     "validities": [
                         {
                             "managers": [
@@ -456,7 +581,7 @@ async def test_get_current_manager_uuid(
                                 }
                             ]
                         }
-                    ]
+                    ],
                 }
             ]
         }
@@ -484,7 +609,9 @@ async def test_get_current_manager_none(
 
     ou_uuid = "27935dbb-c173-4116-a4b5-75022315749d"
 
-    return_dict: dict = {"org_units": {"objects": [{"validities": [{"managers": []}]}]}}
+    return_dict: dict = {
+        "org_units": {"objects": [{"uuid": ou_uuid, "validities": [{"managers": []}]}]}
+    }
 
     mock_query_graphql.return_value = return_dict
     returned_uuid = await get_current_manager(gql_client, UUID(ou_uuid))
@@ -511,10 +638,19 @@ async def test_update_manager_object(
     """Test update_manager can update and create new manager object"""
 
     mock_get_current_manager.return_value = current_manager
+    created_uuid = uuid4()
+    mock_execute_mutator.return_value = {"manager_create": {"uuid": str(created_uuid)}}
 
-    await update_manager(gql_client, org_unit_uuid, manager)
+    assigned = await update_manager(gql_client, org_unit_uuid, manager)
 
-    mock_execute_mutator.assert_called_once_with(gql_client, query, variables)
+    assert assigned.uuid == (
+        created_uuid if current_manager is None else current_manager.uuid
+    )
+    assert assigned.org_unit == org_unit_uuid
+    mock_execute_mutator.assert_called_once_with(gql_client, ANY, variables)
+    assert print_ast(mock_execute_mutator.call_args.args[1].document) == print_ast(
+        query
+    )
 
 
 @patch("sd_managerscript.holstebro_managers.execute_mutator")
@@ -621,101 +757,22 @@ async def test_create_manager_object(
     assert returned_manager == expected_manager
 
 
-async def test_get_manager_level(gql_client: AsyncMock) -> None:
-    """
-    Test get_manager_level in the case where the OU is a "normal"
-    unit, i.e. a unit where the name is not suffixed with led-adm
-    """
-
-    # Arrange
-    org_unit_manager = OrgUnitManagers(
-        uuid=UUID("100b9d19-3190-490f-94f9-759b6b24172a"),
-        name="SomeUnit_leder",
-        has_children=False,
-        parent=Parent(
-            uuid=UUID("9a2bbe63-b7b4-4b3d-9b47-9d7dd391b42c"),
-            name="SomeUnit",
-            parent_uuid=UUID("2665d8e0-435b-5bb6-a550-f275692984ef"),
-            org_unit_level_uuid=UUID("0263522a-2c1e-9c80-1880-92c1b97cfead"),
-        ),
-        associations=[],
-    )
-
-    # Act
-    actual_manager_level = await get_manager_level(gql_client, org_unit_manager)
-
-    # Assert
-    assert actual_manager_level == ManagerLevel(
-        uuid=UUID("a8754726-a4b9-1715-6b41-769c6fe703c5")
-    )
-
-
-async def test_get_manager_level_led_adm() -> None:
-    """
-    Test get_manager_level in the case where the OU is a "led-adm"
-    unit, i.e. a unit where the name is suffixed with "led-adm"
-    """
-
-    # Arrange
-    org_unit_manager = OrgUnitManagers(
-        uuid=UUID("100b9d19-3190-490f-94f9-759b6b24172a"),
-        name="SomeUnit_leder",
-        has_children=False,
-        parent=Parent(
-            uuid=UUID("9a2bbe63-b7b4-4b3d-9b47-9d7dd391b42c"),
-            name="SomeUnit led-adm",
-            parent_uuid=UUID("2665d8e0-435b-5bb6-a550-f275692984ef"),
-            org_unit_level_uuid=UUID("0263522a-2c1e-9c80-1880-92c1b97cfead"),
-        ),
-        associations=[],
-    )
-    mock_gql_client = AsyncMock()
-    mock_execute = AsyncMock(
-        return_value={
-            "org_units": {
-                "objects": [
-                    {
-                        "validities": [
-                            {
-                                "org_unit_level_uuid": "891603db-cc28-6ed2-6d48-25e14d3f142f"
-                            }
-                        ]
-                    }
-                ]
-            }
-        }
-    )
-    mock_gql_client.execute = mock_execute
-
-    # Act
-    actual_manager_level = await get_manager_level(mock_gql_client, org_unit_manager)
-
-    # Assert
-    mock_execute.assert_awaited_once_with(
-        QUERY_ORG_UNIT_LEVEL,
-        variable_values={"uuids": "2665d8e0-435b-5bb6-a550-f275692984ef"},
-    )
-    assert actual_manager_level == ManagerLevel(
-        uuid=UUID("e226821b-4af3-1e91-c53f-ea5c57c6d8d0")
-    )
-
-
 @patch("sd_managerscript.holstebro_managers.update_manager")
 @patch("sd_managerscript.holstebro_managers.create_manager_object")
-@patch("sd_managerscript.holstebro_managers.get_manager_level")
 async def test_create_update_manager(
-    mock_get_manager_level: MagicMock,
     mock_create_manager_object: MagicMock,
     mock_update_manager: MagicMock,
 ) -> None:
     """Test creating and updating Manager object and role"""
 
     org_unit, manager_lvl, manager = get_create_update_manager_data()
+    target = ManagerTarget(org_units=[org_unit.parent.uuid], manager_level=manager_lvl)
 
-    mock_get_manager_level.return_value = manager_lvl
     mock_create_manager_object.return_value = manager
 
-    await create_update_manager(gql_client, org_unit)
+    await create_update_manager(gql_client, org_unit, target)
+
+    mock_create_manager_object.assert_awaited_once_with(org_unit, manager_lvl)
 
     mock_update_manager.assert_called_once_with(
         gql_client, org_unit.parent.uuid, manager
@@ -724,9 +781,7 @@ async def test_create_update_manager(
 
 @patch("sd_managerscript.holstebro_managers.update_manager")
 @patch("sd_managerscript.holstebro_managers.create_manager_object")
-@patch("sd_managerscript.holstebro_managers.get_manager_level")
 async def test_create_update_manager_led_adm(
-    mock_get_manager_level: MagicMock,
     mock_create_manager_object: MagicMock,
     mock_update_manager: MagicMock,
 ) -> None:
@@ -736,14 +791,569 @@ async def test_create_update_manager_led_adm(
 
     """
     org_unit, manager_lvl, manager = get_create_update_manager_led_adm_data()
+    target = ManagerTarget(
+        org_units=[org_unit.parent.uuid, org_unit.parent.parent_uuid],
+        manager_level=manager_lvl,
+    )
 
-    mock_get_manager_level.return_value = manager_lvl
     mock_create_manager_object.return_value = manager
     calls = [
         call(gql_client, org_unit.parent.uuid, manager),
         call(gql_client, org_unit.parent.parent_uuid, manager),
     ]
 
-    await create_update_manager(gql_client, org_unit)
+    await create_update_manager(gql_client, org_unit, target)
 
     mock_update_manager.assert_has_calls(calls, any_order=True)
+
+
+@patch("sd_managerscript.holstebro_managers.create_update_manager")
+async def test_create_update_managers(mock_create_update_manager: AsyncMock) -> None:
+    """Test units are updated concurrently, but in order for shared targets"""
+    org_unit, manager_lvl, _ = get_create_update_manager_data()
+    first, second, other, failing = (
+        org_unit.copy(update={"uuid": uuid4()}) for _ in range(4)
+    )
+    shared = ManagerTarget(org_units=[uuid4()], manager_level=manager_lvl)
+    separate = ManagerTarget(org_units=[uuid4()], manager_level=manager_lvl)
+    events = []
+
+    async def create_update_manager(gql_client, org_unit, target, dry_run):
+        events.append(("start", org_unit.uuid))
+        if org_unit is failing:
+            raise ValueError("MO is down")
+        await asyncio.sleep(0.01 if org_unit is first else 0)
+        events.append(("end", org_unit.uuid))
+        return []
+
+    mock_create_update_manager.side_effect = create_update_manager
+    failures: dict[UUID, str] = {}
+    updated = MagicMock()
+
+    with patch.object(get_settings(), "unit_concurrency", 10):
+        await create_update_managers(
+            gql_client,
+            [(first, shared), (second, shared), (other, separate), (failing, separate)],
+            failures,
+            on_updated=updated,
+        )
+
+    # The unit with a separate target does not wait for the first unit
+    assert events.index(("end", other.uuid)) < events.index(("end", first.uuid))
+    # The unit sharing the target of the first unit waits for it
+    assert events.index(("end", first.uuid)) < events.index(("start", second.uuid))
+    assert list(failures) == [failing.uuid]
+    updated.assert_has_calls(
+        [
+            call(other, separate, []),
+            call(first, shared, []),
+            call(second, shared, []),
+        ]
+    )
+    assert updated.call_count == 3
+
+
+@patch("sd_managerscript.holstebro_managers.get_current_manager")
+async def test_skip_unchanged_org_units(mock_get_current_manager: AsyncMock) -> None:
+    """Test "_leder" units are skipped if unchanged since the last run"""
+    org_unit, manager_lvl, manager = get_create_update_manager_led_adm_data()
+    changed, retargeted, rehired, edited = (
+        org_unit.copy(update={"uuid": uuid4()}) for _ in range(4)
+    )
+    units = [org_unit, changed, retargeted, rehired, edited]
+    uuids = UUIDTable()
+    targets = {
+        ou.uuid: ManagerTarget(org_units=[uuid4()], manager_level=manager_lvl)
+        for ou in units
+    }
+    manager_targets = {uuids.intern(uuid): target for uuid, target in targets.items()}
+    # The manager roles assigned in the target org-units
+    assigned = {
+        target.org_units[0]: manager.copy(
+            update={"uuid": uuid4(), "org_unit": target.org_units[0]}
+        )
+        for target in targets.values()
+    }
+    employee = org_unit.associations[0].employee_uuid
+    engagement_from = {employee: datetime(2022, 1, 1)}
+    state_store = StateStore(":memory:")
+    for ou in units:
+        target = targets[ou.uuid]
+        state_store.record(ou, target, engagement_from, [assigned[target.org_units[0]]])
+
+    changed = changed.copy(update={"associations": []})
+    manager_targets[uuids.intern(retargeted.uuid)] = targets[retargeted.uuid].copy(
+        update={"org_units": [uuid4()]}
+    )
+    units = [org_unit, changed, retargeted, rehired, edited]
+    # The manager role of a unit was changed manually in MO
+    edited_org_unit = targets[edited.uuid].org_units[0]
+    assigned[edited_org_unit] = assigned[edited_org_unit].copy(
+        update={"employee": uuid4()}
+    )
+    mock_get_current_manager.side_effect = lambda gql_client, uuid: assigned.get(uuid)
+
+    assert await skip_unchanged_org_units(
+        gql_client, units, manager_targets, uuids, state_store, set(), engagement_from
+    ) == [changed, retargeted, edited]
+    # A changed engagement of a candidate forces re-evaluation
+    assert await skip_unchanged_org_units(
+        gql_client, [rehired], manager_targets, uuids, state_store, set(), {}
+    ) == [rehired]
+    # A manager changed in a target org-unit in the run forces re-evaluation
+    assert await skip_unchanged_org_units(
+        gql_client,
+        [org_unit],
+        manager_targets,
+        uuids,
+        state_store,
+        set(targets[org_unit.uuid].org_units),
+        engagement_from,
+    ) == [org_unit]
+
+
+@patch("sd_managerscript.holstebro_managers.get_current_manager")
+async def test_skip_unchanged_org_units_after_restart(
+    mock_get_current_manager: AsyncMock,
+) -> None:
+    """
+    Test a "_leder" unit targeting an org-unit whose manager was terminated before
+    a restart is processed, although its fingerprint is unchanged
+    """
+    org_unit, manager_lvl, manager = get_create_update_manager_data()
+    uuids = UUIDTable()
+    target = ManagerTarget(org_units=[uuid4()], manager_level=manager_lvl)
+    manager_targets = {uuids.intern(org_unit.uuid): target}
+    assigned = manager.copy(update={"uuid": uuid4(), "org_unit": target.org_units[0]})
+    mock_get_current_manager.return_value = assigned
+    state_store = StateStore(":memory:")
+    state_store.record(org_unit, target, {}, [assigned])
+
+    def run_progress() -> RunProgress:
+        return RunProgress(
+            state_store,
+            datetime.now(timezone.utc),
+            full_run=True,
+            delta=False,
+            dry_run=False,
+            checkpoint_window=3600,
+        )
+
+    async def skip(progress: RunProgress) -> list[OrgUnitManagers]:
+        return await skip_unchanged_org_units(
+            gql_client,
+            [org_unit],
+            manager_targets,
+            uuids,
+            state_store,
+            progress.changed_org_units,
+            {},
+        )
+
+    assert await skip(run_progress()) == []
+    # Interrupted after terminating the manager of the target org-unit
+    run_progress().terminated(
+        OrgUnitManager(org_unit_uuid=target.org_units[0], manager_uuid=uuid4())
+    )
+    assert await skip(run_progress()) == [org_unit]
+
+
+@patch("sd_managerscript.holstebro_managers.get_manager_org_units")
+async def test_find_manager_org_units(
+    mock_get_manager_org_units: AsyncMock,
+    graph: OrgGraph,
+    org_uuids: dict[str, UUID],
+) -> None:
+    """Test the "_leder" units of full, single and delta runs"""
+
+    async def find(
+        org_unit: str, recursive: bool, full_run: bool, changes: Changes | None
+    ) -> set[UUID]:
+        await find_manager_org_units(
+            gql_client, graph, org_uuids[org_unit], recursive, full_run, changes
+        )
+        return set(mock_get_manager_org_units.call_args.args[2])
+
+    leder_units = {
+        org_uuids[name] for name in ("Byudvikling_leder", "Plan_leder", "Skoler_leder")
+    }
+    assert await find("Kommune", True, True, None) == leder_units
+    assert await find("Plan led-adm", False, False, None) == {org_uuids["Plan_leder"]}
+    assert await find("Byudvikling led-adm", True, False, None) == {
+        org_uuids["Byudvikling_leder"],
+        org_uuids["Plan_leder"],
+    }
+    changes = Changes(org_units={org_uuids["Skoler"]})
+    assert await find("Kommune", True, True, changes) == {org_uuids["Skoler_leder"]}
+
+
+@patch("sd_managerscript.holstebro_managers._update_mo_managers")
+async def test_update_mo_managers_returns_failures(
+    mock_update_mo_managers: AsyncMock,
+) -> None:
+    """Test the units failing in the run are returned"""
+    failed_unit = uuid4()
+
+    async def run(*args, failures, **kwargs):
+        failures[failed_unit] = "error"
+
+    mock_update_mo_managers.side_effect = run
+
+    assert await update_mo_managers(gql_client, uuid4(), uuid4()) == {
+        failed_unit: "error"
+    }
+
+
+@patch("sd_managerscript.holstebro_managers.create_update_manager")
+@patch("sd_managerscript.holstebro_managers.filter_manager_org_units")
+@patch("sd_managerscript.holstebro_managers.load_org_subgraph")
+@patch("sd_managerscript.holstebro_managers.query_org_unit")
+async def test_update_leder_unit(
+    mock_query_org_unit: AsyncMock,
+    mock_load_org_subgraph: AsyncMock,
+    mock_filter_manager_org_units: AsyncMock,
+    mock_create_update_manager: AsyncMock,
+    graph: OrgGraph,
+    org_uuids: dict[str, UUID],
+) -> None:
+    """
+    Test a single "_leder" unit is fetched by UUID, filtered and updated with the
+    targets of the org graph
+    """
+    org_unit, *_ = get_create_update_manager_data()
+    org_unit = org_unit.copy(update={"uuid": org_uuids["Plan_leder"]})
+    mock_query_org_unit.return_value = [org_unit]
+    mock_load_org_subgraph.return_value = graph
+    mock_filter_manager_org_units.return_value = [org_unit]
+    gql_client = AsyncMock()
+
+    await update_leder_unit(gql_client, org_unit.uuid)
+
+    assert mock_query_org_unit.call_args.args[2] == {"uuids": [str(org_unit.uuid)]}
+    target = graph.manager_targets()[graph.id(org_unit.uuid)]
+    # The whole led-adm chain, as in full runs
+    assert target.org_units == [
+        org_uuids["Plan led-adm"],
+        org_uuids["Byudvikling led-adm"],
+        org_uuids["Borgmesterens Afdeling"],
+    ]
+    mock_create_update_manager.assert_awaited_once_with(
+        gql_client, org_unit, target, dry_run=False
+    )
+
+    # Other org-units are ignored
+    mock_query_org_unit.return_value = [org_unit.copy(update={"name": "Skoler"})]
+    await update_leder_unit(gql_client, org_unit.uuid)
+    mock_filter_manager_org_units.assert_awaited_once()
+
+
+@freeze_time("2023-01-10")
+@patch("sd_managerscript.holstebro_managers.get_current_manager")
+async def test_reconcile_mutations(mock_get_current_manager: AsyncMock) -> None:
+    """Test logged mutations are applied again, unless already applied"""
+    created, missing, unreachable, stale, applied, replaced, changed = (
+        str(uuid4()) for _ in range(7)
+    )
+    _, _, manager = get_create_update_manager_data()
+
+    def current_manager(org_unit: str, from_date: str = "2023-01-01") -> Manager:
+        return manager.copy(
+            update={
+                "uuid": UUID(org_unit),
+                "org_unit": UUID(org_unit),
+                "validity": Validity(from_date=from_date),
+            }
+        )
+
+    def manager_input(org_unit: str, employee: UUID) -> dict:
+        return {
+            "uuid": org_unit,
+            "org_unit": org_unit,
+            "person": str(employee),
+            "manager_level": str(manager.manager_level.uuid),
+            "manager_type": str(manager.manager_type.uuid),
+            "validity": {"from": "2023-01-05", "to": None},
+        }
+
+    current_managers = {
+        created: current_manager(created),
+        stale: current_manager(stale),
+        applied: current_manager(applied),
+        replaced: current_manager(replaced).copy(update={"uuid": uuid4()}),
+        # Changed in MO after the update was logged
+        changed: current_manager(changed, from_date="2023-01-08"),
+    }
+
+    async def get_current_manager(gql_client: AsyncMock, uuid: UUID) -> Manager | None:
+        if str(uuid) == unreachable:
+            raise ConnectionError("MO is down")
+        return current_managers.get(str(uuid))
+
+    mock_get_current_manager.side_effect = get_current_manager
+    mutation_log = MutationLog(":memory:")
+    for org_unit in (created, missing, unreachable):
+        mutation_log.append(
+            "CREATE_MANAGER", {"input": manager_input(org_unit, manager.employee)}
+        )
+    mutation_log.append("MANAGER_TERMINATE", {"input": {"uuid": str(uuid4())}})
+    for org_unit in (stale, replaced, changed):
+        mutation_log.append(
+            "UPDATE_MANAGER", {"input": manager_input(org_unit, uuid4())}
+        )
+    mutation_log.append(
+        "UPDATE_MANAGER", {"input": manager_input(applied, manager.employee)}
+    )
+    gql_client = AsyncMock()
+
+    await reconcile_mutations(gql_client, mutation_log)
+
+    operations = [
+        lookup_operation(c.args[0]).name for c in gql_client.execute.await_args_list
+    ]
+    # Terminations first
+    assert operations == ["MANAGER_TERMINATE", "CREATE_MANAGER", "UPDATE_MANAGER"]
+    # Applied from today
+    created_input, updated_input = (
+        c.args[1]["input"] for c in gql_client.execute.await_args_list[1:]
+    )
+    assert created_input["org_unit"] == missing
+    assert updated_input["org_unit"] == stale
+    assert updated_input["validity"] == {"from": "2023-01-10", "to": None}
+    # The entry failing to be reconciled is kept
+    assert [entry[2]["input"]["org_unit"] for entry in mutation_log.pending()] == [
+        unreachable
+    ]
+
+    # Kept if MO cannot be reached
+    mutation_log.append("MANAGER_TERMINATE", {"input": {"uuid": str(uuid4())}})
+    gql_client.execute.side_effect = ConnectionError("MO is down")
+    await reconcile_mutations(gql_client, mutation_log)
+    assert len(mutation_log) == 2
+
+
+@patch("sd_managerscript.holstebro_managers.terminate_manager")
+@patch("sd_managerscript.holstebro_managers.check_manager_engagement")
+async def test_check_employee_managers(
+    mock_check_manager_engagement: AsyncMock, mock_terminate_manager: AsyncMock
+) -> None:
+    """Test only the org-units where the employee is manager are checked"""
+    employee, org_unit, manager, root = uuid4(), uuid4(), uuid4(), uuid4()
+    manager_index = ManagerIndex()
+    manager_index.add(manager, employee, org_unit)
+    manager_index.add(uuid4(), uuid4(), uuid4())
+    mock_check_manager_engagement.return_value = [
+        OrgUnitManager(org_unit_uuid=org_unit, manager_uuid=manager)
+    ]
+    gql_client = AsyncMock()
+
+    await check_employee_managers(gql_client, employee, root, manager_index)
+
+    mock_check_manager_engagement.assert_awaited_once_with(
+        gql_client, org_unit, root, recursive=False
+    )
+    mock_terminate_manager.assert_awaited_once_with(gql_client, manager, dry_run=False)
+    assert manager_index.org_units(employee) == set()
+
+    # Employees without manager roles cost nothing
+    await check_employee_managers(gql_client, employee, root, manager_index)
+    mock_check_manager_engagement.assert_awaited_once()
+
+
+@patch("sd_managerscript.holstebro_managers.query_paginated")
+async def test_check_manager_roles(mock_query_paginated: AsyncMock) -> None:
+    """Test manager roles are checked without traversing the org-unit tree"""
+    unit, other_unit, outside_unit = uuid4(), uuid4(), uuid4()
+    engaged = manager_role(unit, uuid4(), [("Skoler", unit, uuid4())])
+    led_adm = manager_role(unit, uuid4(), [("Plan led-adm", uuid4(), unit)])
+    unengaged = manager_role(unit, uuid4(), [("Skoler", other_unit, uuid4())])
+    elsewhere = manager_role(other_unit, uuid4())
+    outside = manager_role(outside_unit, uuid4())
+    vacant = manager_role(other_unit, None)
+    mock_query_paginated.return_value = [
+        engaged,
+        led_adm,
+        unengaged,
+        elsewhere,
+        outside,
+        vacant,
+    ]
+
+    managers = await check_manager_roles(AsyncMock(), {unit, other_unit})
+
+    def org_unit_manager(manager: dict) -> OrgUnitManager:
+        validity = one(manager["validities"])
+        return OrgUnitManager(
+            org_unit_uuid=validity["org_unit_uuid"], manager_uuid=validity["uuid"]
+        )
+
+    assert managers == [org_unit_manager(unengaged), org_unit_manager(elsewhere)]
+
+
+@patch("sd_managerscript.holstebro_managers.query_graphql")
+async def test_check_manager_engagement_by_level(mock_query_graphql: AsyncMock) -> None:
+    """Test the tree is traversed with one batched query per level"""
+    # root -> a, b; a -> a1, a2; b -> b1
+    root, a, b, a1, a2, b1 = (str(uuid4()) for _ in range(6))
+    children = {root: [a, b], a: [a1, a2], b: [b1]}
+    managers = {unit: str(uuid4()) for unit in (root, a, b, a1, a2, b1)}
+
+    def org_unit(uuid: str) -> dict:
+        return {
+            "validities": [
+                {
+                    "uuid": uuid,
+                    "has_children": uuid in children,
+                    "managers": [{"uuid": managers[uuid], "employee": [{}]}],
+                }
+            ]
+        }
+
+    async def execute(_: object, query: object, variables: dict) -> dict:
+        if query == QUERY_ROOT_MANAGER_ENGAGEMENTS:
+            return {"org_units": {"objects": [org_unit(variables["uuid"])]}}
+        assert query == QUERY_MANAGER_ENGAGEMENTS
+        return {
+            "org_units": {
+                "objects": [
+                    org_unit(child)
+                    for parent in variables["uuid"]
+                    for child in children.get(parent, [])
+                ]
+            }
+        }
+
+    mock_query_graphql.side_effect = execute
+
+    with patch.object(get_settings(), "graphql_batch_size", 1):
+        result = await check_manager_engagement_by_level(AsyncMock(), root, root)
+
+    assert {str(manager.manager_uuid) for manager in result} == set(managers.values())
+    # Root, the children of root, and of a and b (chunked). Leaves are not queried
+    assert [call.args[2] for call in mock_query_graphql.call_args_list] == [
+        {"uuid": root},
+        {"uuid": [root]},
+        {"uuid": [a]},
+        {"uuid": [b]},
+    ]
+
+    mock_query_graphql.reset_mock()
+    children[a1] = [str(uuid4())]
+    children[a2] = []
+    managers[children[a1][0]] = str(uuid4())
+    await check_manager_engagement_by_level(AsyncMock(), UUID(root), UUID(a))
+    assert [call.args[2] for call in mock_query_graphql.call_args_list] == [
+        {"uuid": [root]},
+        {"uuid": [a, b]},
+        {"uuid": [a1, a2]},
+    ]
+
+
+@pytest.mark.parametrize("name", ["Kommune", "Byudvikling led-adm", "Skoler"])
+@patch("sd_managerscript.holstebro_managers.query_paginated")
+@patch("sd_managerscript.holstebro_managers.query_graphql")
+async def test_manager_checks_agree(
+    mock_query_graphql: AsyncMock,
+    mock_query_paginated: AsyncMock,
+    graph: OrgGraph,
+    org_units: list[dict],
+    org_uuids: dict[str, UUID],
+    name: str,
+) -> None:
+    """Test the recursive, breadth-first and manager role checks find the same"""
+    root = org_uuids["Kommune"]
+    # An unengaged manager in every org-unit
+    manager_roles = {
+        org_unit["uuid"]: manager_role(UUID(org_unit["uuid"]), uuid4())
+        for org_unit in org_units
+    }
+    children: dict[str, list[str]] = {}
+    for org_unit in org_units:
+        children.setdefault(org_unit["parent_uuid"], []).append(org_unit["uuid"])
+
+    def org_unit_object(uuid: str) -> dict:
+        validity = one(manager_roles[uuid]["validities"])
+        return {
+            "validities": [
+                {
+                    "uuid": uuid,
+                    "has_children": uuid in children,
+                    "managers": [
+                        {"uuid": validity["uuid"], "employee": validity["employee"]}
+                    ],
+                }
+            ]
+        }
+
+    async def execute(_: object, query: object, variables: dict) -> dict:
+        if query == QUERY_ROOT_MANAGER_ENGAGEMENTS:
+            return {"org_units": {"objects": [org_unit_object(variables["uuid"])]}}
+        assert query == QUERY_MANAGER_ENGAGEMENTS
+        parents = variables["uuid"]
+        return {
+            "org_units": {
+                "objects": [
+                    org_unit_object(child)
+                    for parent in ([parents] if isinstance(parents, str) else parents)
+                    for child in children.get(parent, [])
+                ]
+            }
+        }
+
+    mock_query_graphql.side_effect = execute
+    mock_query_paginated.return_value = list(manager_roles.values())
+    org_unit_uuid = org_uuids[name]
+
+    recursive = await check_manager_engagement(
+        AsyncMock(), org_unit_uuid, root, flags=graph.flags
+    )
+    by_level = await find_managers_to_terminate(
+        AsyncMock(), graph, org_unit_uuid, root, recursive=True, changes=None
+    )
+    with patch.object(get_settings(), "check_manager_roles", True):
+        by_role = await find_managers_to_terminate(
+            AsyncMock(), graph, org_unit_uuid, root, recursive=True, changes=None
+        )
+
+    def key(manager: OrgUnitManager) -> UUID:
+        return manager.manager_uuid
+
+    assert recursive
+    assert sorted(recursive, key=key) == sorted(by_level, key=key)
+    assert sorted(by_role, key=key) == sorted(by_level, key=key)
+    # The org-unit itself is only checked if it is the root
+    checked = {manager.org_unit_uuid for manager in by_role}
+    assert (org_unit_uuid in checked) == (org_unit_uuid == root)
+
+
+@patch("sd_managerscript.mo.query_graphql")
+async def test_get_active_engagements_batched(mock_query_gql: AsyncMock) -> None:
+    """Test the engagements of concurrently checked employees are fetched at once"""
+    employees = [uuid4(), uuid4(), uuid4()]
+    mock_query_gql.return_value = {
+        "engagements": {
+            "objects": [
+                {
+                    "current": {
+                        "employee_uuid": str(employee),
+                        "validity": {"from": f"200{i}-01-01T00:00:00+01:00"},
+                    }
+                }
+                for i, employee in enumerate(employees[:2])
+            ]
+        }
+    }
+
+    async with query_scope():
+        engagements = await asyncio.gather(
+            *(get_active_engagements(AsyncMock(), employee) for employee in employees)
+        )
+
+    mock_query_gql.assert_awaited_once()
+    assert mock_query_gql.call_args.args[2] == {
+        "uuid": [str(employee) for employee in employees]
+    }
+    assert [engagement.engagement_from for engagement in engagements] == [
+        datetime.fromisoformat("2000-01-01T00:00:00+01:00"),
+        datetime.fromisoformat("2001-01-01T00:00:00+01:00"),
+        None,
+    ]
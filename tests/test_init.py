@@ -62,7 +62,7 @@ async def test_get_manager_level_facet_and_classes() -> None:
         UUID("35d5d061-5d19-4584-8c5e-796309b87dfb"),
         ["Niveau 1", "Niveau 2", "Niveau 3"],
     )
-    mock_execute.assert_awaited_once_with(QUERY_MANAGER_CLASSES)
+    mock_execute.assert_awaited_once_with(QUERY_MANAGER_CLASSES.document)
 
 
 async def test_create_manager_level(
@@ -83,7 +83,7 @@ async def test_create_manager_level(
     # Assert
     assert class_uuid == create_manager_level_uuid
     mock_execute.assert_awaited_once_with(
-        MANAGER_LEVEL_CREATE,
+        MANAGER_LEVEL_CREATE.document,
         variable_values={
             "input": {
                 "facet_uuid": str(facet_uuid),
@@ -118,7 +118,7 @@ async def test_create_manager_level_with_uuid(
     # Assert
     assert class_uuid == create_manager_level_uuid
     mock_execute.assert_awaited_once_with(
-        MANAGER_LEVEL_CREATE,
+        MANAGER_LEVEL_CREATE.document,
         variable_values={
             "input": {
                 "facet_uuid": str(facet_uuid),
@@ -180,7 +180,7 @@ async def test_create_missing_manager_levels() -> None:
     assert 3 == mock_execute.await_count
 
     mock_execute.assert_any_await(
-        MANAGER_LEVEL_CREATE,
+        MANAGER_LEVEL_CREATE.document,
         variable_values={
             "input": {
                 "facet_uuid": str(facet_uuid),
@@ -192,7 +192,7 @@ async def test_create_missing_manager_levels() -> None:
         },
     )
     mock_execute.assert_any_await(
-        MANAGER_LEVEL_CREATE,
+        MANAGER_LEVEL_CREATE.document,
         variable_values={
             "input": {
                 "facet_uuid": str(facet_uuid),
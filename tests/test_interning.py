@@ -0,0 +1,40 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from uuid import UUID
+from uuid import uuid4
+
+from sd_managerscript.interning import UUIDTable
+
+
+def test_intern_assigns_consecutive_ids() -> None:
+    # Arrange
+    uuids = UUIDTable()
+    first, second = uuid4(), uuid4()
+
+    # Act
+    ids = [uuids.intern(value) for value in (first, str(second), str(first))]
+
+    # Assert
+    assert ids == [0, 1, 0]
+    assert len(uuids) == 2
+    assert uuids.uuid(1) == second
+    assert uuids.as_str(0) == str(first)
+
+
+def test_intern_normalises_uuid_strings() -> None:
+    uuids = UUIDTable()
+    uuid = UUID("9a2bbe63-b7b4-4b3d-9b47-9d7dd391b42c")
+
+    assert uuids.intern(str(uuid).upper()) == uuids.intern(uuid)
+    assert str(uuid).upper() in uuids
+    assert uuid4() not in uuids
+
+
+def test_intern_mapping() -> None:
+    uuids = UUIDTable()
+    key, value = uuid4(), uuid4()
+
+    mapping = uuids.intern_mapping({str(key): str(value)})
+
+    assert mapping == {uuids.intern(key): uuids.intern(value)}
+    assert uuids.uuid(mapping[uuids.intern(key)]) == value
@@ -0,0 +1,178 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+
+import httpx
+import pytest
+
+from sd_managerscript.limiter import AdaptiveLimiter
+from sd_managerscript.limiter import WriteLimiter
+from sd_managerscript.transport import FastJSONTransport
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def test_additive_increase() -> None:
+    limiter = AdaptiveLimiter(initial=2, max_limit=3, latency_target=1.0, window=4)
+
+    for _ in range(4):
+        await limiter.acquire()
+        limiter.release(0.1, False)
+    assert limiter.limit == 3
+
+    # The limit is capped
+    for _ in range(4):
+        await limiter.acquire()
+        limiter.release(0.1, False)
+    assert limiter.limit == 3
+
+
+async def test_no_increase_when_slow() -> None:
+    limiter = AdaptiveLimiter(initial=2, latency_target=1.0, window=4)
+
+    for latency in [0.1, 0.1, 0.1, 5.0]:
+        await limiter.acquire()
+        limiter.release(latency, False)
+
+    assert limiter.p95() == 5.0
+    assert limiter.limit == 2
+
+
+async def test_multiplicative_decrease() -> None:
+    clock = Clock()
+    limiter = AdaptiveLimiter(initial=16, min_limit=2, cooldown=1.0, clock=clock)
+
+    limiter.in_flight = 3
+    limiter.release(0.1, True)
+    # A burst of failures only halves the limit once per cooldown
+    limiter.release(0.1, True)
+    assert limiter.limit == 8
+
+    for _ in range(3):
+        clock.now += 1
+        await limiter.acquire()
+        limiter.release(0.1, True)
+    assert limiter.limit == 2
+    assert limiter.summary()["overloads"] == 5
+
+
+async def test_acquire_waits_for_limit() -> None:
+    limiter = AdaptiveLimiter(initial=1)
+    await limiter.acquire()
+
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    limiter.release(0.1, False)
+    await asyncio.wait_for(waiter, 1)
+    assert limiter.in_flight == 1
+
+
+async def test_transport_reports_server_errors() -> None:
+    limiter = AdaptiveLimiter(initial=4)
+    transport = FastJSONTransport(
+        url="http://mo/graphql",
+        client_cls=httpx.AsyncClient,
+        client_args={
+            "transport": httpx.MockTransport(lambda request: httpx.Response(503))
+        },
+        limiter=limiter,
+    )
+    await transport.connect()
+
+    response = await transport._post({}, None)
+
+    assert response.status_code == 503
+    assert limiter.in_flight == 0
+    assert limiter.limit == 2
+    await transport.close()
+
+
+async def test_transport_reports_network_errors_and_ignores_cancellations() -> None:
+    limiter = AdaptiveLimiter(initial=4)
+    started = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers.get("x-test") == "fail":
+            raise httpx.ConnectError("MO is down", request=request)
+        started.set()
+        await asyncio.sleep(60)
+        return httpx.Response(200)  # pragma: no cover
+
+    transport = FastJSONTransport(
+        url="http://mo/graphql",
+        client_cls=httpx.AsyncClient,
+        client_args={"transport": httpx.MockTransport(handler)},
+        limiter=limiter,
+    )
+    await transport.connect()
+
+    # Network errors are overloads
+    with pytest.raises(httpx.ConnectError):
+        await transport._post({}, {"headers": {"x-test": "fail"}})
+    assert limiter.limit == 2
+    assert limiter.summary()["requests"] == 1
+
+    # Cancelled requests, e.g. the loser of a hedged read, are no samples
+    task = asyncio.create_task(transport._post({}, None))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert limiter.in_flight == 0
+    assert limiter.summary()["requests"] == 1
+    await transport.close()
+
+
+async def test_transport_does_not_limit_mutations() -> None:
+    limiter = AdaptiveLimiter(initial=4)
+    transport = FastJSONTransport(
+        url="http://mo/graphql",
+        client_cls=httpx.AsyncClient,
+        client_args={
+            "transport": httpx.MockTransport(lambda request: httpx.Response(503))
+        },
+        limiter=limiter,
+    )
+    await transport.connect()
+
+    await transport._post({}, None, limited=False)
+
+    assert limiter.requests == 0
+    await transport.close()
+
+
+async def test_write_limiter_token_bucket() -> None:
+    clock = Clock()
+    limiter = WriteLimiter(rate=2, burst=2, concurrency=2, clock=clock)
+
+    # The burst is free
+    for _ in range(2):
+        assert await limiter.acquire() == 0
+        limiter.release()
+    assert limiter.tokens == 0
+
+    # Refilled by the clock
+    clock.now = 0.5
+    assert await limiter.acquire() == 0
+    assert limiter.tokens == 0
+
+
+async def test_write_limiter_concurrency() -> None:
+    limiter = WriteLimiter(rate=1000, burst=10, concurrency=1)
+    await limiter.acquire()
+
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+
+    limiter.release()
+    assert await asyncio.wait_for(waiter, 1) > 0
+    assert limiter.summary()["writes"] == 2
@@ -4,11 +4,16 @@ from collections.abc import Callable
 from collections.abc import Generator
 from typing import Any
 
+import httpx
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
+from sd_managerscript.config import get_settings
+from sd_managerscript.main import construct_client
 from sd_managerscript.main import create_app
+from sd_managerscript.pool import PoolMonitor
+from sd_managerscript.transport import FastJSONTransport
 
 
 @pytest.fixture
@@ -50,3 +55,28 @@ async def test_index(test_client: TestClient) -> None:
     response = test_client.get("/")
     assert response.status_code == 200
     assert response.json() == {"Integration": "SD Managersync"}
+
+
+def test_construct_client() -> None:
+    """Test the connection settings are passed to the HTTPX client"""
+    settings = get_settings(
+        client_secret="hunter2",
+        graphql_timeout=30,
+        graphql_connect_timeout=5,
+        http_max_connections=10,
+        http_max_keepalive_connections=4,
+        http_keepalive_expiry=60,
+    )
+    pool_monitor = PoolMonitor()
+
+    gql_client = construct_client(settings, pool_monitor)
+
+    client_args = gql_client.transport.client_args
+    assert client_args["timeout"] == httpx.Timeout(30, connect=5)
+    assert client_args["limits"] == httpx.Limits(
+        max_connections=10, max_keepalive_connections=4, keepalive_expiry=60
+    )
+    assert client_args["http2"] is False
+    assert client_args["event_hooks"] == {"request": [pool_monitor.on_request]}
+    assert client_args["headers"]["Accept-Encoding"] in {"gzip", "br, gzip"}
+    assert isinstance(gql_client.transport, FastJSONTransport)
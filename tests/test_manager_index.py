@@ -0,0 +1,53 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+from uuid import uuid4
+
+from sd_managerscript.manager_index import ManagerIndex
+from tests.test_data.sample_test_data import manager_role
+
+
+def test_manager_index() -> None:
+    employee, manager, other_manager = uuid4(), uuid4(), uuid4()
+    org_unit, other_org_unit = uuid4(), uuid4()
+    index = ManagerIndex()
+
+    index.add(manager, employee, org_unit)
+    index.add(other_manager, employee, other_org_unit)
+    assert index.org_units(employee) == {org_unit, other_org_unit}
+    assert index.org_units(uuid4()) == set()
+
+    # Manager role moved to another employee
+    index.add(manager, uuid4(), org_unit)
+    assert index.org_units(employee) == {other_org_unit}
+
+    index.remove(other_manager)
+    index.remove(uuid4())
+    assert index.org_units(employee) == set()
+    assert len(index) == 1
+
+
+@patch("sd_managerscript.manager_index.query_paginated")
+async def test_manager_index_refresh(mock_query_paginated: AsyncMock) -> None:
+    employee, org_unit, manager, vacant, terminated = (uuid4() for _ in range(5))
+    mock_query_paginated.return_value = [
+        manager_role(org_unit, employee, manager=manager),
+        manager_role(org_unit, None, manager=vacant),
+    ]
+    gql_client = AsyncMock()
+    index = ManagerIndex()
+    index.add(terminated, employee, uuid4())
+
+    await index.refresh(gql_client)
+
+    assert mock_query_paginated.call_args.args[2] == {"uuids": None}
+    assert index.org_units(employee) == {org_unit}
+    assert len(index) == 1
+
+    # Refresh of a terminated manager role
+    mock_query_paginated.return_value = []
+    await index.refresh(gql_client, [manager])
+
+    assert mock_query_paginated.call_args.args[2] == {"uuids": [str(manager)]}
+    assert len(index) == 0
@@ -0,0 +1,24 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from uuid import uuid4
+
+from sd_managerscript.mutation_log import MutationLog
+
+
+def test_mutation_log(tmp_path) -> None:  # type: ignore
+    path = str(tmp_path / "mutations.db")
+    mutation_log = MutationLog(path)
+    uuid = uuid4()
+
+    first = mutation_log.append("MANAGER_TERMINATE", {"input": {"uuid": uuid}})
+    second = mutation_log.append("CREATE_MANAGER", {"input": {"org_unit": "x"}})
+    mutation_log.done(first)
+    mutation_log.close()
+
+    # Survives a restart
+    mutation_log = MutationLog(path)
+    assert len(mutation_log) == 1
+    assert mutation_log.pending() == [
+        (second, "CREATE_MANAGER", {"input": {"org_unit": "x"}})
+    ]
+    mutation_log.close()
@@ -0,0 +1,32 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import hashlib
+
+import pytest
+from graphql import DocumentNode
+
+from sd_managerscript.operations import lookup_operation
+from sd_managerscript.operations import Operation
+from sd_managerscript.operations import operation
+from sd_managerscript.operations import REGISTRY
+from sd_managerscript.queries import QUERY_ENGAGEMENTS
+
+
+def test_operation() -> None:
+    op = Operation("TEST", "\n    query {\n        org { uuid }\n    }\n")
+    assert op.source == "query {\n    org { uuid }\n}"
+    assert op.sha256 == hashlib.sha256(op.source.encode()).hexdigest()
+
+    # Parsed lazily, once
+    assert not op.parsed
+    document = op.document
+    assert isinstance(document, DocumentNode)
+    assert op.document is document
+    assert lookup_operation(document) is op
+    assert lookup_operation(DocumentNode()) is None
+
+
+def test_registry() -> None:
+    assert REGISTRY["QUERY_ENGAGEMENTS"] is QUERY_ENGAGEMENTS
+    with pytest.raises(ValueError):
+        operation("QUERY_ENGAGEMENTS", "query { org { uuid } }")
@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from unittest.mock import AsyncMock
+from unittest.mock import patch
+from uuid import UUID
+from uuid import uuid4
+
+from sd_managerscript.interning import UUIDTable
+from sd_managerscript.models import ManagerLevel
+from sd_managerscript.models import ManagerTarget
+from sd_managerscript.operations import Operation
+from sd_managerscript.org_graph import load_org_graph
+from sd_managerscript.org_graph import load_org_subgraph
+from sd_managerscript.org_graph import OrgGraph
+from sd_managerscript.queries import QUERY_ORG_UNIT_CHILD_NODES
+
+
+def test_hierarchy(graph: OrgGraph, org_uuids: dict[str, UUID]) -> None:
+    def id_(name: str) -> int:
+        return graph.id(org_uuids[name])
+
+    assert len(graph) == len(org_uuids)
+    assert graph.roots == [id_("Kommune")]
+    assert graph.parent[id_("Plan_leder")] == id_("Plan led-adm")
+    assert graph.children[id_("Skoler")] == [id_("Skoler_leder"), id_("Ø_Skoler_leder")]
+
+    assert sorted(graph.subtree(id_("Skoler"))) == sorted(
+        [id_("Skoler"), id_("Skoler_leder"), id_("Ø_Skoler_leder")]
+    )
+    assert graph.subtree(graph.id(uuid4())) == []
+
+
+def test_manager_targets(graph: OrgGraph, org_uuids: dict[str, UUID]) -> None:
+    manager_targets = graph.manager_targets()
+
+    assert manager_targets == {
+        graph.id(org_uuids["Byudvikling_leder"]): ManagerTarget(
+            org_units=[
+                org_uuids["Byudvikling led-adm"],
+                org_uuids["Borgmesterens Afdeling"],
+            ],
+            manager_level=ManagerLevel(
+                uuid=UUID("e226821b-4af3-1e91-c53f-ea5c57c6d8d0")
+            ),
+        ),
+        # The led-adm chain is followed all the way up
+        graph.id(org_uuids["Plan_leder"]): ManagerTarget(
+            org_units=[
+                org_uuids["Plan led-adm"],
+                org_uuids["Byudvikling led-adm"],
+                org_uuids["Borgmesterens Afdeling"],
+            ],
+            manager_level=ManagerLevel(
+                uuid=UUID("e226821b-4af3-1e91-c53f-ea5c57c6d8d0")
+            ),
+        ),
+        graph.id(org_uuids["Skoler_leder"]): ManagerTarget(
+            org_units=[org_uuids["Skoler"]],
+            manager_level=ManagerLevel(
+                uuid=UUID("a8754726-a4b9-1715-6b41-769c6fe703c5")
+            ),
+        ),
+    }
+
+
+@patch("sd_managerscript.org_graph.query_paginated")
+async def test_load_org_graph(
+    mock_query_paginated: AsyncMock, org_units: list[dict]
+) -> None:
+    mock_query_paginated.return_value = [
+        {"validities": [org_unit]} for org_unit in org_units
+    ]
+
+    graph = await load_org_graph(AsyncMock(), UUIDTable())
+
+    assert len(graph) == len(org_units)
+
+
+def test_leder_units_targeting(graph: OrgGraph, org_uuids: dict[str, UUID]) -> None:
+    def id_(name: str) -> int:
+        return graph.id(org_uuids[name])
+
+    # Plan_leder assigns its manager up the led-adm chain
+    assert graph.leder_units_targeting({id_("Borgmesterens Afdeling")}) == [
+        id_("Byudvikling_leder"),
+        id_("Plan_leder"),
+    ]
+    assert graph.leder_units_targeting({id_("Plan led-adm")}) == [id_("Plan_leder")]
+    # Subtree of Skoler
+    assert graph.leder_units_targeting(set(graph.subtree(id_("Skoler")))) == [
+        id_("Skoler_leder")
+    ]
+    assert graph.leder_units_targeting({id_("Kommune")}) == []
+
+
+def test_may_be_leder_unit(graph: OrgGraph, org_uuids: dict[str, UUID]) -> None:
+    assert graph.may_be_leder_unit(org_uuids["Skoler_leder"])
+    assert not graph.may_be_leder_unit(org_uuids["Skoler"])
+    assert not graph.may_be_leder_unit(org_uuids["Ø_Skoler_leder"])
+    # Unknown to the graph
+    assert graph.may_be_leder_unit(uuid4())
+
+    graph.mark_changed(org_uuids["Skoler"])
+    assert graph.may_be_leder_unit(org_uuids["Skoler"])
+
+
+@patch("sd_managerscript.org_graph.query_graphql")
+async def test_load_org_subgraph(
+    mock_query_graphql: AsyncMock, org_units: list[dict], org_uuids: dict[str, UUID]
+) -> None:
+    def query_graphql(gql_client: AsyncMock, query: Operation, variables: dict) -> dict:
+        key = "parent_uuid" if query is QUERY_ORG_UNIT_CHILD_NODES else "uuid"
+        return {
+            "org_units": {
+                "objects": [
+                    {"validities": [org_unit]}
+                    for org_unit in org_units
+                    if org_unit[key] in variables["uuids"]
+                ]
+            }
+        }
+
+    mock_query_graphql.side_effect = query_graphql
+    full = OrgGraph(UUIDTable(), org_units)
+
+    def targets(graph: OrgGraph, *names: str) -> dict[str, ManagerTarget]:
+        manager_targets = graph.manager_targets(
+            graph.id(org_uuids[name]) for name in names
+        )
+        return {
+            graph.uuids.as_str(id_): target for id_, target in manager_targets.items()
+        }
+
+    # The "_leder" units below the led-adm chain and the rest of the chain above
+    graph = await load_org_subgraph(
+        AsyncMock(), UUIDTable(), org_uuids["Byudvikling led-adm"]
+    )
+    assert len(graph) == 5
+    assert org_uuids["Skoler"] not in graph.uuids
+    leder_units = [graph.uuids.uuid(id_) for id_ in graph.leder_units()]
+    assert leder_units == [org_uuids["Byudvikling_leder"], org_uuids["Plan_leder"]]
+    assert targets(graph, "Byudvikling_leder", "Plan_leder") == targets(
+        full, "Byudvikling_leder", "Plan_leder"
+    )
+
+    # The targets of a single "_leder" unit
+    graph = await load_org_subgraph(AsyncMock(), UUIDTable(), org_uuids["Plan_leder"])
+    assert targets(graph, "Plan_leder") == targets(full, "Plan_leder")
@@ -0,0 +1,42 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import httpx
+from structlog.testing import capture_logs
+
+from sd_managerscript.pool import PoolMonitor
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def test_pool_monitor() -> None:
+    clock = Clock()
+    monitor = PoolMonitor(warning=1.0, clock=clock)
+
+    request = httpx.Request("POST", "http://mo/graphql")
+    await monitor.on_request(request)
+    trace = request.extensions["trace"]
+    clock.now = 0.5
+    await trace("connection.connect_tcp.started", {})
+    # Only the first connection event counts
+    clock.now = 0.7
+    await trace("http11.send_request_headers.started", {})
+
+    request = httpx.Request("POST", "http://mo/graphql")
+    await monitor.on_request(request)
+    clock.now = 2.7
+    with capture_logs() as cap_logs:
+        await request.extensions["trace"]("http2.send_request_headers.started", {})
+    assert cap_logs[0]["event"] == "Waited for HTTP connection"
+
+    assert monitor.summary() == {
+        "requests": 2,
+        "total_wait": 2.5,
+        "mean_wait": 1.25,
+        "max_wait": 2.0,
+    }
@@ -0,0 +1,50 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+
+from sd_managerscript.retry import backoff_delay
+from sd_managerscript.retry import retry
+
+
+def test_backoff_delay() -> None:
+    assert backoff_delay(0, 0.5, 10, rand=lambda: 0.5) == 0.25
+    assert backoff_delay(3, 0.5, 10, rand=lambda: 0.5) == 2.0
+    # Capped
+    assert backoff_delay(10, 0.5, 10, rand=lambda: 0.99) == pytest.approx(9.9)
+
+
+async def test_retry_transient_errors() -> None:
+    sleep = AsyncMock()
+    request = AsyncMock(side_effect=[httpx.ReadTimeout("Timeout"), "ok"])
+
+    assert await retry(request, 3, sleep=sleep) == "ok"
+    assert request.await_count == 2
+    sleep.assert_awaited_once()
+
+
+async def test_retry_transient_results() -> None:
+    sleep = AsyncMock()
+    request = AsyncMock(side_effect=[503, 503, 503])
+
+    # The last result is returned when the attempts are exhausted
+    assert await retry(request, 3, is_transient=lambda r: r >= 500, sleep=sleep) == 503
+    assert request.await_count == 3
+    assert sleep.await_count == 2
+
+
+async def test_retry_gives_up() -> None:
+    sleep = AsyncMock()
+    request = AsyncMock(side_effect=httpx.ConnectError("Refused"))
+
+    with pytest.raises(httpx.ConnectError):
+        await retry(request, 2, sleep=sleep)
+    assert request.await_count == 2
+
+    # Other errors are not retried
+    request = AsyncMock(side_effect=ValueError("Bad query"))
+    with pytest.raises(ValueError):
+        await retry(request, 3, sleep=sleep)
+    assert request.await_count == 1
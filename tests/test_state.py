@@ -0,0 +1,250 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import sqlite3
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from uuid import uuid4
+
+from freezegun import freeze_time  # type: ignore
+from ramodels.mo import Validity  # type: ignore
+
+from sd_managerscript.models import Manager
+from sd_managerscript.models import ManagerTarget
+from sd_managerscript.models import ManagerType
+from sd_managerscript.models import OrgUnitManager
+from sd_managerscript.state import leder_unit_fingerprint
+from sd_managerscript.state import RunProgress
+from sd_managerscript.state import StateStore
+from tests.test_data.sample_test_data import (  # type: ignore
+    get_create_update_manager_led_adm_data,
+)
+
+
+def get_target() -> tuple:
+    org_unit, manager_level, _ = get_create_update_manager_led_adm_data()
+    target = ManagerTarget(
+        org_units=[org_unit.parent.uuid, org_unit.parent.parent_uuid],
+        manager_level=manager_level,
+    )
+    return org_unit, target
+
+
+def test_leder_unit_fingerprint() -> None:
+    org_unit, target = get_target()
+    engagement_from = {
+        association.employee_uuid: datetime(2022, 1, 1)
+        for association in org_unit.associations
+    }
+    fingerprint = leder_unit_fingerprint(org_unit, target, engagement_from)
+
+    # Independent of the order of the associations
+    reordered = org_unit.copy(
+        update={"associations": list(reversed(org_unit.associations))}
+    )
+    assert leder_unit_fingerprint(reordered, target, engagement_from) == fingerprint
+
+    # Changes with the associations and the target
+    fewer = org_unit.copy(update={"associations": org_unit.associations[:-1]})
+    assert leder_unit_fingerprint(fewer, target, engagement_from) != fingerprint
+    other_target = target.copy(update={"org_units": target.org_units[:1]})
+    assert (
+        leder_unit_fingerprint(org_unit, other_target, engagement_from) != fingerprint
+    )
+    # and with the engagement from-dates of the employees
+    rehired = {**engagement_from, org_unit.associations[0].employee_uuid: None}
+    assert leder_unit_fingerprint(org_unit, target, rehired) != fingerprint
+
+
+def test_state_store() -> None:
+    org_unit, target = get_target()
+    fingerprint = leder_unit_fingerprint(org_unit, target, {})
+    state_store = StateStore(":memory:")
+    manager = Manager(
+        uuid=uuid4(),
+        employee=org_unit.associations[0].employee_uuid,
+        manager_level=target.manager_level,
+        manager_type=ManagerType(uuid=uuid4()),
+        org_unit=target.org_units[0],
+        validity=Validity(from_date=datetime(2022, 1, 1)),
+    )
+
+    assert not state_store.is_unchanged(org_unit.uuid, fingerprint, 3600)
+    assert state_store.assigned_managers(org_unit.uuid) == []
+
+    with freeze_time("2023-01-01 12:00:00"):
+        state_store.record(org_unit, target, {}, [manager])
+    assert state_store.assigned_managers(org_unit.uuid) == [
+        {
+            "uuid": str(manager.uuid),
+            "org_unit": str(target.org_units[0]),
+            "employee": str(manager.employee),
+            "manager_level": str(target.manager_level.uuid),
+        }
+    ]
+
+    with freeze_time("2023-01-01 12:30:00"):
+        assert state_store.is_unchanged(org_unit.uuid, fingerprint, 3600)
+        assert not state_store.is_unchanged(org_unit.uuid, "other", 3600)
+        assert not state_store.is_unchanged(uuid4(), fingerprint, 3600)
+    with freeze_time("2023-01-01 13:30:00"):
+        assert not state_store.is_unchanged(org_unit.uuid, fingerprint, 3600)
+
+    state_store.close()
+
+
+def test_checkpoint() -> None:
+    state_store = StateStore(":memory:")
+    first_start = datetime(2023, 1, 1, 12, tzinfo=timezone.utc)
+    second_start = datetime(2023, 1, 1, 13, tzinfo=timezone.utc)
+
+    with freeze_time("2023-01-01 12:00:00"):
+        assert state_store.open_checkpoint(first_start, 3600) == first_start
+        state_store.checkpoint("processed", "a")
+    with freeze_time("2023-01-01 12:30:00"):
+        state_store.checkpoint("processed", "b")
+        state_store.checkpoint("completed", "terminate")
+
+    # Resumed within the window of the last progress
+    with freeze_time("2023-01-01 13:00:00"):
+        assert state_store.open_checkpoint(second_start, 3600) == first_start
+    assert state_store.checkpointed("processed") == {"a", "b"}
+    assert state_store.checkpointed("completed") == {"terminate"}
+
+    # Started over after the window
+    with freeze_time("2023-01-01 14:00:00"):
+        assert state_store.open_checkpoint(second_start, 1800) == second_start
+    assert state_store.checkpointed("processed") == set()
+
+    state_store.checkpoint("processed", "c")
+    state_store.close_checkpoint()
+    assert state_store.open_checkpoint(second_start, 3600) == second_start
+    assert state_store.checkpointed("processed") == set()
+    state_store.close()
+
+
+def test_run_progress_resumes_interrupted_run() -> None:
+    state_store = StateStore(":memory:")
+    org_unit, target = get_target()
+    processed = org_unit.copy(update={"uuid": uuid4()})
+    terminated, pending = (
+        OrgUnitManager(org_unit_uuid=uuid4(), manager_uuid=uuid4()) for _ in range(2)
+    )
+    first_start = datetime(2023, 1, 1, 12, tzinfo=timezone.utc)
+    second_start = datetime(2023, 1, 1, 13, tzinfo=timezone.utc)
+
+    def run_progress(started_at: datetime) -> RunProgress:
+        return RunProgress(
+            state_store,
+            started_at,
+            full_run=True,
+            delta=False,
+            dry_run=False,
+            checkpoint_window=3600,
+        )
+
+    # Interrupted after terminating a manager and processing a unit
+    with freeze_time("2023-01-01 12:00:00"):
+        progress = run_progress(first_start)
+        assert progress.pending_terminations([terminated]) == [terminated]
+        progress.terminated(terminated)
+        progress.complete_terminations()
+        progress.processed(processed, target, {}, [])
+
+    with freeze_time("2023-01-01 12:30:00"):
+        progress = run_progress(second_start)
+    # The start time of the interrupted run is kept
+    assert progress.started_at == first_start
+    assert progress.terminations_completed
+    # Terminated managers are skipped, but their org-units are still changed
+    assert progress.pending_terminations([terminated, pending]) == [pending]
+    assert progress.changed_org_units == {terminated.org_unit_uuid}
+    # Processed units are skipped
+    assert progress.unprocessed([processed, org_unit]) == [org_unit]
+
+    progress.complete([org_unit.uuid])
+    assert state_store.last_run(full=True) == first_start
+    assert state_store.failed_units() == {org_unit.uuid}
+    assert state_store.checkpointed("processed") == set()
+
+    # A new run after completion is not resumed
+    with freeze_time("2023-01-01 12:40:00"):
+        progress = run_progress(second_start)
+    assert progress.started_at == second_start
+    assert not progress.terminations_completed
+    assert progress.pending_terminations([terminated]) == [terminated]
+
+
+def test_run_progress_without_checkpoint() -> None:
+    state_store = StateStore(":memory:")
+    org_unit, target = get_target()
+    manager = OrgUnitManager(org_unit_uuid=uuid4(), manager_uuid=uuid4())
+    started_at = datetime(2023, 1, 1, 12, tzinfo=timezone.utc)
+
+    # Delta runs are recorded, but not checkpointed
+    progress = RunProgress(
+        state_store,
+        started_at,
+        full_run=True,
+        delta=True,
+        dry_run=False,
+        checkpoint_window=3600,
+    )
+    progress.terminated(manager)
+    progress.processed(org_unit, target, {}, [])
+    assert progress.changed_org_units == {manager.org_unit_uuid}
+    assert state_store.checkpointed("terminated") == set()
+    assert state_store.assigned_managers(org_unit.uuid) == []
+    assert state_store.is_unchanged(
+        org_unit.uuid, leder_unit_fingerprint(org_unit, target, {}), 3600
+    )
+    progress.complete([])
+    assert state_store.last_run() == started_at
+    assert state_store.last_run(full=True) is None
+
+    # Dry runs record nothing
+    other = org_unit.copy(update={"uuid": uuid4()})
+    progress = RunProgress(
+        state_store,
+        started_at + timedelta(hours=1),
+        full_run=True,
+        delta=False,
+        dry_run=True,
+        checkpoint_window=3600,
+    )
+    progress.processed(other, target, {}, [])
+    progress.complete([])
+    assert not state_store.is_unchanged(
+        other.uuid, leder_unit_fingerprint(other, target, {}), 3600
+    )
+    assert state_store.last_run() == started_at
+
+
+def test_state_store_adds_managers_column(tmp_path) -> None:  # type: ignore
+    path = str(tmp_path / "state.db")
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute(
+            """
+            CREATE TABLE leder_units (
+                uuid TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                employee_uuid TEXT,
+                org_units TEXT NOT NULL,
+                manager_level_uuid TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            "INSERT INTO leder_units VALUES (?, 'a', NULL, '[]', ?, 0)",
+            (str(uuid4()), str(uuid4())),
+        )
+    connection.close()
+
+    org_unit, target = get_target()
+    state_store = StateStore(path)
+    assert state_store.assigned_managers(org_unit.uuid) == []
+    state_store.record(org_unit, target, {}, [])
+    assert state_store.assigned_managers(org_unit.uuid) == []
+    state_store.close()
@@ -0,0 +1,159 @@
+# SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import gzip
+import json
+from collections.abc import AsyncIterator
+
+import httpx
+import pytest
+from gql import gql  # type: ignore
+from gql.transport.exceptions import TransportProtocolError  # type: ignore
+
+from sd_managerscript.operations import Operation
+from sd_managerscript.transport import accept_encoding
+from sd_managerscript.transport import FastJSONTransport
+
+PAYLOAD = {"data": {"org_units": {"objects": [{"uuid": "x" * 36}] * 100}}}
+
+
+def compressed_handler(request: httpx.Request) -> httpx.Response:
+    assert request.headers["Accept-Encoding"] == "gzip"
+
+    async def stream() -> AsyncIterator[bytes]:
+        yield gzip.compress(json.dumps(PAYLOAD).encode())
+
+    return httpx.Response(
+        200,
+        content=stream(),
+        headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+    )
+
+
+def test_accept_encoding() -> None:
+    assert accept_encoding(False) == "identity"
+    assert "gzip" in accept_encoding()
+
+
+@pytest.mark.parametrize("fast_json", [True, False])
+async def test_fast_json_transport(fast_json: bool) -> None:
+    transport = FastJSONTransport(
+        url="http://mo/graphql",
+        client_cls=httpx.AsyncClient,
+        client_args={
+            "transport": httpx.MockTransport(compressed_handler),
+            "headers": {"Accept-Encoding": "gzip"},
+        },
+        fast_json=fast_json,
+    )
+    await transport.connect()
+    assert transport.client is not None
+    response = await transport.client.post("http://mo/graphql", json={})
+
+    result = transport._decode_response(response)
+
+    assert result.data == PAYLOAD["data"]
+    assert transport.responses == 1
+    assert transport.decoded_bytes == len(json.dumps(PAYLOAD))
+    assert 0 < transport.received_bytes < transport.decoded_bytes
+    await transport.close()
+
+
+async def test_fast_json_transport_invalid_response() -> None:
+    transport = FastJSONTransport(url="http://mo/graphql")
+    request = httpx.Request("POST", "http://mo/graphql")
+    with pytest.raises(TransportProtocolError):
+        transport._decode_response(
+            httpx.Response(200, content=b"<html>", request=request)
+        )
+    with pytest.raises(TransportProtocolError):
+        transport._decode_response(
+            httpx.Response(200, json={"foo": 1}, request=request)
+        )
+
+
+async def test_persisted_queries() -> None:
+    op = Operation("TEST_PERSISTED", "query { org { uuid } }")
+    payloads = []
+    known: set[str] = set()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        payloads.append(payload)
+        sha256 = payload["extensions"]["persistedQuery"]["sha256Hash"]
+        if "query" in payload:
+            known.add(sha256)
+        elif sha256 not in known:
+            return httpx.Response(
+                200, json={"errors": [{"message": "PersistedQueryNotFound"}]}
+            )
+        return httpx.Response(200, json={"data": {"org": {"uuid": "x"}}})
+
+    transport = FastJSONTransport(
+        url="http://mo/graphql",
+        client_cls=httpx.AsyncClient,
+        client_args={"transport": httpx.MockTransport(handler)},
+        persisted_queries=True,
+    )
+    await transport.connect()
+
+    # The query is sent the first time only
+    for _ in range(2):
+        result = await transport.execute(op.document, {"a": 1})
+        assert result.data == {"org": {"uuid": "x"}}
+    assert payloads[0]["query"] == op.source
+    assert payloads[1] == {
+        "extensions": {"persistedQuery": {"version": 1, "sha256Hash": op.sha256}},
+        "variables": {"a": 1},
+    }
+
+    # The server forgot the query
+    known.clear()
+    payloads.clear()
+    result = await transport.execute(op.document)
+    assert result.data == {"org": {"uuid": "x"}}
+    assert ["query" in payload for payload in payloads] == [False, True]
+    await transport.close()
+
+
+async def test_unregistered_document() -> None:
+    payloads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payloads.append(json.loads(request.content))
+        return httpx.Response(200, json={"data": {}})
+
+    transport = FastJSONTransport(
+        url="http://mo/graphql",
+        client_cls=httpx.AsyncClient,
+        client_args={"transport": httpx.MockTransport(handler)},
+        persisted_queries=True,
+    )
+    await transport.connect()
+    await transport.execute(gql("query { org { uuid } }"))
+    assert payloads == [{"query": "{\n  org {\n    uuid\n  }\n}"}]
+    await transport.close()
+
+
+async def test_queries_are_retried() -> None:
+    statuses = [503, 200, 503, 200]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(statuses.pop(0), json={"data": {"org": None}})
+
+    transport = FastJSONTransport(
+        url="http://mo/graphql",
+        client_cls=httpx.AsyncClient,
+        client_args={"transport": httpx.MockTransport(handler)},
+        retry_attempts=2,
+        retry_backoff=0,
+    )
+    await transport.connect()
+
+    result = await transport.execute(gql("query { org { uuid } }"))
+    assert result.data == {"org": None}
+    assert statuses == [503, 200]
+
+    # Mutations are not retried
+    await transport.execute(gql("mutation { org_unit_terminate { uuid } }"))
+    assert statuses == [200]
+    await transport.close()
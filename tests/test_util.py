@@ -1,12 +1,30 @@
 # SPDX-FileCopyrightText: 2022 Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
+import asyncio
 from unittest.mock import AsyncMock
 from unittest.mock import patch
+from uuid import UUID
+from uuid import uuid4
 
+import httpx
+import pytest
 from gql import gql  # type: ignore
+from gql.transport.exceptions import TransportQueryError  # type: ignore
 
+from sd_managerscript.cache import ReadCache
+from sd_managerscript.limiter import WriteLimiter
+from sd_managerscript.mutation_log import MutationLog
+from sd_managerscript.queries import MANAGER_TERMINATE
+from sd_managerscript.queries import QUERY_ORG_UNIT_NODES
+from sd_managerscript.queries import QUERY_ORG_UNITS
+from sd_managerscript.util import DataLoader
+from sd_managerscript.util import execute_mutator
+from sd_managerscript.util import get_loader
 from sd_managerscript.util import query_graphql
 from sd_managerscript.util import query_org_unit
+from sd_managerscript.util import query_paginated
+from sd_managerscript.util import query_scope
+from sd_managerscript.util import uuid_tags
 from tests.test_data.sample_test_data import get_org_unit_models_sample  # type: ignore
 
 QUERY_ROOT_ORG_UNIT = gql(
@@ -57,6 +75,24 @@ async def test_query_org_unit(mock_query_gql: AsyncMock) -> None:
     assert returned_org_units == expected_org_units
 
 
+@patch("sd_managerscript.util.query_graphql")
+async def test_query_paginated(mock_query_gql: AsyncMock) -> None:
+    """Test query_paginated follows the cursor until the last page"""
+    mock_query_gql.side_effect = [
+        {"org_units": {"objects": [1, 2], "page_info": {"next_cursor": "abc"}}},
+        {"org_units": {"objects": [3], "page_info": {"next_cursor": None}}},
+    ]
+    gql_client = AsyncMock()
+
+    objects = await query_paginated(gql_client, QUERY_ROOT_ORG_UNIT, {"a": 1}, 2)
+
+    assert objects == [1, 2, 3]
+    assert [c.args[2] for c in mock_query_gql.call_args_list] == [
+        {"a": 1, "limit": 2, "cursor": None},
+        {"a": 1, "limit": 2, "cursor": "abc"},
+    ]
+
+
 async def test_execute_mutator() -> None:
     gql_client = AsyncMock()
     query = MUTATOR_TERMINATE_MANAGER_BY_UUID
@@ -65,3 +101,262 @@ async def test_execute_mutator() -> None:
     await query_graphql(gql_client, query, variables)
 
     gql_client.execute.assert_called_once_with(query, variable_values=variables)
+
+
+async def test_query_scope_deduplicates_queries() -> None:
+    """Test identical queries within a scope share one request"""
+    uuid = str(uuid4())
+
+    async def execute(*args: object, **kwargs: object) -> dict:
+        await asyncio.sleep(0)
+        return {"org_units": {"objects": []}}
+
+    gql_client = AsyncMock()
+    gql_client.execute.side_effect = execute
+
+    async with query_scope() as scope:
+        results = await asyncio.gather(
+            query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": uuid}),
+            query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": uuid}),
+        )
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": uuid})
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": str(uuid4())})
+
+    assert results[0] is results[1]
+    assert gql_client.execute.await_count == 2
+    assert (scope.hits, scope.misses) == (2, 2)
+
+    # Outside the scope nothing is shared
+    await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": uuid})
+    assert gql_client.execute.await_count == 3
+
+
+async def test_query_scope_does_not_keep_failures() -> None:
+    gql_client = AsyncMock()
+    gql_client.execute.side_effect = [ValueError("MO is down"), {"org_units": {}}]
+
+    async with query_scope():
+        with pytest.raises(ValueError):
+            await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {})
+        result = await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {})
+
+    assert result == {"org_units": {}}
+
+
+async def test_query_scope_invalidated_by_mutation() -> None:
+    """Test a mutation invalidates the results of queries of the touched UUIDs"""
+    touched, untouched = str(uuid4()), str(uuid4())
+    gql_client = AsyncMock()
+    gql_client.execute.return_value = {"org_units": {"objects": []}}
+
+    async with query_scope():
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": touched})
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": untouched})
+        await execute_mutator(
+            gql_client, MUTATOR_TERMINATE_MANAGER_BY_UUID, {"input": {"uuid": touched}}
+        )
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": touched})
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": untouched})
+
+    # Two queries, one mutation and the re-query of the touched UUID
+    assert gql_client.execute.await_count == 4
+
+
+async def test_query_scope_limits_mutations() -> None:
+    gql_client = AsyncMock()
+    write_limiter = WriteLimiter(rate=1000, burst=1, concurrency=1)
+    variables = {"input": {"uuid": str(uuid4())}}
+
+    async with query_scope(write_limiter=write_limiter) as scope:
+        await asyncio.gather(
+            *(
+                execute_mutator(
+                    gql_client, MUTATOR_TERMINATE_MANAGER_BY_UUID, variables
+                )
+                for _ in range(3)
+            )
+        )
+
+    assert gql_client.execute.await_count == 3
+    assert scope.writes == write_limiter.writes == 3
+    # The mutations after the burst waited for a token
+    assert scope.write_wait > 0
+
+
+async def test_mutations_are_written_ahead() -> None:
+    mutation_log = MutationLog(":memory:")
+    logged = []
+
+    async def execute(*args: object) -> dict:
+        logged.append(mutation_log.pending())
+        return {}
+
+    gql_client = AsyncMock()
+    gql_client.execute.side_effect = execute
+    variables = {"input": {"uuid": str(uuid4())}}
+
+    async with query_scope(mutation_log=mutation_log):
+        await execute_mutator(gql_client, MANAGER_TERMINATE, variables)
+
+        # Logged while sent, and removed when answered
+        assert logged == [[(1, "MANAGER_TERMINATE", variables)]]
+        assert len(mutation_log) == 0
+
+        # Rejected mutations are removed, other failures are kept
+        gql_client.execute.side_effect = TransportQueryError("Invalid input")
+        with pytest.raises(TransportQueryError):
+            await execute_mutator(gql_client, MANAGER_TERMINATE, variables)
+        assert len(mutation_log) == 0
+        gql_client.execute.side_effect = httpx.ReadTimeout("Timeout")
+        with pytest.raises(httpx.ReadTimeout):
+            await execute_mutator(gql_client, MANAGER_TERMINATE, variables)
+        assert len(mutation_log) == 1
+
+
+async def test_mutations_are_not_deduplicated() -> None:
+    gql_client = AsyncMock()
+    variables = {"input": {"uuid": str(uuid4())}}
+
+    async with query_scope():
+        await query_graphql(gql_client, MUTATOR_TERMINATE_MANAGER_BY_UUID, variables)
+        await query_graphql(gql_client, MUTATOR_TERMINATE_MANAGER_BY_UUID, variables)
+
+    assert gql_client.execute.await_count == 2
+
+
+def test_uuid_tags() -> None:
+    uuid = uuid4()
+    other = str(uuid4()).upper()
+
+    tags = uuid_tags({"a": [uuid, {"b": other, "c": "not a uuid"}], "d": 1})
+
+    assert tags == {str(uuid), other.lower()}
+
+
+async def test_read_cache_shared_between_scopes() -> None:
+    """Test query results are read through the cross-run read cache"""
+    touched, untouched = str(uuid4()), str(uuid4())
+    gql_client = AsyncMock()
+    gql_client.execute.return_value = {"org_units": {"objects": []}}
+    read_cache = ReadCache(100, 60)
+
+    async with query_scope(read_cache):
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": touched})
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": untouched})
+    assert gql_client.execute.await_count == 2
+
+    # Next run is served by the cache, until a mutation touches a UUID
+    async with query_scope(read_cache):
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": touched})
+        await execute_mutator(
+            gql_client, MUTATOR_TERMINATE_MANAGER_BY_UUID, {"input": {"uuid": touched}}
+        )
+    assert gql_client.execute.await_count == 3
+
+    async with query_scope(read_cache):
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": touched})
+        await query_graphql(gql_client, QUERY_ROOT_ORG_UNIT, {"uuids": untouched})
+    assert gql_client.execute.await_count == 4
+
+
+async def test_read_cache_ttl_by_operation() -> None:
+    """Test TTLs are looked up by the registered name, not the root field"""
+    gql_client = AsyncMock()
+    gql_client.execute.return_value = {"org_units": {"objects": []}}
+    read_cache = ReadCache(100, 60, {"QUERY_ORG_UNIT_NODES": 0})
+    variables = {"uuids": [str(uuid4())]}
+
+    for _ in range(2):
+        async with query_scope(read_cache):
+            await query_graphql(gql_client, QUERY_ORG_UNITS, variables)
+            await query_graphql(gql_client, QUERY_ORG_UNIT_NODES, variables)
+
+    # Both operations query "org_units", but only QUERY_ORG_UNITS is cached
+    assert gql_client.execute.await_count == 3
+
+
+async def test_data_loader_batches_concurrent_loads() -> None:
+    calls = []
+
+    async def batch_load(keys: list[int]) -> dict[int, object]:
+        calls.append(keys)
+        return {key: ValueError(key) if key == 3 else key * 10 for key in keys}
+
+    loader: DataLoader[int, object] = DataLoader(batch_load, max_batch_size=2)
+
+    results = await asyncio.gather(
+        *(loader.load(key) for key in [1, 2, 1, 3, 4]), return_exceptions=True
+    )
+
+    # Deduplicated and chunked
+    assert calls == [[1, 2], [3, 4]]
+    assert results[:3] == [10, 20, 10]
+    # The error of a key only fails that key
+    assert isinstance(results[3], ValueError)
+    assert results[4] == 40
+
+    # A new batch in the next tick
+    assert await asyncio.gather(loader.load(5), loader.load(6)) == [50, 60]
+    assert loader.batches == 3
+
+
+async def test_data_loader_errors_and_defaults() -> None:
+    batch_load = AsyncMock(return_value={})
+    loader: DataLoader[int, list] = DataLoader(batch_load, default=[])
+    assert await loader.load(1) == []
+
+    batch_load.side_effect = RuntimeError("MO is down")
+    results = await asyncio.gather(
+        loader.load(2), loader.load(3), return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+    batch_load.assert_awaited_with([2, 3])
+
+    # Failed keys are loaded again
+    batch_load.side_effect = None
+    assert await loader.load(2) == []
+    batch_load.assert_awaited_with([2])
+
+
+async def test_data_loader_reuses_and_invalidates_keys() -> None:
+    key1, key2, key3, value_uuid = uuid4(), uuid4(), uuid4(), uuid4()
+    batch_load = AsyncMock(
+        side_effect=lambda keys: {key: [str(value_uuid)] for key in keys}
+    )
+    loader: DataLoader[UUID, list] = DataLoader(batch_load)
+
+    await asyncio.gather(loader.load(key1), loader.load(key2))
+    # Already loaded keys are not part of later batches
+    await asyncio.gather(loader.load(key1), loader.load(key3))
+    batch_load.assert_awaited_with([key3])
+    assert loader.hits == 1
+
+    # Keys are invalidated by the UUIDs of both the key and the value
+    loader.invalidate({str(key2)})
+    await asyncio.gather(loader.load(key1), loader.load(key2))
+    batch_load.assert_awaited_with([key2])
+    loader.invalidate({str(value_uuid)})
+    await asyncio.gather(loader.load(key1), loader.load(key3))
+    batch_load.assert_awaited_with([key1, key3])
+
+
+async def test_query_scope_invalidates_loaders() -> None:
+    org_unit_uuid = uuid4()
+    batch_load = AsyncMock(side_effect=lambda keys: {key: [] for key in keys})
+    async with query_scope() as scope:
+        loader = get_loader("test", lambda: DataLoader(batch_load))
+        await loader.load(org_unit_uuid)
+        scope.invalidate({str(org_unit_uuid)})
+        await loader.load(org_unit_uuid)
+    assert batch_load.await_count == 2
+
+
+async def test_get_loader() -> None:
+    def factory() -> DataLoader:
+        return DataLoader(AsyncMock(return_value={}))
+
+    assert get_loader("test", factory) is not get_loader("test", factory)
+    async with query_scope():
+        loader = get_loader("test", factory)
+        assert get_loader("test", factory) is loader
+        assert get_loader("other", factory) is not loader